@@ -0,0 +1,47 @@
+import re
+
+# Which accessions an LDA file is in, from patterns in its Virtual Location
+# (it is in the first rule's that matches) and File Path (it is in all of
+# the ones that match).
+LOCATION_RULES = [
+    (r'lakeland\.umd\.edu/asa', "ASA"),
+    (r'lakeland\.umd\.edu', "Lakeland Omeka Instance Images"),
+]
+PATH_RULES = [
+    (r'Mary Sies Hard Drive', "Mary Sies Hard Drive: Images"),
+    (r'Maxine (?:Gross )?Hard Drive', "Maxine Gross Hard Drive: Images"),
+    (r'College Park Photos', "College Park Photos"),
+    (r'LCHP Accession 2021', "LCHP Accession 2021"),
+]
+
+
+def compile_rules(rules):
+    """
+    Compile (pattern, accession) rules into one regular expression, with a
+    group for each rule, so a string is only scanned once.
+    """
+    return re.compile('|'.join('(?P<r{}>{})'.format(n, pattern) for n, (pattern, accession) in enumerate(rules)))
+
+
+location_rules = compile_rules(LOCATION_RULES)
+path_rules = compile_rules(PATH_RULES)
+
+
+def match_rules(compiled, rules, s, first=False):
+    """
+    Get the accessions of the rules that match a string, in rule order, or
+    only the first of them.
+    """
+    matched = sorted({int(m.lastgroup[1:]) for m in compiled.finditer(s)})
+    if first:
+        matched = matched[:1]
+    return [rules[n][1] for n in matched]
+
+
+def match_accessions(location, paths):
+    """
+    Get the descriptions of the accessions for a Virtual Location and File
+    Path (either can be empty).
+    """
+    return (match_rules(location_rules, LOCATION_RULES, location or '', first=True)
+            + match_rules(path_rules, PATH_RULES, paths or ''))
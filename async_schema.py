@@ -0,0 +1,415 @@
+import os
+import time
+import random
+import asyncio
+import aiohttp
+
+from urllib.parse import quote
+from metrics import metrics
+from schema import Base, Table, chunks, index_key, modified_since, IDEMPOTENT_METHODS
+
+
+class AsyncBase(Base):
+    """
+    A Base that talks to Airtable with asyncio (using aiohttp) instead of
+    blocking requests, so that Airtable reads and writes can be overlapped
+    with each other and with other work on the same event loop. It has to
+    be loaded before it is used:
+
+        lak = await AsyncBase.open('appqn0kIOXRo00kdN', key, schema)
+        people = await asyncio.gather(*[
+            lak.tables['People'].get_or_insert(p) for p in names
+        ])
+        await lak.close()
+
+    The tables are AsyncTables, which work like Tables except that the
+    methods that talk to Airtable are coroutines. Requests go through one
+    connection pool (pass session to share it between bases) and an
+    AsyncScheduler that keeps them under the base's rate limit. Writes are
+    sent as they are made, so buffered and streamed tables aren't
+    supported; use insert_many() and update_many() to batch them.
+    """
+
+    def __init__(self, base_id, api_key, schema, session=None, **kwargs):
+        if kwargs.get('buffered') or kwargs.get('stream'):
+            raise ValueError('AsyncBase does not support buffered or streamed tables')
+        super().__init__(base_id, api_key, schema, fetch=False, **kwargs)
+        self.session = session
+        self.own_session = session is None
+
+    def make_scheduler(self):
+        return get_async_scheduler(self.id)
+
+    @classmethod
+    async def open(cls, *args, **kwargs):
+        base = cls(*args, **kwargs)
+        await base.load()
+        return base
+
+    async def load(self):
+        """
+        Fetch all the tables at the same time, paging through each of them,
+        and link them once they have all arrived. Snapshots are used and
+        saved the same way as Base.load().
+        """
+        if self.session is None:
+            self.session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit_per_host=self.scheduler.concurrency))
+
+        snapshot = None
+        if self.snapshot_dir and not self.refresh:
+            snapshot = self.read_snapshot()
+        if not snapshot:
+            self.fetched = time.time()
+        self.unsaved = False
+
+        self.tables = {
+            table_name: AsyncTable(self, table_name, relations)
+            for table_name, relations in self.schema.items()
+        }
+        await asyncio.gather(*[
+            table.load(snapshot[table.table_name] if snapshot else None)
+            for table in self.tables.values()
+        ])
+
+        if self.snapshot_dir and not snapshot:
+            self.save_snapshot()
+
+        for table in self.tables.values():
+            table.link()
+
+    async def refresh_since(self, since):
+        """
+        Fetch the records modified since a time in all the tables at once,
+        as Base.refresh_since() does.
+        """
+        since = min(since, self.fetched)
+        fetched = time.time()
+        changed = await asyncio.gather(*[table.load_modified(since) for table in self.tables.values()])
+        return self.refreshed(dict(zip(self.tables, changed)), fetched)
+
+    async def wipe(self):
+        """
+        Empty all the tables but leave the schema intact.
+        """
+        # safety to only ever wipe this airtable base
+        assert self.id == 'appqn0kIOXRo00kdN'
+
+        await asyncio.gather(*[table.wipe() for table in self.tables.values()])
+
+    async def close(self):
+        if self.own_session and self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    def flush(self):
+        pass
+
+
+class AsyncTable(Table):
+    """
+    A Table whose Airtable calls (load, load_modified, insert, update,
+    get_or_insert, upsert, wipe) are coroutines. Looking records up with get() and find() is
+    done in memory, as it is for a Table.
+    """
+
+    def __init__(self, base, table_name, relations):
+        super().__init__(base, table_name, relations, fetch=False)
+        # get_or_insert() calls that are inserting, so that callers looking
+        # for the same record at the same time wait for it instead
+        self.inserting = {}
+
+    def make_client(self):
+        return AsyncClient(self.base, self.table_name)
+
+    async def load(self, data=None):
+        if data is None:
+            data = await self.airtable.get_all(**self.options())
+        super().load(data)
+
+    async def load_modified(self, since):
+        rows = await self.airtable.get_all(formula=modified_since(since), **self.options())
+        return self.merge_modified(rows)
+
+    async def wipe(self):
+        """
+        Remove all rows from the table.
+        """
+        await self.load()
+        await self.airtable.batch_delete([row['id'] for row in self.data])
+        self.data = []
+        self.ids = {}
+        self.indexes = {}
+
+    async def insert(self, row):
+        result = self.add_fetched(await self.airtable.insert(row))
+        self.index_row(result)
+        return result
+
+    async def insert_many(self, rows):
+        """
+        Insert rows 10 at a time, sending the batches concurrently. Returns
+        the new records in the same order.
+        """
+        results = []
+        for result in await self.airtable.batch_insert(rows):
+            result = self.add_fetched(result)
+            self.index_row(result)
+            results.append(result)
+        return results
+
+    async def update(self, id, row):
+        result = await self.airtable.update(id, row)
+        self.apply_update(id, result['fields'])
+        return result
+
+    async def update_many(self, updates):
+        """
+        Update a dictionary of record id to fields, 10 records at a time.
+        """
+        records = [{'id': id, 'fields': row} for id, row in updates.items()]
+        results = await self.airtable.batch_update(records)
+        for result in results:
+            self.apply_update(result['id'], result['fields'])
+        return results
+
+    async def get_or_insert(self, fields, extra=None):
+        """
+        Get or insert and get the first record that matches the fields, as
+        Table.get_or_insert() does. If another call is already inserting the
+        same record this one waits for it rather than inserting it again.
+        """
+        r = self.find(fields, first=True)
+        if r:
+            return r
+
+        try:
+            keys = tuple(sorted(fields))
+            key = (keys, index_key(fields, keys))
+        except TypeError:
+            key = None
+        if key in self.inserting:
+            return await asyncio.shield(self.inserting[key])
+
+        inserted = asyncio.get_running_loop().create_future()
+        if key is not None:
+            self.inserting[key] = inserted
+        try:
+            f = fields
+            if extra:
+                f.update(extra)
+            r = await self.insert(f)
+            inserted.set_result(r)
+            return r
+        except Exception as e:
+            inserted.set_exception(e)
+            # the callers that are waiting get it, so it is never "unretrieved"
+            inserted.exception()
+            raise
+        finally:
+            self.inserting.pop(key, None)
+
+    async def upsert(self, key, fields):
+        """
+        Update the record that matches the key or insert one, as Table.upsert()
+        does.
+        """
+        r = self.find(key, first=True)
+        if not r:
+            f = dict(fields)
+            f.update(key)
+            return await self.insert(f)
+
+        changes = self.changes(r, fields)
+        if changes:
+            await self.update(r['id'], changes)
+        return r
+
+    def flush(self):
+        pass
+
+
+class AsyncClient:
+    """
+    The Airtable API calls a Table makes, as coroutines. Pagination is
+    pipelined: the next page is requested as soon as the offset for it is
+    known, while the records on the current page are being handled.
+    """
+
+    API_URL = 'https://api.airtable.com'
+    MAX_RECORDS_PER_REQUEST = 10
+
+    def __init__(self, base, table_name):
+        self.base = base
+        self.table_name = table_name
+        api_url = (base.endpoint or self.API_URL).rstrip('/')
+        self.url_table = '{}/v0/{}/{}'.format(api_url, base.id, quote(table_name, safe=''))
+
+    async def request(self, method, url, params=None, json=None):
+        with metrics.timer('airtable.' + method.lower()):
+            return await self.base.scheduler.call(
+                self.base.session, method, url,
+                params=params, json=json,
+                headers={'Authorization': 'Bearer {}'.format(self.base.api_key)}
+            )
+
+    async def pages(self, fields=None, formula=None):
+        """
+        Yield the records a page at a time.
+        """
+        params = [('fields[]', f) for f in fields or []]
+        if formula:
+            params.append(('filterByFormula', formula))
+
+        def get_page(offset):
+            page_params = params + [('offset', offset)] if offset else params
+            return asyncio.ensure_future(self.request('GET', self.url_table, params=page_params))
+
+        next_page = get_page(None)
+        while next_page is not None:
+            result = await next_page
+            offset = result.get('offset')
+            next_page = get_page(offset) if offset else None
+            yield result.get('records', [])
+
+    async def get_all(self, **options):
+        records = []
+        async for page in self.pages(**options):
+            records.extend(page)
+        return records
+
+    async def insert(self, fields):
+        return await self.request('POST', self.url_table, json={'fields': fields})
+
+    async def batch_insert(self, records):
+        results = await asyncio.gather(*[
+            self.request('POST', self.url_table, json={'records': [{'fields': r} for r in chunk]})
+            for chunk in chunks(records, self.MAX_RECORDS_PER_REQUEST)
+        ])
+        return [record for result in results for record in result['records']]
+
+    async def update(self, record_id, fields):
+        return await self.request('PATCH', '{}/{}'.format(self.url_table, record_id), json={'fields': fields})
+
+    async def batch_update(self, records):
+        results = await asyncio.gather(*[
+            self.request('PATCH', self.url_table, json={'records': chunk})
+            for chunk in chunks(records, self.MAX_RECORDS_PER_REQUEST)
+        ])
+        return [record for result in results for record in result['records']]
+
+    async def batch_delete(self, record_ids):
+        results = await asyncio.gather(*[
+            self.request('DELETE', self.url_table, params=[('records[]', id) for id in chunk])
+            for chunk in chunks(record_ids, self.MAX_RECORDS_PER_REQUEST)
+        ])
+        return [record for result in results for record in result['records']]
+
+
+class AsyncScheduler:
+    """
+    The asyncio version of schema.Scheduler: a token bucket that keeps
+    requests under the rate limit, a limit on how many are in flight at
+    once (which defaults to the rate, since Airtable requests take around a
+    second), and retries with jittered exponential backoff for 429s (at
+    least penalty seconds), server errors and dropped connections. As with
+    schema.Scheduler, requests that aren't idempotent are only retried if
+    they were throttled or couldn't connect.
+    """
+
+    def __init__(self, rate=5, burst=5, concurrency=None, retries=8, backoff=1, max_backoff=120, penalty=30):
+        self.rate = rate
+        self.burst = burst
+        self.concurrency = concurrency or max(int(rate), 1)
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.penalty = penalty
+        self.tokens = burst
+        self.updated = None
+        self.slots = None
+
+        # counters
+        self.requests = 0
+        self.retried = 0
+        self.throttled = 0
+        self.wait_time = 0.0
+        self.backoff_time = 0.0
+
+    async def acquire(self):
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        if self.updated is None:
+            self.updated = now
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        self.requests += 1
+        self.wait_time += wait
+        if wait:
+            await asyncio.sleep(wait)
+
+    async def call(self, session, method, url, **kwargs):
+        if self.slots is None:
+            self.slots = asyncio.Semaphore(self.concurrency)
+        attempt = 0
+        while True:
+            await self.acquire()
+            status = None
+            try:
+                async with self.slots, session.request(method, url, **kwargs) as resp:
+                    status = resp.status
+                    if status < 400:
+                        return await resp.json()
+                    resp.raise_for_status()
+            except (aiohttp.ClientResponseError, aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                if attempt >= self.retries or not async_retryable(e, status, method.upper() in IDEMPOTENT_METHODS):
+                    raise
+            delay = min(self.max_backoff, self.backoff * 2 ** attempt)
+            delay += random.uniform(0, delay / 2)
+            if status == 429:
+                self.throttled += 1
+                delay = max(delay, self.penalty)
+            self.retried += 1
+            self.backoff_time += delay
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    def stats(self):
+        return {
+            "requests": self.requests,
+            "retried": self.retried,
+            "throttled": self.throttled,
+            "wait_time": round(self.wait_time, 2),
+            "backoff_time": round(self.backoff_time, 2)
+        }
+
+
+def async_retryable(e, status, idempotent):
+    """
+    The aiohttp version of schema.retryable(): a request that couldn't
+    connect (ClientConnectorError) is known not to have been sent.
+    """
+    if status == 429:
+        return True
+    if status is not None and status < 500:
+        return False
+    return idempotent or isinstance(e, aiohttp.ClientConnectorError)
+
+
+async_schedulers = {}
+
+def get_async_scheduler(base_id):
+    """
+    Get the AsyncScheduler shared by everything that uses a base on the
+    running event loop. AIRTABLE_RATE raises the rate, as for get_scheduler().
+    """
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        loop = None
+    key = (base_id, id(loop))
+    if key not in async_schedulers:
+        rate = float(os.environ.get('AIRTABLE_RATE', 5))
+        async_schedulers[key] = AsyncScheduler(rate=rate, burst=max(rate, 5))
+    return async_schedulers[key]
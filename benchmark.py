@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+
+# Times the schema.Table operations the migrations lean on (load, link,
+# find, get_or_insert and insert) against synthetic bases of different
+# sizes, and runs the migrations end to end, all against fake_airtable.py
+# so nothing real is touched. The times are written to a JSON report and
+# can be compared with a baseline report to catch regressions:
+#
+#     ./benchmark.py --save-baseline
+#     ... change something ...
+#     ./benchmark.py --baseline benchmarks/baseline.json
+#
+# Sizes are the number of LDA Items, and the other tables are scaled to
+# match, so 100000 is a base of over a quarter of a million records.
+
+import os
+import sys
+import json
+import time
+import random
+import pathlib
+import argparse
+import platform
+import datetime
+import tempfile
+import subprocess
+
+os.environ.setdefault('AIRTABLE_RATE', '100000')
+
+import schema
+import fake_airtable
+
+from fake_airtable import FakeAirtable, make_fixtures, make_files, LAKELAND_SIZES, LAK_TABLES, LDA, LAK
+
+LDA_SCHEMA = {
+    "Items": {
+        "Files": "Files",
+        "Creator": "Entities",
+        "People": "Entities",
+        "Places/Organizations": "Entities",
+        "Subjects": "Subjects",
+        "Source (Provenance)": "Entities",
+    },
+    "Files": {},
+    "Subjects": {},
+    "Entities": {},
+    "Relationships": {}
+}
+
+LAK_SCHEMA = {name: {} for name in LAK_TABLES}
+
+# how many times each operation is done in a round
+OPERATIONS = 1000
+
+
+def best(repeat, func, setup=None):
+    """
+    Run func repeat times (calling setup first, untimed) and return the
+    fastest time and the last result.
+    """
+    times = []
+    result = None
+    for i in range(repeat):
+        arg = setup() if setup else None
+        start = time.perf_counter()
+        result = func(arg) if setup else func()
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+def fake_for(size, seed=0, urls=False, files=None):
+    """
+    Get a FakeAirtable with bases for size items, and write the files they
+    refer to under files if it is given.
+    """
+    fake = FakeAirtable(rate=0)
+    scale = size / LAKELAND_SIZES[LDA]['Items']
+    fixtures = make_fixtures(scale, seed, urls=urls)
+    for base_id, tables in fixtures.items():
+        for table_name, table in tables.items():
+            fake.add_table(base_id, table_name, table['records'], table.get('autonumber'))
+    if files:
+        make_files(fixtures, files, seed)
+    return fake
+
+
+def bench_tables(server, endpoint, size, repeat):
+    """
+    Time the Table operations against an LDA shaped base with size items.
+    """
+    server.fake = fake_for(size)
+    results = {}
+    rnd = random.Random(size)
+
+    results['load'], lda = best(repeat, lambda: schema.Base(LDA, 'fake', LDA_SCHEMA, endpoint=endpoint))
+
+    def unlink():
+        for table in lda.tables.values():
+            table.load([table.raw(r) for r in table.data])
+
+    def link(arg):
+        for table in lda.tables.values():
+            table.link()
+
+    results['link'], _ = best(repeat, link, unlink)
+
+    entities = lda.tables['Entities']
+    names = [rnd.choice(entities.data)['fields']['Name'] for i in range(OPERATIONS)]
+
+    def cold_index():
+        entities.indexes = {}
+
+    def find(arg):
+        for name in names:
+            entities.find({'Name': name}, first=True)
+
+    results['find'], _ = best(repeat, find, cold_index)
+
+    def empty_lak():
+        for table_name in LAK_TABLES:
+            server.fake.add_table(LAK, table_name)
+        return schema.Base(LAK, 'fake', LAK_SCHEMA, buffered=True, endpoint=endpoint)
+
+    # half of the lookups are for a person that has already been added
+    people = [{'First Name': rnd.choice(fake_airtable.FIRST_NAMES), 'Last Name': str(rnd.randrange(OPERATIONS // 2))}
+              for i in range(OPERATIONS)]
+
+    def get_or_insert(lak):
+        for person in people:
+            lak.tables['People'].get_or_insert(person)
+        lak.flush()
+
+    results['get_or_insert'], _ = best(repeat, get_or_insert, empty_lak)
+
+    def insert(lak):
+        for i in range(OPERATIONS):
+            lak.tables['Items'].insert({'Title': 'Item {}'.format(i), 'Legacy UMD ID': 'umd:{}'.format(i)})
+        lak.flush()
+
+    results['insert'], _ = best(repeat, insert, empty_lak)
+
+    return results
+
+
+def bench_migrations(server, endpoint, media_proxy, size, log_dir):
+    """
+    Run migrate_ldt.py and then migrate_lda.py against generated bases in a
+    scratch directory, with the source files they refer to written there
+    (and the ones at URLs served by the media server behind media_proxy),
+    so the files are ingested, downloaded and stored as well. Their run
+    reports are checked to make sure that they were.
+    """
+    results = {}
+    scripts = pathlib.Path(__file__).resolve().parent
+
+    with tempfile.TemporaryDirectory() as cwd:
+        server.fake = fake_for(size, urls=True, files=cwd)
+        media_proxy.root = pathlib.Path(cwd)
+        env = dict(
+            os.environ,
+            AIRTABLE_ENDPOINT=endpoint,
+            AIRTABLE_KEY='fake',
+            HTTP_PROXY='http://localhost:{}'.format(media_proxy.server_port),
+            HTTPS_PROXY='http://localhost:{}'.format(media_proxy.server_port),
+            NO_PROXY='localhost,127.0.0.1',
+            REQUESTS_CA_BUNDLE=str(media_proxy.certificate),
+            ASA_PASSWORD='fake',
+            LDA_DRIVE=str(pathlib.Path(cwd) / 'lda-drive'),
+            LAKELAND_DATA_ROOT=str(pathlib.Path(cwd) / 'data')
+        )
+        for name in ['migrate_ldt', 'migrate_lda']:
+            log_path = log_dir / '{}-{}.log'.format(name, size)
+            start = time.perf_counter()
+            with open(log_path, 'w') as log:
+                proc = subprocess.run(
+                    [sys.executable, str(scripts / (name + '.py')), '--restart', '--refresh'],
+                    cwd=cwd, env=env, stdout=log, stderr=subprocess.STDOUT
+                )
+            if proc.returncode != 0:
+                raise RuntimeError('{} failed, see {}'.format(name, log_path))
+            results[name] = time.perf_counter() - start
+
+            report_path = max((pathlib.Path(cwd) / 'reports').glob(name + '-*.json'))
+            stats = json.loads(report_path.read_text())['stats']
+            for stat in MIGRATION_STATS[name]:
+                if not stats.get(stat, {}).get('count'):
+                    raise RuntimeError('{} did no {}, see {}'.format(name, stat, log_path))
+
+    return results
+
+
+# what each migration has to have done for its time to mean anything
+MIGRATION_STATS = {
+    'migrate_ldt': ['ingest'],
+    'migrate_lda': ['download', 'ingest'],
+}
+
+
+def compare(report, baseline, threshold, floor=0.01):
+    """
+    Print each time next to the baseline's and return the names of the
+    ones that are more than threshold (a fraction) slower. Differences
+    under floor seconds are ignored as noise.
+    """
+    regressions = []
+    for name, seconds in sorted(report['results'].items()):
+        old = baseline['results'].get(name)
+        if old is None:
+            print('{:40} {:10.3f}s'.format(name, seconds))
+            continue
+        change = (seconds - old) / old if old else 0
+        slower = change > threshold and seconds - old > floor
+        print('{:40} {:10.3f}s {:10.3f}s {:+8.1%}{}'.format(name, seconds, old, change, '  REGRESSION' if slower else ''))
+        if slower:
+            regressions.append(name)
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark the schema.Table operations and the migrations.')
+    parser.add_argument('--size', type=int, action='append', help='number of items in a synthetic base (can be repeated, default 1000, 10000 and 100000)')
+    parser.add_argument('--migration-size', type=int, action='append', help='number of items to run the migrations with (can be repeated, default 1000, 0 to skip)')
+    parser.add_argument('--repeat', type=int, default=3, help='times to repeat each operation (the fastest is reported)')
+    parser.add_argument('--port', type=int, default=8778, help='port for the fake Airtable server')
+    parser.add_argument('--media-port', type=int, default=8779, help='port for the server that stands in for the hosts of files at URLs')
+    parser.add_argument('--report', default='benchmarks/report.json', help='where to write the report')
+    parser.add_argument('--baseline', help='a report to compare with')
+    parser.add_argument('--threshold', type=float, default=0.25, help='fraction slower than the baseline that counts as a regression')
+    parser.add_argument('--save-baseline', action='store_true', help='also save the report as benchmarks/baseline.json')
+    args = parser.parse_args()
+
+    report_path = pathlib.Path(args.report)
+    report_path.parent.mkdir(parents=True, exist_ok=True)
+
+    server = fake_airtable.serve(FakeAirtable(rate=0), port=args.port)
+    endpoint = 'http://localhost:{}'.format(args.port)
+    media_dir = tempfile.TemporaryDirectory()
+    media_proxy = fake_airtable.serve_media(media_dir.name, port=args.media_port)
+
+    results = {}
+    for size in args.size or [1000, 10000, 100000]:
+        for op, seconds in bench_tables(server, endpoint, size, args.repeat).items():
+            results['table/{}/{}'.format(size, op)] = seconds
+            print('table/{}/{}: {:.3f}s'.format(size, op, seconds))
+
+    for size in args.migration_size or [1000]:
+        if not size:
+            continue
+        for name, seconds in bench_migrations(server, endpoint, media_proxy, size, report_path.parent).items():
+            results['migration/{}/{}'.format(size, name)] = seconds
+            print('migration/{}/{}: {:.3f}s'.format(size, name, seconds))
+
+    server.shutdown()
+    media_proxy.shutdown()
+    media_dir.cleanup()
+
+    report = {
+        'created': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'repeat': args.repeat,
+        'results': results
+    }
+    with open(report_path, 'w') as fh:
+        json.dump(report, fh, indent=2)
+    if args.save_baseline:
+        with open(report_path.parent / 'baseline.json', 'w') as fh:
+            json.dump(report, fh, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as fh:
+            baseline = json.load(fh)
+        regressions = compare(report, baseline, args.threshold)
+        if regressions:
+            print('benchmark: {} regressions'.format(len(regressions)))
+            sys.exit(1)
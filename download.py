@@ -0,0 +1,159 @@
+import time
+import random
+import pathlib
+import requests
+import threading
+
+from urllib.parse import urlparse
+from metrics import metrics
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
+
+
+class Downloader:
+    """
+    Downloads URLs into a directory. Connections are pooled with one
+    requests.Session per host, and no more than per_host downloads run
+    against a host at once. A download is written to <name>.part first,
+    so if it fails part way through it is resumed with an HTTP Range
+    request when it is retried (with jittered exponential backoff).
+
+    The ETag (or Last-Modified) of a download is kept in <name>.part.validator
+    and sent with If-Range when it is resumed, so that if the file has
+    changed since, the server sends all of it again instead of the rest.
+    """
+
+    def __init__(self, dest='tmp', chunk_size=1024 * 1024, per_host=2, workers=8,
+                 retries=5, backoff=2, timeout=60):
+        self.dest = pathlib.Path(dest)
+        self.chunk_size = chunk_size
+        self.per_host = per_host
+        self.workers = workers
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.sessions = {}
+        self.limits = {}
+        self.lock = threading.Lock()
+
+    def session(self, host):
+        """
+        Get the session and semaphore for a host.
+        """
+        with self.lock:
+            if host not in self.sessions:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.per_host)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                self.sessions[host] = session
+                self.limits[host] = threading.Semaphore(self.per_host)
+            return self.sessions[host], self.limits[host]
+
+    def fetch(self, url, filename, auth=None):
+        """
+        Download a URL to filename in the destination directory, resuming
+        any partial download that is already there. Returns the path.
+        """
+        self.dest.mkdir(parents=True, exist_ok=True)
+        path = self.dest / filename
+        part = path.with_name(path.name + '.part')
+        session, limit = self.session(urlparse(url).netloc)
+
+        attempt = 0
+        while True:
+            try:
+                with limit, metrics.timer('download') as t:
+                    if self.get(session, url, part, auth):
+                        part.replace(path)
+                        validator_path(part).unlink(missing_ok=True)
+                        t.size = path.stat().st_size
+                        return path
+                # the partial download was thrown away, so start again now
+                continue
+            except (requests.exceptions.ConnectionError,
+                    requests.exceptions.Timeout,
+                    requests.exceptions.ChunkedEncodingError,
+                    requests.exceptions.HTTPError) as e:
+                response = getattr(e, 'response', None)
+                status = response.status_code if response is not None else None
+                if attempt >= self.retries or (status is not None and status != 429 and status < 500):
+                    raise
+            attempt += 1
+            delay = self.backoff * 2 ** attempt
+            time.sleep(delay + random.uniform(0, delay / 2))
+
+    def get(self, session, url, part, auth):
+        """
+        Make one attempt at downloading the rest of a URL into part. Returns
+        True if it was downloaded completely.
+        """
+        offset = part.stat().st_size if part.is_file() else 0
+        validator = read_validator(part) if offset else None
+
+        # without a validator there is no telling if the part is still good
+        headers = {}
+        if validator:
+            headers = {'Range': 'bytes={}-'.format(offset), 'If-Range': validator}
+        else:
+            offset = 0
+
+        with session.get(url, stream=True, auth=auth, headers=headers, timeout=self.timeout) as r:
+
+            # the partial file is no good, so start again
+            if r.status_code == 416:
+                part.unlink()
+                validator_path(part).unlink(missing_ok=True)
+                return False
+
+            r.raise_for_status()
+
+            # the file has changed, or the server doesn't support ranges, and
+            # it is sending everything
+            if offset and r.status_code != 206:
+                offset = 0
+
+            if not offset:
+                save_validator(part, r)
+
+            expected = r.headers.get('Content-Length')
+            written = 0
+            with open(part, 'ab' if offset else 'wb') as fh:
+                for chunk in r.iter_content(chunk_size=self.chunk_size):
+                    fh.write(chunk)
+                    written += len(chunk)
+
+        # a short read is resumed on the next attempt
+        if expected is not None and r.headers.get('Content-Encoding') is None and written < int(expected):
+            raise requests.exceptions.ChunkedEncodingError('incomplete download of {}'.format(url))
+
+        return True
+
+    def fetch_all(self, downloads):
+        """
+        Download a list of (url, filename, auth) tuples in parallel and
+        return their paths in the same order.
+        """
+        with ThreadPoolExecutor(self.workers) as pool:
+            return list(pool.map(lambda d: self.fetch(*d), downloads))
+
+
+def validator_path(part):
+    return part.with_name(part.name + '.validator')
+
+def read_validator(part):
+    path = validator_path(part)
+    return path.read_text() if path.is_file() else None
+
+def save_validator(part, r):
+    """
+    Save what identifies the version of a file that is being downloaded: its
+    ETag (If-Range can't use a weak one) or else its Last-Modified date.
+    """
+    etag = r.headers.get('ETag')
+    validator = etag if etag and not etag.startswith('W/') else r.headers.get('Last-Modified')
+    path = validator_path(part)
+    if validator:
+        path.write_text(validator)
+    else:
+        path.unlink(missing_ok=True)
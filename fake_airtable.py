@@ -0,0 +1,697 @@
+#!/usr/bin/env python3
+
+# A local stand-in for the parts of the Airtable REST API that schema.Base
+# uses (listing with pagination, create, update and delete, one record or
+# a batch at a time) so the migrations can be timed and tried out without
+# using up quota or touching the real bases. Point Base at it with the
+# AIRTABLE_ENDPOINT environment variable:
+#
+#     ./fake_airtable.py --generate 1.0 --latency 0.2
+#     AIRTABLE_ENDPOINT=http://localhost:8777 ./migrate_ldt.py
+#
+# Requests over the rate limit get a 429, just like the real thing, and
+# --throttle makes a fraction of the other requests get one too.
+#
+# --files writes the source files the generated bases refer to into a
+# directory, and serves the ones that LDA has as urls through a proxy, so
+# that the migrations ingest, download and store them too. The urls are
+# https, so the proxy answers for their hosts with a self-signed
+# certificate (made with the openssl command) written to the directory:
+#
+#     ./fake_airtable.py --generate 0.1 --files /tmp/lakeland
+#     cd /tmp/lakeland
+#     export AIRTABLE_ENDPOINT=http://localhost:8777 NO_PROXY=localhost
+#     export HTTP_PROXY=http://localhost:8779 HTTPS_PROXY=http://localhost:8779 REQUESTS_CA_BUNDLE=/tmp/lakeland/media/proxy.crt
+#     export LDA_DRIVE=/tmp/lakeland/lda-drive LAKELAND_DATA_ROOT=/tmp/lakeland/data
+#     ~/lakeland-data-munging/migrate_ldt.py && ~/lakeland-data-munging/migrate_lda.py
+
+import re
+import os
+import ssl
+import json
+import time
+import gzip
+import random
+import string
+import pathlib
+import argparse
+import datetime
+import threading
+import subprocess
+import collections
+
+from urllib.parse import urlparse, parse_qs, unquote
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+PAGE_SIZE = 100
+MAX_RECORDS_PER_REQUEST = 10
+
+
+class FakeAirtable:
+    """
+    The bases, tables and records the server holds, and how it behaves: a
+    latency (plus up to jitter more) for every request, a rate limit of
+    requests per second for each base, and a throttle fraction of requests
+    that get a 429 anyway.
+
+    Tables have to exist before records can be added to them, as with
+    Airtable. A table can have an autonumber field, which is set on the
+    records that are created in it.
+    """
+
+    def __init__(self, latency=0, jitter=0, rate=5, throttle=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate = rate
+        self.throttle = throttle
+        self.bases = {}
+        self.requests = collections.defaultdict(collections.deque)
+        self.lock = threading.Lock()
+
+    def add_table(self, base_id, table_name, records=(), autonumber=None):
+        table = {'records': collections.OrderedDict(), 'order': None, 'autonumber': autonumber, 'next': 1}
+        self.bases.setdefault(base_id, {})[table_name] = table
+        for r in records:
+            self.create(table, r['fields'], r.get('id'), r.get('createdTime'))
+
+    def load(self, path):
+        """
+        Add the bases in a fixtures file (see make_fixtures).
+        """
+        with gzip.open(path, 'rt') if str(path).endswith('.gz') else open(path) as fh:
+            fixtures = json.load(fh)
+        for base_id, tables in fixtures.items():
+            for table_name, table in tables.items():
+                self.add_table(base_id, table_name, table['records'], table.get('autonumber'))
+
+    def table(self, base_id, table_name):
+        return self.bases.get(base_id, {}).get(table_name)
+
+    def allow(self, base_id):
+        """
+        Is a request to a base under the rate limit?
+        """
+        if self.throttle and random.random() < self.throttle:
+            return False
+        if not self.rate:
+            return True
+        with self.lock:
+            now = time.time()
+            recent = self.requests[base_id]
+            while recent and recent[0] <= now - 1:
+                recent.popleft()
+            if len(recent) >= self.rate:
+                return False
+            recent.append(now)
+            return True
+
+    def delay(self):
+        if self.latency or self.jitter:
+            time.sleep(self.latency + random.uniform(0, self.jitter))
+
+    def create(self, table, fields, record_id=None, created=None):
+        record_id = record_id or new_id()
+        fields = stored(fields)
+        if table['autonumber']:
+            fields[table['autonumber']] = table['next']
+        table['next'] += 1
+        record = {'id': record_id, 'fields': fields, 'createdTime': created or now_iso()}
+        table['records'][record_id] = {'record': record, 'modified': time.time()}
+        table['order'] = None
+        return record
+
+    def update(self, table, record_id, fields, replace=False):
+        entry = table['records'].get(record_id)
+        if entry is None:
+            return None
+        record = entry['record']
+        if replace:
+            keep = {k: v for k, v in record['fields'].items() if k == table['autonumber']}
+            record['fields'] = keep
+        record['fields'].update(fields)
+        record['fields'] = stored(record['fields'])
+        entry['modified'] = time.time()
+        return record
+
+    def delete(self, table, record_id):
+        if table['records'].pop(record_id, None) is None:
+            return None
+        table['order'] = None
+        return {'id': record_id, 'deleted': True}
+
+    def list(self, table, params):
+        """
+        Get a page of records and the offset of the next page, if there is one.
+        """
+        # the records are only listed again after they change, so that
+        # paging through a big table doesn't copy it for every page
+        if table['order'] is None:
+            table['order'] = list(table['records'].values())
+        entries = table['order']
+
+        formula = first(params, 'filterByFormula')
+        if formula:
+            test = parse_formula(formula)
+            if test is None:
+                raise ApiError(422, 'INVALID_FILTER_BY_FORMULA', 'unsupported formula: {}'.format(formula))
+            entries = [e for e in entries if test(e)]
+
+        max_records = first(params, 'maxRecords')
+        if max_records:
+            entries = entries[:int(max_records)]
+
+        page_size = min(int(first(params, 'pageSize') or PAGE_SIZE), PAGE_SIZE)
+        start = int(first(params, 'offset') or 0)
+        page = [e['record'] for e in entries[start:start + page_size]]
+
+        fields = params.get('fields[]') or params.get('fields')
+        if fields:
+            page = [dict(r, fields={k: v for k, v in r['fields'].items() if k in fields}) for r in page]
+
+        result = {'records': page}
+        if start + page_size < len(entries):
+            result['offset'] = str(start + page_size)
+        return result
+
+
+class ApiError(Exception):
+
+    def __init__(self, status, error_type, message):
+        super().__init__(message)
+        self.status = status
+        self.error_type = error_type
+        self.message = message
+
+
+class Handler(BaseHTTPRequestHandler):
+    """
+    Turns requests to /v0/<base>/<table>[/<record>] into calls on the
+    server's FakeAirtable.
+    """
+
+    protocol_version = 'HTTP/1.1'
+
+    # otherwise every response waits on a delayed ACK
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        self.handle_api('GET')
+
+    def do_POST(self):
+        self.handle_api('POST')
+
+    def do_PATCH(self):
+        self.handle_api('PATCH')
+
+    def do_PUT(self):
+        self.handle_api('PUT')
+
+    def do_DELETE(self):
+        self.handle_api('DELETE')
+
+    def handle_api(self, method):
+        fake = self.server.fake
+        body = self.read_body()
+        try:
+            if not self.headers.get('Authorization', '').startswith('Bearer '):
+                raise ApiError(401, 'AUTHENTICATION_REQUIRED', 'Authentication required')
+
+            url = urlparse(self.path)
+            parts = [unquote(p) for p in url.path.strip('/').split('/')]
+            if len(parts) not in (3, 4) or parts[0] != 'v0':
+                raise ApiError(404, 'NOT_FOUND', 'Could not find what you are looking for')
+            base_id, table_name = parts[1], parts[2]
+            record_id = parts[3] if len(parts) == 4 else None
+
+            fake.delay()
+            if not fake.allow(base_id):
+                raise ApiError(429, 'RATE_LIMIT_REACHED', 'Rate limit exceeded. Please try again later')
+
+            table = fake.table(base_id, table_name)
+            if table is None:
+                raise ApiError(404, 'TABLE_NOT_FOUND', 'Could not find table {} in base {}'.format(table_name, base_id))
+
+            with fake.lock:
+                result = self.dispatch(fake, table, method, record_id, parse_qs(url.query), body)
+            self.send_json(200, result)
+
+        except ApiError as e:
+            self.send_json(e.status, {'error': {'type': e.error_type, 'message': e.message}})
+
+    def dispatch(self, fake, table, method, record_id, params, body):
+        if record_id:
+            if method == 'GET':
+                result = table['records'].get(record_id, {}).get('record')
+            elif method in ('PATCH', 'PUT'):
+                result = fake.update(table, record_id, body.get('fields', {}), replace=method == 'PUT')
+            elif method == 'DELETE':
+                result = fake.delete(table, record_id)
+            else:
+                raise ApiError(404, 'NOT_FOUND', 'Could not find what you are looking for')
+            if result is None:
+                raise ApiError(404, 'NOT_FOUND', 'Could not find record {}'.format(record_id))
+            return result
+
+        if method == 'GET':
+            return fake.list(table, params)
+
+        if method == 'DELETE':
+            ids = params.get('records[]') or params.get('records') or []
+            check_batch(ids)
+            results = [fake.delete(table, i) for i in ids]
+            if None in results:
+                raise ApiError(404, 'NOT_FOUND', 'Could not find a record to delete')
+            return {'records': results}
+
+        if method == 'POST':
+            if 'records' not in body:
+                return fake.create(table, body.get('fields', {}))
+            check_batch(body['records'])
+            return {'records': [fake.create(table, r.get('fields', {})) for r in body['records']]}
+
+        if method in ('PATCH', 'PUT'):
+            check_batch(body.get('records', []))
+            results = [fake.update(table, r['id'], r.get('fields', {}), replace=method == 'PUT') for r in body.get('records', [])]
+            if None in results:
+                raise ApiError(404, 'NOT_FOUND', 'Could not find a record to update')
+            return {'records': results}
+
+        raise ApiError(404, 'NOT_FOUND', 'Could not find what you are looking for')
+
+    def read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        if not length:
+            return {}
+        try:
+            return json.loads(self.rfile.read(length))
+        except ValueError:
+            return {}
+
+    def send_json(self, status, obj):
+        body = json.dumps(obj).encode('utf8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+def serve(fake, host='localhost', port=8777, verbose=False):
+    """
+    Start a server for a FakeAirtable in a background thread and return it.
+    Its endpoint is http://<host>:<port>, and server.shutdown() stops it.
+    """
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    server.fake = fake
+    server.verbose = verbose
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class MediaHandler(BaseHTTPRequestHandler):
+    """
+    Serves the files under the server's root as media/<host>/<path>. It is
+    meant to be used as an HTTP proxy, so requests for the real hosts in
+    LDA's Virtual Locations are answered with the files make_files() wrote.
+    https urls are tunnelled with CONNECT, which is answered with the
+    server's own certificate when it has one.
+    """
+
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_CONNECT(self):
+        if self.server.context is None:
+            self.send_error(501, 'no certificate to answer https with')
+            return
+        self.send_response(200, 'Connection Established')
+        self.end_headers()
+        # the rest of the requests on the connection come through the tunnel
+        self.request = self.server.context.wrap_socket(self.request, server_side=True)
+        self.setup()
+        self.close_connection = False
+
+    def finish(self):
+        super().finish()
+        if isinstance(self.request, ssl.SSLSocket):
+            self.request.close()
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        host = url.netloc or self.headers.get('Host', '').split(':')[0]
+        path = self.server.root / 'media' / host / unquote(url.path).lstrip('/')
+        if not path.is_file() or '..' in path.parts:
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        body = path.read_bytes()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+def make_certificate(path, hosts):
+    """
+    Write a self-signed certificate for hosts to path (and its key next to
+    it, with a .key suffix) with the openssl command, and return an
+    ssl.SSLContext that serves it, or None if there is no openssl.
+    """
+    path = pathlib.Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    key = path.with_suffix('.key')
+    try:
+        subprocess.run([
+            'openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '30',
+            '-keyout', str(key), '-out', str(path), '-subj', '/CN=fake_airtable',
+            '-addext', 'subjectAltName=' + ','.join('DNS:' + h for h in hosts)
+        ], check=True, capture_output=True)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(str(path), str(key))
+    return context
+
+
+def serve_media(root, host='localhost', port=8779, verbose=False):
+    """
+    Start a MediaHandler server for the files under root in a background
+    thread and return it. Set HTTP_PROXY and HTTPS_PROXY to
+    http://<host>:<port> to use it, and REQUESTS_CA_BUNDLE to its
+    certificate, which is written to server.certificate (under root).
+    """
+    server = ThreadingHTTPServer((host, port), MediaHandler)
+    server.daemon_threads = True
+    server.root = pathlib.Path(root)
+    server.verbose = verbose
+    server.certificate = server.root / 'media' / 'proxy.crt'
+    server.context = make_certificate(server.certificate, MEDIA_HOSTS)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def check_batch(records):
+    if len(records) > MAX_RECORDS_PER_REQUEST:
+        raise ApiError(422, 'INVALID_RECORDS', 'You can only send up to {} records at a time'.format(MAX_RECORDS_PER_REQUEST))
+
+
+def first(params, name):
+    values = params.get(name)
+    return values[0] if values else None
+
+
+def stored(fields):
+    """
+    Airtable leaves empty values out of the records it returns.
+    """
+    return {k: v for k, v in fields.items() if v is not None and v is not False and v != '' and v != []}
+
+
+def parse_formula(formula):
+    """
+    Get a test for the filter formulas the migrations use, or None if the
+    formula isn't one of them.
+    """
+    m = re.match(r"^IS_AFTER\(LAST_MODIFIED_TIME\(\), DATETIME_PARSE\('(.+)'\)\)$", formula.strip())
+    if m:
+        since = datetime.datetime.strptime(m.group(1), '%Y-%m-%dT%H:%M:%SZ').replace(tzinfo=datetime.timezone.utc).timestamp()
+        return lambda entry: entry['modified'] > since
+    return None
+
+
+def new_id(prefix='rec'):
+    return prefix + ''.join(random.choice(string.ascii_letters + string.digits) for i in range(14))
+
+
+def now_iso():
+    return datetime.datetime.now(datetime.timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.000Z')
+
+
+# The bases the migrations use, and roughly how many records their tables
+# hold at a scale of 1.0.
+
+LDA = 'app9sKntqCyBwawhA'
+LDT = 'appkzHtR3oryuaKfm'
+LAK = 'appqn0kIOXRo00kdN'
+
+LAKELAND_SIZES = {
+    LDA: {'Items': 3000, 'Files': 5000, 'Subjects': 300, 'Entities': 2500, 'Relationships': 0},
+    LDT: {'Folder': 150, 'Images': 8000, 'Items': 1500, 'People': 1500, 'Subjects': 300, 'Locations': 250, 'QA': 0},
+}
+
+LAK_TABLES = ['Accessions', 'Files', 'Items', 'People', 'Places', 'Subjects', 'Organizations', 'Events', 'Families']
+
+
+def make_fixtures(scale=1.0, seed=0, urls=True):
+    """
+    Generate bases shaped like LDA and LDT, with the fields and links the
+    migrations read, and an empty Lakeland Temp base to migrate them into.
+    Unless urls is False some LDA files are only online, and migrating
+    them would download them.
+    The fixtures are a dictionary of base id to table name to a table with
+    its records (and autonumber field, if it has one).
+    """
+    rnd = random.Random(seed)
+    size = lambda base_id, table_name: int(LAKELAND_SIZES[base_id][table_name] * scale)
+
+    def rec_id():
+        return 'rec' + ''.join(rnd.choice(string.ascii_letters + string.digits) for i in range(14))
+
+    def records(fields_list):
+        return [{'id': rec_id(), 'fields': stored(f)} for f in fields_list]
+
+    def links(rows, low, high):
+        return [r['id'] for r in rnd.sample(rows, min(len(rows), rnd.randint(low, high)))]
+
+    def words(n):
+        return ' '.join(rnd.choice(WORDS) for i in range(n)).capitalize()
+
+    def person_name():
+        names = [rnd.choice(FIRST_NAMES), rnd.choice(LAST_NAMES)]
+        if rnd.random() < 0.2:
+            names.insert(1, rnd.choice(string.ascii_uppercase) + '.')
+        if rnd.random() < 0.05:
+            names.append('Jr.')
+        return ' '.join(names)
+
+    # LDA
+
+    subjects = records({
+        'Name': words(2),
+        'Subject Category': 'Event' if rnd.random() < 0.2 else 'Concept'
+    } for i in range(size(LDA, 'Subjects')))
+
+    entities = []
+    for i in range(size(LDA, 'Entities')):
+        category = rnd.choices(ENTITY_CATEGORIES, weights=[60, 5, 15, 10, 10])[0]
+        name = person_name() if category.startswith('Person') else words(3)
+        entities.extend(records([{
+            'Name': name,
+            'Entity Category': category,
+            'Source Code': 'LCHP-{:05d}'.format(i),
+            'Address': '{} {} Street'.format(rnd.randint(1, 9999), words(1)) if category in ('Place', 'Corporate Body') else None,
+        }]))
+
+    files = []
+    for i in range(size(LDA, 'Files')):
+        if not urls or rnd.random() < 0.6:
+            fields = {'File Path': '{}/{}/IMG_{:05d}.jpg'.format(rnd.choice(LDA_DRIVES), words(2), i)}
+        else:
+            fields = {'Virtual Location': 'https://lakeland.umd.edu/asa/LCHP-{:05d}'.format(i),
+                      'Duration': rnd.randint(60, 7200)}
+        files.extend(records([fields]))
+
+    items = []
+    for i in range(size(LDA, 'Items')):
+        items.extend(records([{
+            'Title': words(5),
+            'Description': words(20),
+            'Legacy ID-UMD': 'umd:{}'.format(100000 + i),
+            'Object Type': rnd.choice(OBJECT_TYPES),
+            'Files': links(files, 1, 3),
+            'Creator': links(entities, 0, 1),
+            'People': links(entities, 0, 4),
+            'Places/Organizations': links(entities, 0, 2),
+            'Subjects': links(subjects, 0, 3),
+            'Source (Provenance)': links(entities, 0, 1),
+        }]))
+
+    # LDT
+
+    people = records({'Name': person_name()} for i in range(size(LDT, 'People')))
+    locations = records({'Name': words(2)} for i in range(size(LDT, 'Locations')))
+    ldt_subjects = records({'Name': words(2)} for i in range(size(LDT, 'Subjects')))
+
+    # folders have ids like 84b1a1 and their images are numbered in them
+    folder_count = max(size(LDT, 'Folder'), 1)
+    folder_ids = []
+    while len(folder_ids) < folder_count:
+        folder_id = ''.join(rnd.choice(string.ascii_lowercase + string.digits) for i in range(6))
+        if folder_id not in folder_ids:
+            folder_ids.append(folder_id)
+
+    images = records({
+        'Image ID': '{}-{:03d}'.format(folder_ids[i % folder_count], i // folder_count + 1),
+        'Image Description': words(6) if rnd.random() < 0.7 else None,
+        'People (Image Level)': links(people, 0, 3),
+        'Places (Image Level)': links(locations, 0, 1),
+        'Subjects (Image Level)': links(ldt_subjects, 0, 2),
+    } for i in range(size(LDT, 'Images')))
+
+    folders = records({
+        'Folder ID': folder_ids[n],
+        'Donor Name': links(people, 1, 2),
+        'Date of donation': '20{:02d}-{:02d}-01'.format(rnd.randint(15, 21), rnd.randint(1, 12)),
+        'Accession Notes': words(10),
+        'Linked Images': [img['id'] for img in images[n::folder_count]],
+    } for n in range(folder_count))
+
+    ldt_items = records({
+        'Title': words(5),
+        'Readable Item ID': 'LDT-{:05d}'.format(i),
+        'Object Type': rnd.choice(OBJECT_TYPES),
+        'People': links(people, 0, 3),
+        'Places/Organizations': links(locations, 0, 1),
+        'Subjects': links(ldt_subjects, 0, 2),
+        'Images in Item': links(images, 1, 4),
+    } for i in range(size(LDT, 'Items')))
+
+    fixtures = {
+        LDA: {
+            'Items': {'records': items},
+            'Files': {'records': files},
+            'Subjects': {'records': subjects},
+            'Entities': {'records': entities},
+            'Relationships': {'records': []},
+        },
+        LDT: {
+            'Folder': {'records': folders},
+            'Images': {'records': images},
+            'Items': {'records': ldt_items},
+            'People': {'records': people},
+            'Subjects': {'records': ldt_subjects},
+            'Locations': {'records': locations},
+            'QA': {'records': []},
+        },
+        LAK: {name: {'records': []} for name in LAK_TABLES},
+    }
+    fixtures[LAK]['Accessions']['autonumber'] = 'ID'
+    return fixtures
+
+
+def make_files(fixtures, root, seed=0, sizes=(2, 64)):
+    """
+    Write the source files that generated bases refer to under root, with
+    sizes between sizes KB: the LDT images in mith-lastclass-raw/<folder>/Jpegs,
+    where migrate_ldt looks for them (relative to where it runs), the LDA
+    files with a File Path in lda-drive (for LDA_DRIVE), and the LDA files
+    at a Virtual Location in media/<host>/<path> of the url migrate_lda
+    downloads them from (for serve_media()). As in
+    the real sources, a few are missing and a few have the same content as
+    another. Returns the number of files and bytes that were written.
+    """
+    rnd = random.Random(seed)
+    root = pathlib.Path(root)
+    written = [0, 0]
+    contents = []
+
+    def write(path, magic):
+        if rnd.random() < 0.02:
+            return
+        if contents and rnd.random() < 0.05:
+            content = rnd.choice(contents)
+        else:
+            content = magic + rnd.randbytes(rnd.randint(*sizes) * 1024)
+            contents.append(content)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(content)
+        written[0] += 1
+        written[1] += len(content)
+
+    for image in fixtures[LDT]['Images']['records']:
+        image_id = image['fields']['Image ID']
+        write(root / 'mith-lastclass-raw' / image_id.split('-')[0] / 'Jpegs' / (image_id + '.jpg'), JPEG)
+
+    for f in fixtures[LDA]['Files']['records']:
+        if 'File Path' in f['fields']:
+            write(root / 'lda-drive' / f['fields']['File Path'], JPEG)
+        else:
+            # ASA locations are downloaded from the protected audio folder
+            name = f['fields']['Virtual Location'].split('/')[-1]
+            write(root / 'media' / ASA_HOST / 'asa' / 'audio' / (name + '.mp3'), MP3)
+
+    return tuple(written)
+
+
+# the start of a JPEG and an MP3 file, so that they are sniffed as such
+JPEG = b'\xff\xd8\xff\xe0\x00\x10JFIF\x00\x01\x01\x00\x00\x01\x00\x01\x00\x00'
+MP3 = b'ID3\x03\x00\x00\x00\x00\x00\x00'
+
+ASA_HOST = 'protected.lakeland.reclaim.hosting'
+MEDIA_HOSTS = [ASA_HOST, 'lakeland.umd.edu', 'mith-lakeland-media.s3-website-us-east-1.amazonaws.com']
+
+ENTITY_CATEGORIES = ['Person', 'Person (LCHP Team)', 'Corporate Body', 'Family', 'Place']
+OBJECT_TYPES = ['Photo', 'Photos', 'Oral History', 'OralHistory', 'Document', 'Publication']
+LDA_DRIVES = ['Mary Sies Hard Drive', 'Maxine Gross Hard Drive', 'College Park Photos', 'LCHP Accession 2021']
+FIRST_NAMES = ['Mary', 'James', 'Maxine', 'John', 'Violet', 'Robert', 'Eleanor', 'William', 'Ruth', 'Charles', 'Hattie', 'George']
+LAST_NAMES = ['Gross', 'Sies', 'Johnson', 'Brown', 'Williams', 'Jackson', 'Thomas', 'Harris', 'Gaines', 'Turner', 'Wilson', 'Moore']
+WORDS = ['lakeland', 'church', 'school', 'family', 'river', 'street', 'reunion', 'college', 'park', 'house', 'store',
+         'baseball', 'team', 'choir', 'wedding', 'parade', 'flood', 'hall', 'community', 'garden', 'station', 'picnic']
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Run a local stand-in for the Airtable API.')
+    parser.add_argument('--host', default='localhost', help='address to listen on')
+    parser.add_argument('--port', type=int, default=8777, help='port to listen on')
+    parser.add_argument('--fixtures', help='JSON (or .json.gz) file of bases to load')
+    parser.add_argument('--generate', type=float, metavar='SCALE', help='generate Lakeland shaped bases at this scale')
+    parser.add_argument('--save', help='save the generated bases to this file and exit')
+    parser.add_argument('--seed', type=int, default=0, help='random seed for generated bases')
+    parser.add_argument('--latency', type=float, default=0, help='seconds each request takes')
+    parser.add_argument('--jitter', type=float, default=0, help='up to this many more seconds added to the latency')
+    parser.add_argument('--rate', type=int, default=5, help='requests per second allowed for each base (0 for no limit)')
+    parser.add_argument('--throttle', type=float, default=0, help='fraction of requests that get a 429 anyway')
+    parser.add_argument('--verbose', action='store_true', help='log every request')
+    parser.add_argument('--files', metavar='DIR', help='write the files the generated bases refer to into DIR and serve their urls')
+    parser.add_argument('--media-port', type=int, default=8779, help='port to serve the files at urls on (as an HTTP proxy)')
+    args = parser.parse_args()
+
+    if args.save:
+        with gzip.open(args.save, 'wt') if args.save.endswith('.gz') else open(args.save, 'w') as fh:
+            json.dump(make_fixtures(args.generate or 1.0, args.seed), fh)
+        parser.exit()
+
+    fake = FakeAirtable(latency=args.latency, jitter=args.jitter, rate=args.rate, throttle=args.throttle)
+    if args.fixtures:
+        fake.load(args.fixtures)
+    if args.generate is not None:
+        fixtures = make_fixtures(args.generate, args.seed)
+        for base_id, tables in fixtures.items():
+            for table_name, table in tables.items():
+                fake.add_table(base_id, table_name, table['records'], table.get('autonumber'))
+        if args.files:
+            count, size = make_files(fixtures, args.files, args.seed)
+            print('fake_airtable: wrote {} files ({} bytes) to {}'.format(count, size, os.path.abspath(args.files)))
+
+    servers = [serve(fake, args.host, args.port, args.verbose)]
+    print('fake_airtable: serving {} bases on http://{}:{}'.format(len(fake.bases), args.host, args.port))
+    if args.files:
+        servers.append(serve_media(args.files, args.host, args.media_port, args.verbose))
+        print('fake_airtable: serving files at urls through the proxy http://{}:{} (certificate {})'.format(
+            args.host, args.media_port, servers[-1].certificate))
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        for server in servers:
+            server.shutdown()
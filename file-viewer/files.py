@@ -5,6 +5,7 @@ import os
 import csv
 import sys
 import json
+import argparse
 
 sys.path.append((os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
 
@@ -14,13 +15,18 @@ from dotenv import load_dotenv
 load_dotenv()
 airtable_key = os.environ.get('AIRTABLE_KEY')
 
+parser = argparse.ArgumentParser(description='Write the LDA file paths as a tree to files.json.')
+parser.add_argument('--refresh', action='store_true', help='fetch LDA from Airtable even if there is a recent snapshot')
+args = parser.parse_args()
 
+# the snapshots are kept apart from migrate_lda's, which has other tables
+# and fields, so that the two don't keep replacing each other's
 lda = Base("app9sKntqCyBwawhA", airtable_key, {
     "Items": {
         "Files": "Files"
     },
     "Files": {}
-})
+}, snapshot_dir='snapshots/file-viewer', snapshot_ttl=7 * 24 * 60 * 60, refresh=args.refresh)
 
 fs = {}
 for item in lda.tables['Files'].data:
@@ -0,0 +1,145 @@
+import json
+import time
+import pathlib
+import sqlite3
+import requests
+import threading
+
+from urllib.parse import urlparse, parse_qsl, urlencode, urlunparse
+
+
+class HttpCache:
+    """
+    A persistent cache of API responses kept in SQLite. Entries are keyed by
+    URL with secret query parameters (API keys) removed. Once an entry is
+    older than ttl seconds it is revalidated using its ETag or Last-Modified
+    header, and the least recently used entries are evicted when the cache
+    is over max_size bytes. A request that gets no response for timeout
+    seconds fails rather than holding up its caller.
+
+    It also remembers the SHA256 of files that were downloaded from a URL,
+    so unchanged media doesn't need to be downloaded again.
+    """
+
+    def __init__(self, path='cache/http.sqlite3', ttl=7 * 24 * 60 * 60, max_size=256 * 1024 * 1024,
+                 secret_params=('key',), timeout=60):
+        self.path = pathlib.Path(path)
+        self.ttl = ttl
+        self.max_size = max_size
+        self.secret_params = secret_params
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.db = None
+        self.lock = threading.Lock()
+
+    def index(self):
+        if self.db is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self.db = sqlite3.connect(str(self.path), check_same_thread=False)
+            self.db.execute('CREATE TABLE IF NOT EXISTS responses (url TEXT PRIMARY KEY, status INTEGER, etag TEXT, last_modified TEXT, fetched REAL, accessed REAL, size INTEGER, body BLOB)')
+            self.db.execute('CREATE TABLE IF NOT EXISTS downloads (url TEXT PRIMARY KEY, sha256 TEXT)')
+        return self.db
+
+    def key(self, url):
+        """
+        The cache key for a URL: the URL without any secret parameters.
+        """
+        uri = urlparse(url)
+        params = [(k, v) for k, v in parse_qsl(uri.query) if k not in self.secret_params]
+        return urlunparse(uri._replace(query=urlencode(sorted(params))))
+
+    def get(self, url):
+        """
+        Get a URL, using the cache when possible. Returns the status code and
+        the body of the response. Only successful responses are cached.
+        """
+        key = self.key(url)
+        with self.lock:
+            row = self.index().execute(
+                'SELECT status, etag, last_modified, fetched, body FROM responses WHERE url = ?', (key,)
+            ).fetchone()
+
+        headers = {}
+        if row:
+            status, etag, last_modified, fetched, body = row
+            if time.time() - fetched < self.ttl:
+                self.touch(key)
+                return status, body
+            if etag:
+                headers['If-None-Match'] = etag
+            if last_modified:
+                headers['If-Modified-Since'] = last_modified
+
+        resp = self.session.get(url, headers=headers, timeout=self.timeout)
+
+        if row and resp.status_code == 304:
+            with self.lock:
+                self.index().execute('UPDATE responses SET fetched = ?, accessed = ? WHERE url = ?',
+                                     (time.time(), time.time(), key))
+                self.index().commit()
+            return status, body
+
+        if resp.status_code == 200:
+            self.put(key, resp)
+        return resp.status_code, resp.content
+
+    def get_json(self, url):
+        """
+        Get the JSON for a URL, or None if the request wasn't successful.
+        """
+        status, body = self.get(url)
+        if status == 200:
+            return json.loads(body)
+        return None
+
+    def peek_json(self, url):
+        """
+        Get the cached JSON for a URL however old it is, without making a
+        request. None is returned if it isn't cached.
+        """
+        with self.lock:
+            row = self.index().execute('SELECT body FROM responses WHERE url = ?', (self.key(url),)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, key, resp):
+        now = time.time()
+        with self.lock:
+            self.index().execute(
+                'INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (key, resp.status_code, resp.headers.get('ETag'), resp.headers.get('Last-Modified'),
+                 now, now, len(resp.content), resp.content)
+            )
+            self.evict()
+            self.index().commit()
+
+    def touch(self, key):
+        with self.lock:
+            self.index().execute('UPDATE responses SET accessed = ? WHERE url = ?', (time.time(), key))
+            self.index().commit()
+
+    def evict(self):
+        """
+        Remove the least recently used responses until the cache fits.
+        """
+        total = self.index().execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+        if total <= self.max_size:
+            return
+        rows = self.index().execute('SELECT url, size FROM responses ORDER BY accessed').fetchall()
+        for url, size in rows:
+            if total <= self.max_size:
+                break
+            self.index().execute('DELETE FROM responses WHERE url = ?', (url,))
+            total -= size
+
+    def get_sha256(self, url):
+        """
+        Get the SHA256 of the file that was last downloaded from a URL.
+        """
+        with self.lock:
+            row = self.index().execute('SELECT sha256 FROM downloads WHERE url = ?', (self.key(url),)).fetchone()
+        return row[0] if row else None
+
+    def set_sha256(self, url, sha256):
+        with self.lock:
+            self.index().execute('INSERT OR REPLACE INTO downloads VALUES (?, ?)', (self.key(url), sha256))
+            self.index().commit()
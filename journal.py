@@ -0,0 +1,168 @@
+import os
+import json
+import pathlib
+import threading
+
+from schema import Link, Record
+
+
+class Journal:
+    """
+    A durable record of the units of work a migration has finished, such
+    as an authority or item that was inserted or a file that was ingested,
+    so that a run that dies part way through can pick up where it left off.
+    Each unit is identified by a kind and a key (usually the id of the
+    source record) and has a value (usually the id of the new record).
+
+    Units are appended to a JSON lines file and synced to disk as they are
+    recorded. Writes to a buffered Table should be recorded with
+    record_after() so that they only count once Airtable has them.
+
+    A read_only journal (for a dry run) reads what earlier runs did but only
+    keeps what is recorded in memory.
+
+    A journal of writes to a base that can be wiped is tied to a generation,
+    the time it was last wiped (see last_wipe()). The generation is written
+    at the top of the file, and if it has changed since, what the journal
+    says was done is gone and it starts over.
+    """
+
+    def __init__(self, path, read_only=False, generation=None):
+        self.path = pathlib.Path(path)
+        self.read_only = read_only
+        self.generation = generation
+        self.done = {}
+        self.lock = threading.Lock()
+        self.fh = None
+        good = 0
+        if self.path.is_file():
+            found = None
+            with open(self.path, 'rb') as fh:
+                for line in fh:
+                    # a line that was only partly written when we died
+                    if not line.endswith(b"\n"):
+                        break
+                    unit = json.loads(line)
+                    if 'generation' in unit:
+                        found = unit['generation']
+                    else:
+                        self.done[(unit['kind'], unit['key'])] = unit['value']
+                    good += len(line)
+            if found != generation:
+                self.done = {}
+                good = 0
+            if not read_only:
+                os.truncate(self.path, good)
+        if not read_only:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self.fh = open(self.path, 'a')
+            if not good:
+                self.write_generation()
+
+    def __contains__(self, unit):
+        return unit in self.done
+
+    def __len__(self):
+        return len(self.done)
+
+    def get(self, kind, key, default=None):
+        return self.done.get((kind, key), default)
+
+    def record(self, kind, key, value=None):
+        with self.lock:
+            # it is already on disk
+            if (kind, key) in self.done and self.done[(kind, key)] == value:
+                return
+            self.done[(kind, key)] = value
+            if self.read_only:
+                return
+            self.fh.write(json.dumps({"kind": kind, "key": key, "value": value}) + "\n")
+            self.fh.flush()
+            os.fsync(self.fh.fileno())
+
+    def record_after(self, table, kind, key, value):
+        """
+        Record a unit once the table's buffered writes have been sent. Any
+        records in the value are saved as their ids.
+        """
+        table.when_flushed(lambda: self.record(kind, key, record_ids(value)))
+
+    def reset(self):
+        with self.lock:
+            self.done = {}
+            if self.read_only:
+                return
+            self.fh.close()
+            self.fh = open(self.path, 'w')
+            self.write_generation()
+
+    def write_generation(self):
+        if self.generation is not None:
+            self.fh.write(json.dumps({"generation": self.generation}) + "\n")
+            self.fh.flush()
+
+
+def record_ids(value):
+    if type(value) == list:
+        return [record_ids(v) for v in value]
+    elif isinstance(value, (Link, Record)):
+        return value.id
+    elif isinstance(value, dict) and 'fields' in value:
+        return value['id']
+    return value
+
+
+def last_sync(name, generation=None, path='checkpoints/sync.json'):
+    """
+    Get the time (in seconds since the epoch) that a migration last
+    finished successfully, or None if it never has, or hasn't since the
+    base it migrates into was wiped (if generation is the time of the
+    last wipe).
+    """
+    sync = read_times(path).get(name)
+    # syncs used to be saved as just the time
+    if not isinstance(sync, dict):
+        sync = {"when": sync, "generation": None}
+    if sync['generation'] != generation:
+        return None
+    return sync['when']
+
+
+def save_sync(name, when, generation=None, path='checkpoints/sync.json'):
+    """
+    Save the time the source data for a migration was fetched, once the
+    migration has finished successfully, along with the generation of the
+    base it migrates into.
+    """
+    write_time(path, name, {"when": when, "generation": generation})
+
+
+def last_wipe(base_id, path='checkpoints/wipes.json'):
+    """
+    Get the time a base was last wiped, which is the generation of the
+    journals and syncs of migrations into it, or None if it never has been.
+    """
+    return read_times(path).get(base_id)
+
+
+def save_wipe(base_id, when, path='checkpoints/wipes.json'):
+    write_time(path, base_id, when)
+
+
+def read_times(path):
+    path = pathlib.Path(path)
+    if not path.is_file():
+        return {}
+    with open(path) as fh:
+        return json.load(fh)
+
+
+def write_time(path, name, value):
+    path = pathlib.Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    times = read_times(path)
+    times[name] = value
+    tmp_path = path.with_name(path.name + '.tmp')
+    with open(tmp_path, 'w') as fh:
+        json.dump(times, fh, indent=2)
+    tmp_path.replace(path)
@@ -34,49 +34,121 @@
 import os
 import re
 import json
+import time
 import shutil
+import hashlib
 import logging
+import argparse
 
 from os import stat
 from PIL import Image
+from metrics import metrics
 from os import listdir as ls
 from os.path import join, isdir, isfile, abspath, dirname
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 IMAGE_ROOT = abspath('mith-lastclass-raw')
 
-def get_orig(image_id):
-    folder_id, seq_id = image_id.split('-')
+INDEX_PATH = 'image-index.json'
 
-    # attempt to find the best directory for the images
-    images_dir = find_images_dir(folder_id)
+# the index is built the first time an image is looked up
+index = None
 
-    # look to see if the image id matches
-    found = None
-    for i in get_images(images_dir):
-        if i['id'] == image_id:
-            found = i
+# derivative formats that can keep an image's transparency
+ALPHA_FORMATS = {'png', 'webp', 'tif', 'tiff'}
 
-    # if no image was found look in the parent directory
-    if not found:
-        for i in get_images(dirname(images_dir)):
-            if i['id'] == image_id:
-                found = i
+@metrics.timed('get_orig')
+def get_orig(image_id):
+    """
+    Look up the original file for an image id in the index. The best
+    match is a file in the folder's images directory, then one in the
+    directory above it, then one anywhere in the folder that has the image
+    id in its name, and finally one anywhere at all.
+    """
+    global index
+    if index is None:
+        index = build_index()
 
-    # finally just look for the jpg or tiff anywhere in the directory
-    if not found:
-        for dirpath, dirnames, filenames in os.walk(dirname(images_dir)):
-            for f in filenames:
-                if image_id in f:
-                    found = {
-                        "id": image_id,
-                        "path": join(dirpath, f)
-                    }
+    folder_id, seq_id = image_id.split('-')
+    folder = index['folders'].get(folder_id, {})
 
-    return found
+    path = folder.get('images', {}).get(image_id) or folder.get('found', {}).get(image_id)
+    if not path:
+        path = next((other['found'][image_id] for other in index['folders'].values() if image_id in other['found']), None)
 
-def get_images(images_dir):
+    if path:
+        return {"id": image_id, "path": path}
+    metrics.error('get_orig', 'not found')
+    return None
 
-    for name in ls(images_dir):
+def build_index(index_path=INDEX_PATH):
+    """
+    Walk the images once and record the best file for each image id in each
+    folder, along with the modification time of every directory that was
+    looked at. The index is saved to index_path and when it is rebuilt any
+    folder whose directories haven't changed is reused rather than walked.
+    """
+    old = {}
+    if isfile(index_path):
+        with open(index_path) as fh:
+            old = json.load(fh)
+        if old.get('root') != IMAGE_ROOT:
+            old = {}
+
+    folders = {}
+    for name in sorted(ls(IMAGE_ROOT)):
+        folder_dir = join(IMAGE_ROOT, name)
+        if not isdir(folder_dir):
+            continue
+        prev = old.get('folders', {}).get(name)
+        if prev and not folder_changed(prev):
+            folders[name] = prev
+        else:
+            folders[name] = index_folder(name)
+
+    index = {"root": IMAGE_ROOT, "folders": folders}
+    tmp_path = index_path + '.tmp'
+    with open(tmp_path, 'w') as fh:
+        json.dump(index, fh)
+    os.replace(tmp_path, index_path)
+
+    return index
+
+def folder_changed(folder):
+    for path, mtime in folder['mtimes'].items():
+        if not isdir(path) or stat(path).st_mtime != mtime:
+            return True
+    return False
+
+def index_folder(name):
+    folder_dir = join(IMAGE_ROOT, name)
+    mtimes = {}
+    listings = {}
+    found = {}
+
+    # any file with an image id in its name
+    for dirpath, dirnames, filenames in os.walk(folder_dir):
+        mtimes[dirpath] = stat(dirpath).st_mtime
+        listings[dirpath] = dirnames + filenames
+        for f in filenames:
+            for image_id in re.findall(r'[a-z0-9]{6}-\d{3}', f):
+                found[image_id] = join(dirpath, f)
+
+    # files in the images directory are preferred to ones in its parent
+    images = {}
+    images_dir = find_images_dir(name) if len(name) == 6 else None
+    if images_dir:
+        if images_dir != folder_dir:
+            for i in get_images(folder_dir, listings.get(folder_dir)):
+                images[i['id']] = i['path']
+        for i in get_images(images_dir, listings.get(images_dir)):
+            images[i['id']] = i['path']
+
+    return {"mtimes": mtimes, "images": images, "found": found}
+
+def get_images(images_dir, names=None):
+
+    for name in names if names is not None else ls(images_dir):
         image_path = join(images_dir, name)
 
         # find filenames that look correct {folder-id}-{item-id}.tif
@@ -183,5 +255,154 @@ def make_image(orig_image_path, image_id):
     img.save(image_path)
     logging.info('saved %s', image_path)
 
+def all_originals():
+    """
+    Yield (image_id, path) for the original of every image in the index.
+    """
+    global index
+    if index is None:
+        index = build_index()
+    image_ids = set()
+    for folder in index['folders'].values():
+        image_ids.update(folder['images'])
+        image_ids.update(folder['found'])
+    for image_id in sorted(image_ids):
+        orig = get_orig(image_id)
+        yield orig['id'], orig['path']
+
+def make_derivatives(originals, sizes=(1200,), formats=('png',), out_dir='static/images', workers=None,
+                     save_every=30):
+    """
+    Make derivatives of each (image_id, path) in originals, in every size and
+    format, on a pool of processes. Derivatives are written to out_dir as
+    {image_id}-{size}.{format}, and a manifest.json there records the
+    SHA256 of the original each was made from and the parameters that were
+    used, so they are only made again when either changes. The manifest is
+    saved every save_every seconds, and when the run stops for any reason,
+    so an interrupted run only has to make what it hadn't finished. Returns
+    a summary of the number of images, bytes and time spent for each format.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    manifest_path = join(out_dir, 'manifest.json')
+    manifest = {}
+    if isfile(manifest_path):
+        with open(manifest_path) as fh:
+            manifest = json.load(fh)
+
+    summary = {}
+    start = saved = time.time()
+    with ProcessPoolExecutor(workers) as pool:
+        futures = [
+            pool.submit(make_derivative, image_id, path, sizes, formats, out_dir, manifest.get(image_id))
+            for image_id, path in originals
+        ]
+        try:
+            for future in as_completed(futures):
+                try:
+                    image_id, entry, stats = future.result()
+                except Exception as e:
+                    logging.error('unable to make derivatives: %s', e)
+                    continue
+                manifest[image_id] = entry
+                for fmt, (count, size, secs) in stats.items():
+                    total = summary.setdefault(fmt, {"images": 0, "bytes": 0, "seconds": 0.0})
+                    total["images"] += count
+                    total["bytes"] += size
+                    total["seconds"] += secs
+                if time.time() - saved >= save_every:
+                    save_manifest(manifest, manifest_path)
+                    saved = time.time()
+        except BaseException:
+            # don't wait for the images that haven't been started
+            for future in futures:
+                future.cancel()
+            raise
+        finally:
+            save_manifest(manifest, manifest_path)
+
+    elapsed = time.time() - start
+    for fmt, total in summary.items():
+        total["images_per_second"] = round(total["images"] / elapsed, 2) if elapsed else None
+        logging.info('%s: %s images, %s bytes, %.1fs', fmt, total["images"], total["bytes"], total["seconds"])
+
+    return summary
+
+def save_manifest(manifest, manifest_path):
+    tmp_path = manifest_path + '.tmp'
+    with open(tmp_path, 'w') as fh:
+        json.dump(manifest, fh, indent=2)
+    os.replace(tmp_path, manifest_path)
+
+def make_derivative(image_id, orig_image_path, sizes, formats, out_dir, entry=None):
+    """
+    Make the derivatives for one image. This runs in a worker process and
+    returns the image's new manifest entry and the time spent per format.
+    """
+    st = stat(orig_image_path)
+
+    # only hash the original again if it looks like it has changed
+    entry = entry or {}
+    if entry.get('size') == st.st_size and entry.get('mtime') == st.st_mtime:
+        sha256 = entry['sha256']
+    else:
+        d = hashlib.sha256()
+        with open(orig_image_path, 'rb') as fh:
+            for chunk in iter(lambda: fh.read(512 * 1024), b''):
+                d.update(chunk)
+        sha256 = d.hexdigest()
+
+    outputs = entry.get('outputs', {}) if entry.get('sha256') == sha256 else {}
+    new_entry = {"sha256": sha256, "size": st.st_size, "mtime": st.st_mtime, "outputs": {}}
+    stats = {}
+    img = None
+
+    # make the biggest first so the smaller ones can be made from it
+    for size in sorted(sizes, reverse=True):
+        for fmt in formats:
+            name = '{}-{}.{}'.format(image_id, size, fmt)
+            path = join(out_dir, name)
+            params = {"size": size, "format": fmt}
+            if outputs.get(name) == params and isfile(path):
+                new_entry['outputs'][name] = params
+                continue
+
+            t = time.time()
+            if img is None:
+                img = Image.open(orig_image_path)
+                # JPEGs can be decoded at a reduced scale which is much faster
+                if img.format == 'JPEG':
+                    img.draft('RGB', (max(sizes), max(sizes)))
+                if img.mode not in ('RGB', 'RGBA', 'L'):
+                    img = img.convert('RGBA' if has_alpha(img) else 'RGB')
+            img.thumbnail((size, size))
+            if img.mode == 'RGBA' and fmt.lower() not in ALPHA_FORMATS:
+                img.convert('RGB').save(path)
+            else:
+                img.save(path)
+
+            count, nbytes, secs = stats.get(fmt, (0, 0, 0.0))
+            stats[fmt] = (count + 1, nbytes + stat(path).st_size, secs + time.time() - t)
+            new_entry['outputs'][name] = params
+
+    return image_id, new_entry, stats
+
+def has_alpha(img):
+    return img.mode in ('LA', 'La', 'PA', 'RGBa') or 'transparency' in img.info
+
 if __name__ == "__main__":
-    print(get_orig('88568e-017'))
+    parser = argparse.ArgumentParser(description='Make derivatives of the LDT images.')
+    parser.add_argument('--size', type=int, action='append', help='longest side in pixels (can be repeated)')
+    parser.add_argument('--format', action='append', help='image format, e.g. png or webp (can be repeated)')
+    parser.add_argument('--out', default='static/images', help='directory to write the derivatives to')
+    parser.add_argument('--workers', type=int, help='number of processes to use')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    summary = make_derivatives(
+        all_originals(),
+        sizes=args.size or [1200],
+        formats=args.format or ['png'],
+        out_dir=args.out,
+        workers=args.workers
+    )
+    print(json.dumps(summary, indent=2))
@@ -0,0 +1,208 @@
+import sys
+import json
+import time
+import atexit
+import pathlib
+import datetime
+import functools
+import threading
+import contextlib
+import collections
+
+# upper bounds (in milliseconds) of the latency histogram buckets
+BUCKETS = [2 ** i for i in range(18)]
+
+
+class Stat:
+    """
+    What has been recorded under one name: how many times it happened, how
+    many bytes were involved, how long it took (as a histogram), and the
+    errors it ran into, tallied by type.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.bytes = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+        self.histogram = [0] * (len(BUCKETS) + 1)
+        self.errors = collections.Counter()
+
+    def add(self, seconds=None, size=0, n=1):
+        self.count += n
+        self.bytes += size or 0
+        if seconds is not None:
+            self.seconds += seconds
+            self.max_seconds = max(self.max_seconds, seconds)
+            ms = seconds * 1000
+            bucket = next((i for i, bound in enumerate(BUCKETS) if ms <= bound), len(BUCKETS))
+            self.histogram[bucket] += 1
+
+    def percentile(self, p):
+        """
+        Estimate a latency percentile (in seconds) from the histogram.
+        """
+        timed = sum(self.histogram)
+        if not timed:
+            return None
+        seen = 0
+        for i, n in enumerate(self.histogram):
+            seen += n
+            if seen >= timed * p:
+                return min(BUCKETS[i] / 1000, self.max_seconds) if i < len(BUCKETS) else self.max_seconds
+        return self.max_seconds
+
+    def report(self):
+        timed = sum(self.histogram)
+        r = {"count": self.count}
+        if self.bytes:
+            r["bytes"] = self.bytes
+        if timed:
+            r["seconds"] = round(self.seconds, 3)
+            r["mean"] = round(self.seconds / timed, 4)
+            r["p50"] = self.percentile(0.5)
+            r["p95"] = self.percentile(0.95)
+            r["max"] = round(self.max_seconds, 4)
+            r["histogram"] = {
+                ("<={}ms".format(BUCKETS[i]) if i < len(BUCKETS) else ">{}ms".format(BUCKETS[-1])): n
+                for i, n in enumerate(self.histogram) if n
+            }
+        if self.errors:
+            r["errors"] = dict(self.errors)
+        return r
+
+
+class Metrics:
+    """
+    Counts, bytes, latencies and errors for the stages of a migration, so
+    that after a long run you can see where the time went. Work is timed
+    with timer() or the timed() decorator:
+
+        with metrics.timer('ingest') as t:
+            ...
+            t.size = size
+
+    Warnings can be tallied with error(), and show_progress() prints the
+    throughput of a few stats while the run goes. report() returns it all
+    as a dictionary and save() writes that to a JSON file.
+    """
+
+    def __init__(self):
+        self.stats = collections.defaultdict(Stat)
+        self.sources = {}
+        self.started = time.time()
+        self.lock = threading.Lock()
+        self.progress = None
+
+    @contextlib.contextmanager
+    def timer(self, name):
+        timing = Timing()
+        start = time.perf_counter()
+        try:
+            yield timing
+        except Exception as e:
+            self.error(name, type(e).__name__)
+            raise
+        finally:
+            seconds = time.perf_counter() - start
+            with self.lock:
+                self.stats[name].add(seconds, timing.size)
+
+    def timed(self, name):
+        """
+        Decorate a function so that every call is timed under name.
+        """
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.timer(name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def count(self, name, n=1, size=0):
+        with self.lock:
+            self.stats[name].add(size=size, n=n)
+
+    def error(self, name, kind):
+        with self.lock:
+            self.stats[name].errors[kind] += 1
+
+    def include(self, name, func):
+        """
+        Add the dictionary func returns (like a Scheduler's stats) to the report.
+        """
+        self.sources[name] = func
+
+    def report(self):
+        with self.lock:
+            stats = {name: stat.report() for name, stat in sorted(self.stats.items())}
+        return {
+            "started": datetime.datetime.fromtimestamp(self.started).isoformat(timespec='seconds'),
+            "elapsed": round(time.time() - self.started, 1),
+            "stats": stats,
+            **{name: func() for name, func in self.sources.items()}
+        }
+
+    def save(self, path):
+        path = pathlib.Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, 'w') as fh:
+            json.dump(self.report(), fh, indent=2)
+
+    def save_at_exit(self, path):
+        """
+        Save the report when the program exits, even if it fails part way.
+        """
+        def save():
+            self.stop_progress()
+            self.save(path)
+        atexit.register(save)
+
+    def show_progress(self, names, totals=None, interval=5, out=sys.stderr):
+        """
+        Print the count and rate of the named stats (out of a total, if there
+        is one) every interval seconds until stop_progress() is called.
+        """
+        totals = totals or {}
+        stop = threading.Event()
+
+        def show():
+            while not stop.wait(interval):
+                elapsed = time.time() - self.started
+                parts = ['{:.0f}:{:02.0f}'.format(*divmod(elapsed, 60))]
+                with self.lock:
+                    for name in names:
+                        stat = self.stats.get(name) or Stat()
+                        part = '{} {}'.format(name, stat.count)
+                        if name in totals:
+                            part += '/{}'.format(totals[name])
+                        part += ' {:.1f}/s'.format(stat.count / elapsed)
+                        if stat.bytes:
+                            part += ' {:.1f} MB/s'.format(stat.bytes / elapsed / 1024 / 1024)
+                        parts.append(part)
+                end = '\r' if out.isatty() else '\n'
+                out.write(' | '.join(parts) + end)
+                out.flush()
+
+        self.stop_progress()
+        self.progress = stop
+        threading.Thread(target=show, daemon=True).start()
+
+    def stop_progress(self):
+        if self.progress:
+            self.progress.set()
+            self.progress = None
+
+
+class Timing:
+    """
+    Lets the code being timed say how many bytes it handled.
+    """
+
+    def __init__(self):
+        self.size = 0
+
+
+# the metrics for this run
+metrics = Metrics()
@@ -2,16 +2,31 @@
 
 import os
 import re
+import sys
 import csv
-import magic
+import json
+import time
+import uuid
+import hashlib
+import argparse
 import pathlib
 import requests
 import tempfile
+import threading
+import contextlib
+import collections
 
 from dotenv import load_dotenv
 from urllib.parse import urlparse
 from urllib.request import urlretrieve
-from schema import Base, parse_name, get_sha256, csv_str, csv_list, save_file, get_ext
+from pipeline import Pipeline
+from download import Downloader
+from journal import Journal, last_sync, save_sync, last_wipe, record_ids
+from httpcache import HttpCache
+from metrics import metrics
+from plan import Plan
+from accession_rules import match_accessions
+from schema import Base, warm_name_cache, person_fields, csv_str, csv_list, ingest, store
 
 load_dotenv()
 airtable_key = os.environ.get('AIRTABLE_KEY')
@@ -19,8 +34,33 @@ omeka_key = os.environ.get('OMEKA_KEY')
 google_key = os.environ.get('GOOGLE_KEY')
 asa_password = os.environ.get('ASA_PASSWORD')
 
-# nfs mount of mith NAS
-drive = pathlib.Path('/mnt/storage.mith.us-projects/lakeland-digital-archive/object files/Files by Object Type/')
+parser = argparse.ArgumentParser(description='Migrate the Lakeland Digital Archive base into Lakeland Temp.')
+parser.add_argument('--refresh', action='store_true', help='fetch LDA from Airtable even if there is a recent snapshot')
+parser.add_argument('--restart', action='store_true', help='ignore what an earlier run completed and process everything again')
+parser.add_argument('--incremental', action='store_true', help='only migrate LDA records modified since the last successful run')
+parser.add_argument('--download-workers', type=int, default=4, help='number of files to locate or download at once')
+parser.add_argument('--store-workers', type=int, default=2, help='number of files to hash and store at once')
+parser.add_argument('--downloads-per-host', type=int, default=2, help='number of downloads to run against a host at once')
+parser.add_argument('--chunk-size', type=int, default=1024, help='size in KB of the chunks downloads are read in')
+parser.add_argument('--dry-run', action='store_true', help='work out what would be written and copied, save it as a plan in plans, and write nothing')
+parser.add_argument('--apply', metavar='PLAN', help='make the writes in a plan saved by --dry-run, reading the files it needs')
+args = parser.parse_args()
+
+# A dry run records what it would write in a plan. Applying a plan makes
+# the same writes (with the same --incremental setting) without working
+# them out again, only reading the files.
+plan = None
+if args.dry_run:
+    plan = Plan()
+elif args.apply:
+    plan = Plan.load(args.apply)
+    args.incremental = plan.meta['incremental']
+
+downloader = Downloader('tmp', chunk_size=args.chunk_size * 1024, per_host=args.downloads_per_host)
+http_cache = HttpCache('cache/http.sqlite3')
+
+# nfs mount of mith NAS (or a stand-in for a trial run, see fake_airtable.py)
+drive = pathlib.Path(os.environ.get('LDA_DRIVE', '/mnt/storage.mith.us-projects/lakeland-digital-archive/object files/Files by Object Type/'))
 
 # Lakeland Digitization Archive 
 lda = Base("app9sKntqCyBwawhA", airtable_key, {
@@ -39,7 +79,21 @@ lda = Base("app9sKntqCyBwawhA", airtable_key, {
     "Subjects": {},
     "Entities": {},
     "Relationships": {}
-})
+}, snapshot_dir='snapshots', snapshot_ttl=7 * 24 * 60 * 60, refresh=args.refresh, fields={
+    # only the fields that are migrated are fetched (links are always fetched)
+    "Items": [
+        "Title", "Description", "Legacy ID-UMD", "Object Type", "Object Category",
+        "Creation Date", "Events", "In Lakeland Book?", "Lakeland Book Chapter",
+        "Lakeland Book Page #", "Used in Lakeland Video?", "Flag for Removal?",
+        "Interview Summary"
+    ],
+    "Files": ["Virtual Location", "File Path", "Duration"],
+    "Subjects": ["Name", "Subject Category"],
+    "Entities": [
+        "Name", "Entity Category", "Source Code", "Alternate Name", "Address",
+        "Latitude", "Longitude"
+    ]
+}, stream=[] if args.incremental or args.apply else ['Items'])
 
 # Lakeland Temp Airtable
 lak = Base('appqn0kIOXRo00kdN', airtable_key, {
@@ -52,9 +106,69 @@ lak = Base('appqn0kIOXRo00kdN', airtable_key, {
     "Organizations": {},
     "Events": {},
     "Families": {}
-})
+}, buffered=True, plan=plan if args.dry_run else None)
+
+# Units of work that have been completed, so an interrupted run can resume.
+# They are forgotten when migrate_ldt wipes Lakeland Temp, along with when
+# this migration last finished.
+generation = last_wipe(lak.id)
+journal = Journal('checkpoints/migrate_lda.jsonl', read_only=args.dry_run, generation=generation)
+if args.restart:
+    journal.reset()
+
+# A plan can only be applied to Lakeland Temp as it was when the plan was
+# made, unless applying it was interrupted and is being resumed.
+if args.dry_run:
+    plan.meta = {"id": uuid.uuid4().hex, "fingerprint": lak.fingerprint()}
+elif args.apply and ('Plan', plan.meta.get('id')) not in journal:
+    if plan.meta.get('fingerprint') != lak.fingerprint():
+        parser.error('Lakeland Temp has changed since {} was made, make a new plan with --dry-run'.format(args.apply))
+
+# Write a report of where the time went when the run finishes (or fails).
+metrics.save_at_exit(time.strftime('reports/migrate_lda-%Y%m%d-%H%M%S.json'))
+metrics.include('lda scheduler', lda.scheduler.stats)
+metrics.include('lak scheduler', lak.scheduler.stats)
+
+def done(kind, key):
+    """
+    Was this unit completed by an earlier run, and not changed since?
+    """
+    if kind == 'File' and key in redo_files:
+        return False
+    if kind in ('Item', 'Transcripts') and args.incremental:
+        return False
+    if (kind, key) not in journal:
+        return False
+
+    # the records that were added could have been removed since
+    ids = journal.get(kind, key)
+    table = lak.tables['Items' if kind == 'Item' else 'Files']
+    return all(table.get(id) for id in (ids if type(ids) == list else [ids]))
+
+def record(table_name, kind, key, value):
+    """
+    Journal a unit once its records have been sent. A dry run adds it to the
+    plan too, so that it is journaled when the plan is applied.
+    """
+    journal.record_after(lak.tables[table_name], kind, key, value)
+    if args.dry_run:
+        plan.unit(table_name, kind, key, record_ids(value))
 
-for s in lda.tables['Subjects'].data:
+def write(table_name, fields, key, earlier=None):
+    """
+    Insert a record, or when running incrementally update the record that
+    matches the key with any changes (inserting it if there isn't one).
+    Something without a key updates the record an earlier run added for it
+    instead (earlier is its id), if it is still there.
+    """
+    table = lak.tables[table_name]
+    if args.incremental and key:
+        return table.upsert(key, fields)
+    if args.incremental and earlier and table.get(earlier):
+        return table.update_changed(table.get(earlier), fields)
+    return table.insert(fields)
+
+def add_subject(s):
     s_type = s['fields'].get('Subject Category')
     if s_type == 'Concept':
         table_name = 'Subjects'
@@ -62,59 +176,147 @@ for s in lda.tables['Subjects'].data:
         table_name = 'Events'
     else:
         print('migrate_lda: unknown subject type:', s)
-        continue
+        metrics.error('warnings', 'unknown subject type')
+        return
     lak.tables[table_name].get_or_insert({
         "Name": s['fields']['Name']
     })
 
-for e in lda.tables['Entities'].data:
-    obj = {'Name': e['fields'].get('Name')}
+def add_entity(e):
     extra = None
 
     e_type = e['fields']['Entity Category']
     if e_type in ['Person', 'Person (LCHP Team)']:
-        f, m, l, s = parse_name(obj['Name'])
         table_name = 'People'
-        obj = {
-            "First Name": f,
-            "Middle Name": m,
-            "Last Name": l,
-            "Suffix Name": s,
-            "Source Code": e["fields"].get("Source Code"),
-            "Alternate Name": e["fields"].get("Alternate Name"),
-        }
         if e_type == 'Person (LCHP Team)':
             extra = {'LCHP Staff': True}
     elif e_type == 'Corporate Body':
         table_name = 'Organizations'
-        for col in ["Source Code", "Address", "Latitude", "Longitude"]:
-            obj[col] = e["fields"].get(col)
     elif e_type == 'Family':
         table_name = 'Families'
     elif e_type == 'Place':
         table_name = 'Places'
-        for col in ["Source Code", "Address", "Latitude", "Longitude"]:
-            obj[col] = e["fields"].get(col)
     else:
         print('migrate_lda: unknown entity type:', e)
-        continue
+        metrics.error('warnings', 'unknown entity type')
+        return
 
-    lak.tables[table_name].get_or_insert(obj, extra)
+    lak.tables[table_name].get_or_insert(entity_fields(e, table_name), extra)
 
-def localize(url):
+def entity_fields(entity, lak_table):
+    """
+    Get the fields an LDA entity is found (or inserted) with in a Lakeland
+    Temp table. They are the same wherever the entity is used, so lookups
+    all go to the same index.
+    """
+    if lak_table == 'People':
+        fields = person_fields(entity['fields']['Name'])
+        fields["Source Code"] = entity['fields'].get('Source Code')
+        fields["Alternate Name"] = entity['fields'].get('Alternate Name')
+        return fields
+
+    fields = {"Name": entity['fields'].get('Name')}
+    if lak_table in ['Places', 'Organizations']:
+        for col in ["Source Code", "Address", "Latitude", "Longitude"]:
+            fields[col] = entity['fields'].get(col)
+    return fields
+
+def download_args(url):
+    """
+    Get the (url, filename, auth) to use when downloading a url to tmp.
+    """
     if 'lakeland.umd.edu/asa' in url or 'reclaim.hosting/asa/' in url:
         auth = ('lakeland', asa_password)
     else:
         auth = None
 
-    local_filename = pathlib.Path('tmp') / (url.split('/')[-1] or 'file')
-    with requests.get(url, stream=True, auth=auth) as r:
-        r.raise_for_status()
-        with open(local_filename, 'wb') as f:
-            for chunk in r.iter_content(chunk_size=8192): 
-                f.write(chunk)
+    # prefix with a hash of the url since downloads run concurrently and
+    # different urls can end with the same name
+    url_hash = hashlib.sha1(url.encode('utf8')).hexdigest()[:10]
+    filename = '{}-{}'.format(url_hash, url.split('/')[-1] or 'file')
+
+    return url, filename, auth
 
-    return pathlib.Path(local_filename)
+# the url each file in tmp was downloaded from, and how many of the files
+# being stored are that download: a Files row can be linked to more than one
+# item, and items are processed concurrently, so the same url can be needed
+# by several of them at once
+downloads = {}
+download_users = collections.Counter()
+download_lock = threading.Lock()
+url_locks = collections.defaultdict(threading.Lock)
+
+def stored_path(url):
+    """
+    Get the path to a stored copy of what was downloaded from a url before.
+    The old media these urls point at doesn't change, so it doesn't need to
+    be downloaded again.
+    """
+    sha256 = http_cache.get_sha256(url)
+    location = store.lookup(sha256) if sha256 else None
+    return store.root / location if location else None
+
+@contextlib.contextmanager
+def locked(urls):
+    """
+    Hold the locks for some urls, so that only one download of each is made
+    and then shared.
+    """
+    with download_lock:
+        locks = [url_locks[url] for url in sorted(set(urls))]
+    with contextlib.ExitStack() as stack:
+        for lock in locks:
+            stack.enter_context(lock)
+        yield
+
+def downloaded(url):
+    """
+    Get the path to a download of a url that is in tmp and not stored yet.
+    """
+    path = downloader.dest / download_args(url)[1]
+    return path if path.is_file() else None
+
+def use_download(path, url):
+    with download_lock:
+        downloads[str(path)] = url
+        download_users[str(path)] += 1
+
+@metrics.timed('localize')
+def localize(url):
+    with locked([url]):
+        path = stored_path(url)
+        if not path:
+            path = downloaded(url) or downloader.fetch(*download_args(url))
+            use_download(path, url)
+    return path
+
+def localize_all(urls):
+    with locked(urls):
+        paths = {url: stored_path(url) or downloaded(url) for url in urls}
+        missing = [url for url in urls if paths[url] is None]
+        for url, path in zip(missing, downloader.fetch_all([download_args(url) for url in missing])):
+            paths[url] = path
+        for url, path in paths.items():
+            if path.parent == downloader.dest:
+                use_download(path, url)
+    return [paths[url] for url in urls]
+
+def remember_download(path, sha256):
+    """
+    Remember the sha256 of what was downloaded to a path in tmp. Returns
+    True if the download isn't needed by anything else, and can be deleted.
+    """
+    with download_lock:
+        url = downloads.get(str(path))
+        if url is None:
+            return False
+        http_cache.set_sha256(url, sha256)
+        download_users[str(path)] -= 1
+        if download_users[str(path)] > 0:
+            return False
+        del downloads[str(path)]
+        del download_users[str(path)]
+        return True
 
 def get_asa(url):
     name = url.split('/')[-1]
@@ -123,19 +325,20 @@ def get_asa(url):
 def get_omeka_meta(url):
     omeka_id = url.split('/')[-1]
     url = 'https://lakeland.umd.edu/api/items/{}?key={}'.format(omeka_id, omeka_key)
-    resp = requests.get(url)
-    if resp.status_code == 200:
-        return resp.json()
-    else:
-        return None
+    return http_cache.get_json(url)
 
-def get_omeka_originals(url):
+def get_omeka_originals(url, cached=False):
     omeka_id = url.split('/')[-1]
     url = 'https://lakeland.umd.edu/api/files?item={}&key={}'.format(omeka_id, omeka_key)
-    resp = requests.get(url)
+    if cached:
+        # None if Omeka hasn't been asked about the item before
+        files = http_cache.peek_json(url)
+        if files is None:
+            return None
+    else:
+        files = http_cache.get_json(url)
     results = []
-    if resp.status_code == 200:
-        files = resp.json()
+    if files is not None:
         results = [f['file_urls']['original'] for f in files]
     return results
 
@@ -143,57 +346,59 @@ def get_google_drive(url):
     m = re.match(r'.+drive.google.com/.*file/./(.+)/view.+', url)
     if not m:
         print('migrate_lda: unknown Google Drive URL', url)
+        metrics.error('warnings', 'unknown Google Drive URL')
         return None
     file_id = m.group(1)
     return "https://www.googleapis.com/drive/v3/files/" + file_id + "?supportsAllDrives=true&alt=media&key=" + google_key
 
+# Description -> Accessions record, so each is only looked up (or added) once
+accession_records = {}
+
+def get_accession(description):
+    if description not in accession_records:
+        accession_records[description] = lak.tables['Accessions'].get_or_insert({
+            "Description": description
+        })
+    return accession_records[description]
+
 def get_accessions(f):
-    accessions = []
-
-    virtual_loc = f['fields'].get('Virtual Location', '')
-    if 'lakeland.umd.edu/asa' in virtual_loc:
-        accessions.append(
-            lak.tables['Accessions'].get_or_insert({
-                "Description": "ASA"
-            })
-        )
-    elif 'lakeland.umd.edu' in virtual_loc:
-        accessions.append(
-            lak.tables['Accessions'].get_or_insert({
-                "Description": "Lakeland Omeka Instance Images"
-            })
-        )
-   
-    files = f['fields'].get('File Path', '')
-    if 'Mary Sies Hard Drive' in files:
-        accessions.append(
-            lak.tables['Accessions'].get_or_insert({
-                "Description": "Mary Sies Hard Drive: Images"
-            })
-        )
-
-    if "Maxine Hard Drive" in files or "Maxine Gross Hard Drive" in files:
-        accessions.append(
-            lak.tables['Accessions'].get_or_insert({
-                "Description": "Maxine Gross Hard Drive: Images"
-            })
-        )
-
-    if "College Park Photos" in files:
-        accessions.append(
-            lak.tables['Accessions'].get_or_insert({
-                "Description": "College Park Photos"
-            })
-        )
-
-    if 'LCHP Accession 2021' in files:
-        accessions.append(
-            lak.tables['Accessions'].get_or_insert({
-                "Description": "LCHP Accession 2021"
-            })
-        )
-
-    return accessions
+    accessions = match_accessions(f['fields'].get('Virtual Location'), f['fields'].get('File Path'))
+    return [get_accession(description) for description in accessions]
+
+def drive_path(file_paths):
+    """
+    Get the path on the nfs mount of the first of a Files row's original paths.
+    """
+    orig_path = csv_list(file_paths)[0]
+
+    # these are relative to a different base directory one level up to keep
+    # things interesting I guess. thankfully all this code can be jettisoned
+    orig_path = orig_path.replace('/Projects/lakeland-digital-archive/object files/LCHP Accession 2021', '../LCHP Accession 2021')
+
+    # get the full path on the nfs share
+    return drive / orig_path
+
+def get_urls(loc, cached=False):
+    """
+    Get the URLs to download the files at a Virtual Location from. When
+    cached is true Omeka is only asked about items it has been asked about
+    before, and None is returned for the others.
+    """
+    uri = urlparse(loc)
+    host = uri.netloc
+
+    if host == 'mith-lakeland-media.s3-website-us-east-1.amazonaws.com':
+        return [loc]
+    elif host == 'raw.githubusercontent.com':
+        return [loc]
+    elif host == 'lakeland.umd.edu' and uri.path.startswith('/asa/'):
+        return [get_asa(loc)]
+    elif host == 'lakeland.umd.edu':
+        return get_omeka_originals(loc, cached)
+    elif host == "drive.google.com":
+        url = get_google_drive(loc)
+        return [url] if url else []
+    return []
 
 def get_paths(f):
 
@@ -203,130 +408,177 @@ def get_paths(f):
     paths = []
 
     if file_paths:
-        # get the first original path and look for it in nfs mount
-        orig_path = csv_list(file_paths)[0]
-
-        # these are relative to a different base directory one level up to keep
-        # things interesting I guess. thankfully all this code can be jettisoned
-        orig_path = orig_path.replace('/Projects/lakeland-digital-archive/object files/LCHP Accession 2021', '../LCHP Accession 2021')
-
-        # get the full path on the nfs share
-        path = drive / orig_path
+        # look for the first original path in nfs mount
+        path = drive_path(file_paths)
 
         if not path.is_file():
-            print("migrate_lda: file {} doesn't exist for {}".format(path, f))
+            print("migrate_lda: file {} doesn't exist for {} {}".format(path, f['id'], f['fields']))
+            metrics.error('warnings', 'missing file')
         else:
             paths = [path]
 
     elif loc:
-        uri = urlparse(loc)
-        host = uri.netloc
-
         try:
-            if host == 'mith-lakeland-media.s3-website-us-east-1.amazonaws.com':
-                paths = [localize(loc)]
-            elif host == 'raw.githubusercontent.com':
-                paths = [localize(loc)]
-            elif host == 'lakeland.umd.edu' and uri.path.startswith('/asa/'):
-                paths = [localize(get_asa(loc))]
-            elif host == 'lakeland.umd.edu':
-                paths = list(map(localize, get_omeka_originals(loc)))
-            elif host == "drive.google.com":
-                paths = [localize(get_google_drive(loc))]
+            urls = get_urls(loc)
+            paths = localize_all(urls) if len(urls) > 1 else [localize(url) for url in urls]
         except requests.exceptions.HTTPError as e:
             print("migrate_lda: encountered HTTP error when downloading loc: {}".format(e))
+            metrics.error('warnings', 'download HTTP error')
 
     return paths
 
-def get_files(f):
+def download_files(job):
+    """
+    Pipeline stage: locate or download the files for each of an item's
+    Files rows. If a row's accession or files can't be found we stop right
+    away, and the item won't get any files.
+    """
+    for f in job['item']['fields']['Files']:
 
-    # get the accession that the file is a part of (could be more than one)
-    # because of duplication within hard drives that have been processed
-    # if there aren't any we can't save the file so we need to stop
+        # files that were added by an earlier run
+        if done('File', f['id']):
+            job['files'].append({"file": f, "done": journal.get('File', f['id']), "paths": []})
+            continue
 
-    accessions = get_accessions(f)
-    if len(accessions) == 0:
-        return []
+        # get the accession that the file is a part of (could be more than one)
+        # because of duplication within hard drives that have been processed
+        # if there aren't any we can't save the file so we need to stop
 
-    files = []
-    for path in get_paths(f):
-        mimetype = magic.from_file(path.as_posix(), mime=True)
-        sha256 = get_sha256(path)
-        size = path.stat().st_size
-        ext = get_ext(mimetype)
-        duration = f['fields'].get('Duration')
-
-        obj = {
-            "Accession": [a['id'] for a in accessions],
-            "SHA256": sha256,
-            "Format": mimetype,
-            "Size": size,
-            "Original Filenames": f['fields'].get('File Path'),
-            "Duration": duration
-        }
+        accessions = job['accessions'][f['id']]
+        paths = get_paths(f) if len(accessions) > 0 else []
+        if len(paths) == 0:
+            job['missing'] = True
+            break
 
-        # look for an existing file with the same sha256
-        # if one is found it needs to be updated
+        job['files'].append({"file": f, "accessions": accessions, "paths": paths})
 
-        afile = lak.tables['Files'].find({"SHA256": sha256}, first=True)
-        if afile and 'File Path' in f['fields']:
-            # merge the csv lists of original filenames
-            filenames = csv_list(afile['fields'].get('Original Filenames', ''))
-            filenames.extend(csv_list(f['fields']['File Path']))
-            obj['Original Filenames'] = csv_str(filenames)
-            afile = lak.tables['Files'].update(afile['id'], obj)
+    return job
 
-        # otherwise we need to insert a new row
-        else:
+def store_files(job):
+    """
+    Pipeline stage: hash, sniff and store the files that were located.
+    """
+    for entry in job['files']:
+        entry['stored'] = []
+        for path in entry['paths']:
 
-            # save the file to storage using the first accession, 
-            # checksum, sha256, and file extension to determine the path
-            # the relative path to a storage root is returned for saving
-            # in the Airtable Files table as Location.
+            # store the file using the first accession, sha256 and file extension
+            # to determine the path. The relative path to the storage root is
+            # returned for saving in the Airtable Files table as Location.
             #
-            # Note: a file can be part of more than one accession, so 
-            # but the file should only live at one physical location and 
+            # Note: a file can be part of more than one accession, so
+            # but the file should only live at one physical location and
             # not be duplicated so we pick the first one.
 
-            obj['Location'] = save_file(
-                path,
-                accessions[0]['fields']['ID'], # can be more than one
-                sha256,
-                ext
-            )
+            # A row that will be merged into a record for the same content
+            # doesn't need a copy of its own, so one isn't made if the
+            # content is already stored.
+
+            place = not merges(entry['file'])
+            entry['stored'].append(store_path(path, entry['accessions'][0], place)) # can be more than one
+
+    return job
+
+def store_path(path, accession, place=True):
+    """
+    Store a located file in an accession's directory. Returns its location,
+    sha256, mimetype and size.
+    """
+    stored = ingest(path, accession['fields']['ID'], place)
+
+    # only delete things that were downloaded to tmp, once they are stored
+    if remember_download(path, stored[1]):
+        os.remove(path)
+
+    return stored
+
+def write_item(job):
+    """
+    Pipeline stage: add the item's files and then the item to Airtable. This
+    stage has a single worker since it is the only one that uses lak.
+    """
+    files = []
+    for entry in job['files']:
+        if 'done' in entry:
+            files.extend(filter(None, map(lak.tables['Files'].get, entry['done'])))
+            continue
+        new_files = [add_file(entry['file'], entry['accessions'], *stored) for stored in entry['stored']]
+        record('Files', 'File', entry['file']['id'], new_files)
+        files.extend(new_files)
+
+    # if files can't be found the item doesn't get any
+    if job['missing']:
+        files = []
+
+    lak_item = add_item(job['item'], files)
+    record('Items', 'Item', job['item']['id'], lak_item)
+    metrics.count('item')
 
-            afile = lak.tables['Files'].insert(obj)
+def merges(f):
+    """
+    Is an LDA Files row merged into the Lakeland Files record with the same
+    content, if there is one? Files from a Virtual Location are only merged
+    when running incrementally, when the file may well be one that an
+    earlier run added for the same row.
+    """
+    return 'File Path' in f['fields'] or args.incremental
+
+def add_file(f, accessions, location, sha256, mimetype, size):
+    duration = f['fields'].get('Duration')
+
+    obj = {
+        "Accession": [a['id'] for a in accessions],
+        "SHA256": sha256,
+        "Format": mimetype,
+        "Size": size,
+        "Original Filenames": f['fields'].get('File Path'),
+        "Duration": duration
+    }
+
+    # look for an existing file with the same sha256
+    # if one is found it needs to be updated
+
+    afile = lak.tables['Files'].find({"SHA256": sha256}, first=True)
+    if afile and merges(f):
+
+        # the existing record already has a stored copy (if the content was
+        # stored before this row's wasn't put at location at all)
+        if location and afile['fields'].get('Location') != location:
+            store.remove(location)
+        if args.dry_run:
+            plan.merges['Files'] += 1
+
+        # merge the csv lists of original filenames
+        if 'File Path' in f['fields']:
+            filenames = csv_list(afile['fields'].get('Original Filenames', ''))
+            filenames.extend(fn for fn in csv_list(f['fields']['File Path']) if fn not in filenames)
+            obj['Original Filenames'] = csv_str(filenames)
+        else:
+            del obj['Original Filenames']
+        afile = lak.tables['Files'].update(afile['id'], obj)
 
-            # only delete things that were downloaded to tmp
-            if str(path).startswith("tmp"):
-                os.remove(path)
+    # otherwise we need to insert a new row, with a copy of its own
+    else:
+        if location:
+            store.place(sha256, location, size)
+        obj['Location'] = location
+        afile = lak.tables['Files'].insert(obj)
 
-        files.append(afile)
+    # the record is returned rather than its id so that buffered
+    # inserts aren't flushed one file at a time
+    return afile
 
-    return [f['id'] for f in files]
+# (Lakeland Temp table, LDA record id) -> Lakeland Temp record
+lak_entities = {}
 
+@metrics.timed('get_entities')
 def get_entities(entities, lak_table):
     entity_ids = []
     for entity in entities:
-        fields = {"Name": entity['fields']['Name']}
-        if lak_table == 'People':
-            f, l, m, s = parse_name(entity['fields']['Name'])
-            fields = {
-                "First Name": f,
-                "Last Name": l,
-                "Middle Name": m,
-                "Suffix Name": s,
-                "Source Code": entity['fields'].get('Source Code'),
-                "Alternate Name": entity['fields'].get('Alternate Name')
-            }
-        elif lak_table in ['Places', 'Organizations']:
-            fields['Source Code'] = entity['fields'].get('Source Code')
-            fields['Address'] = entity['fields'].get('Address')
-            fields['Latitude'] = entity['fields'].get('Latitude')
-            fields['Longitude'] = entity['fields'].get('Longitude')
-
-        lak_obj = lak.tables[lak_table].get_or_insert(fields)
-        entity_ids.append(lak_obj['id'])
+        key = (lak_table, entity['id'])
+        if key not in lak_entities:
+            lak_entities[key] = lak.tables[lak_table].get_or_insert(entity_fields(entity, lak_table))
+        entity_ids.append(lak_entities[key]['id'])
     return entity_ids
 
 def replace(s1, s2, l):
@@ -340,18 +592,7 @@ def replace(s1, s2, l):
             new_l.append(s)
     return list(set(new_l))
 
-for i in lda.tables['Items'].data:
-    files = []
-    for f in i['fields']['Files']:
-        new_files = get_files(f)
-
-        # if files can't be found stop right away
-        if len(new_files) == 0:
-            files = []
-            break
-
-        files.extend(new_files)
-
+def add_item(i, files):
     creators = get_entities(i['fields'].get('Creator', []), 'People')
     interviewers = get_entities(i['fields'].get('Interviewer', []), 'People')
     interviewees = get_entities(i['fields'].get('Interviewee', []), 'People')
@@ -392,12 +633,13 @@ for i in lda.tables['Items'].data:
     otypes = replace("OralHistory", "Oral History", otypes)
     otypes = replace("Publications", "Publication", otypes)
 
-    lak.tables['Items'].insert({
+    legacy_id = i['fields'].get('Legacy ID-UMD')
+    return write('Items', {
         "Title": i['fields'].get('Title'),
         "Description": i['fields'].get('Description'),
         "Legacy UMD ID": i['fields'].get('Legacy ID-UMD'),
         "Type": otypes,
-        "Files": files,
+        "Files": [f['id'] for f in files],
         "Created": i['fields'].get('Creation Date'),
         "In Lakeland Book?": i['fields'].get('In Lakeland Book?'),
         "Lakeland Book Chapter": i['fields'].get('Lakeland Book Chapter'),
@@ -415,49 +657,254 @@ for i in lda.tables['Items'].data:
         "Source (People)": source_people,
         "Source (Organizations)": source_orgs,
         "Source (Families)": source_fams
-    })
+    }, {"Legacy UMD ID": legacy_id} if legacy_id else None, journal.get('Item', i['id']))
 
-# add interview transcripts as files attached to items
+def add_transcript(source):
+    """
+    Download and store an interview transcript and add it to Files. The
+    source has its url and filename, and the id of its accession.
+    """
+    accession = lak.tables['Accessions'].get(source['accession'])
+    location, sha256, mimetype, size = store_path(localize(source['url']), accession)
+    return write('Files', {
+        "Accession": [accession['id']],
+        "SHA256": sha256,
+        "Format": mimetype,
+        "Size": size,
+        "Original Filenames": source['filename'],
+        "Location": location
+    }, {"SHA256": sha256})
+
+def predict_path(path):
+    """
+    Dry run: get the sha256, mimetype and size of a file on the nfs mount,
+    if it was read by an earlier run, and plan to copy it if it isn't
+    already stored.
+    """
+    st = path.stat()
+    sha256, mimetype = store.known(path, st) or (None, None)
+    if not (sha256 and store.lookup(sha256)):
+        plan.copy(path, st.st_size)
+    return sha256, mimetype, st.st_size
+
+def predict_url(url):
+    """
+    Dry run: get the sha256, mimetype and size of what is at a url, if it
+    was downloaded by an earlier run, or plan to download it.
+    """
+    path = stored_path(url)
+    if path is None:
+        plan.download(http_cache.key(url))
+        return http_cache.get_sha256(url), None, None
+    sha256, mimetype = store.known(path) or (http_cache.get_sha256(url), None)
+    return sha256, mimetype, path.stat().st_size
+
+def plan_file(f, accessions):
+    """
+    Dry run: add_file() for each of the files of an LDA Files row, using
+    what earlier runs learned about their content instead of reading them.
+    Returns the new (or merged) Files records, or None if there aren't any
+    files to add.
+    """
+    file_paths = f['fields'].get('File Path')
+    loc = f['fields'].get('Virtual Location')
+
+    contents = []
+    if file_paths:
+        path = drive_path(file_paths)
+        if not path.is_file():
+            print("migrate_lda: file {} doesn't exist for {} {}".format(path, f['id'], f['fields']))
+            metrics.error('warnings', 'missing file')
+            return None
+        contents.append(predict_path(path))
+    elif loc:
+        urls = get_urls(loc, cached=True)
+        if urls is None:
+            # Omeka has to be asked what to download, so assume one file
+            plan.lookup(loc)
+            contents.append((None, None, None))
+        else:
+            contents.extend(predict_url(url) for url in urls)
+
+    if not contents:
+        return None
 
-for item in lda.tables['Items'].data:
     files = []
-    lak_item = None
+    with plan.reading({"file": f['id'], "accessions": [a['id'] for a in accessions]}):
+        for sha256, mimetype, size in contents:
+            if sha256:
+                files.append(add_file(f, accessions, None, sha256, mimetype, size))
+            else:
+                files.append(lak.tables['Files'].insert({
+                    "Accession": [a['id'] for a in accessions],
+                    "Size": size,
+                    "Original Filenames": f['fields'].get('File Path'),
+                    "Duration": f['fields'].get('Duration')
+                }))
+    return files
+
+def plan_item(i, accessions):
+    """
+    Dry run: what the pipeline does for an item, with plan_file() standing
+    in for locating, downloading and storing its files.
+    """
+    files = []
+    for f in i['fields']['Files']:
+        if done('File', f['id']):
+            files.extend(filter(None, map(lak.tables['Files'].get, journal.get('File', f['id']))))
+            continue
 
-    for interview in item['fields'].get('Interview Summary', []):
-        old_id = item['fields'].get('Legacy ID-UMD')
-        lak_item = lak.tables['Items'].find({'Legacy UMD ID': old_id}, first=True)
+        new_files = plan_file(f, accessions[f['id']]) if accessions[f['id']] else None
 
-        orig_filename = interview['filename']
-        path = localize(interview['url'])
-        mimetype = magic.from_file(path.as_posix(), mime=True)
-        sha256 = get_sha256(path)
-        size = path.stat().st_size
-        ext = get_ext(mimetype)
+        # if files can't be found the item doesn't get any
+        if new_files is None:
+            files = []
+            break
 
-        accession = lak.tables['Accessions'].find({"Description": "LCHP Accession 2021"}, first=True)
+        record('Files', 'File', f['id'], new_files)
+        files.extend(new_files)
 
-        location = save_file(
-            path,
-            accession['fields']['ID'],
-            sha256,
-            ext
-        )
+    lak_item = add_item(i, files)
+    record('Items', 'Item', i['id'], lak_item)
+    metrics.count('item')
 
-        afile = lak.tables['Files'].insert({
-            "Accession": [accession['id']],
+def plan_transcript(source):
+    """
+    Dry run: add_transcript() without downloading the transcript.
+    """
+    sha256, mimetype, size = predict_url(source['url'])
+    with plan.reading(source):
+        return write('Files', {
+            "Accession": [source['accession']],
             "SHA256": sha256,
             "Format": mimetype,
             "Size": size,
-            "Original Filenames": orig_filename,
-            "Location": location
-        })
- 
-        # only delete things that were downloaded to tmp
-        if str(path).startswith("tmp"):
-            os.remove(path)
+            "Original Filenames": source['filename']
+        }, {"SHA256": sha256} if sha256 else None)
+
+def read_source(source):
+    """
+    Applying a plan: read, store and add the files that it could only
+    predict, returning the Files records for them.
+    """
+    if 'file' not in source:
+        return add_transcript(source)
+    f = lda.tables['Files'].get(source['file'])
+    accessions = [lak.tables['Accessions'].get(id) for id in source['accessions']]
+    return [add_file(f, accessions, *store_path(path, accessions[0], not merges(f))) for path in get_paths(f)]
+
+if args.apply:
+    metrics.show_progress(['ingest', 'download', 'airtable.post', 'airtable.patch'])
+    journal.record('Plan', plan.meta['id'])
+    plan.execute(lak, read_source, journal)
+    lak.flush()
+    metrics.stop_progress()
+    save_sync('migrate_lda', plan.meta['fetched'], generation)
+    sys.exit()
+
+# When running incrementally only the records that have been modified since
+# the last successful run are migrated, and they update what is already there.
+if args.incremental:
+    since = last_sync('migrate_lda', generation)
+    if since is None:
+        parser.error('there has not been a successful full run to update')
+    changed = lda.refresh_since(since)
+else:
+    # Items are streamed into the pipeline below while the rest is fetched
+    changed = {name: table.data for name, table in lda.tables.items() if name not in lda.stream}
+
+# Files rows that need to be processed again even if an earlier run did them
+redo_files = {f['id'] for f in changed['Files']} if args.incremental else set()
+
+# the same people turn up in many items, so their names are parsed once up front
+warm_name_cache(
+    e['fields'].get('Name') for e in lda.tables['Entities'].data
+    if e['fields'].get('Entity Category', '').startswith('Person')
+)
+
+for s in changed['Subjects']:
+    add_subject(s)
+
+for e in changed['Entities']:
+    add_entity(e)
+
+# Items that were added by an earlier run are skipped. When running
+# incrementally the items that changed or have files that changed are done.
+
+if args.incremental:
+    changed_items = {i['id'] for i in changed['Items']}
+    items = [
+        i for i in lda.tables['Items'].data
+        if i['id'] in changed_items or any(f['id'] in redo_files for f in i['fields'].get('Files', []))
+    ]
+else:
+    items = (i for i in lda.tables['Items'].stream() if not done('Item', i['id']))
+
+if not args.dry_run:
+    pipeline = Pipeline([
+        (download_files, args.download_workers),
+        (store_files, args.store_workers),
+        (write_item, 1)
+    ])
+
+metrics.show_progress(['item', 'download', 'ingest', 'airtable.post'],
+                      totals={'item': len(items)} if args.incremental else None)
+
+# The accessions for an item's files are looked up (and saved) before it goes
+# into the pipeline, so that only the write stage uses the other lak tables
+# while it is running.
+
+for i in items:
+    accessions = {}
+    for f in i['fields']['Files']:
+        if not done('File', f['id']):
+            accessions[f['id']] = get_accessions(f)
+    if args.dry_run:
+        plan_item(i, accessions)
+        continue
+    lak.tables['Accessions'].flush()
+    pipeline.put({"item": i, "accessions": accessions, "files": [], "missing": False})
+
+if not args.dry_run:
+    pipeline.join()
+metrics.stop_progress()
+
+# add interview transcripts as files attached to items
+
+for item in items if args.incremental else lda.tables['Items'].data:
+    if done('Transcripts', item['id']):
+        continue
+
+    files = []
+    lak_item = None
+
+    for interview in item['fields'].get('Interview Summary', []):
+        old_id = item['fields'].get('Legacy ID-UMD')
+        lak_item = lak.tables['Items'].find({'Legacy UMD ID': old_id}, first=True)
+
+        accession = get_accession("LCHP Accession 2021")
+
+        source = {"url": interview['url'], "filename": interview['filename'], "accession": accession['id']}
+        afile = plan_transcript(source) if args.dry_run else add_transcript(source)
 
         files.append(afile['id'])
 
     if lak_item is not None:
         lak.tables['Items'].update(lak_item['id'], {"Files": files})
 
+    if files:
+        record('Items', 'Transcripts', item['id'], files)
+
+if args.dry_run:
+    plan.meta.update({"fetched": lda.fetched, "incremental": args.incremental})
+    plan_path = time.strftime('plans/migrate_lda-%Y%m%d-%H%M%S.json')
+    plan.save(plan_path)
+    print(json.dumps(plan.summary(), indent=2))
+    print('migrate_lda: saved the plan in {}, apply it with --apply {}'.format(plan_path, plan_path))
+    sys.exit()
+
+# send any writes that are still buffered
+lak.flush()
+
+# the next incremental run only needs what has changed since LDA was fetched
+save_sync('migrate_lda', lda.fetched, generation)
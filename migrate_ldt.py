@@ -1,16 +1,25 @@
 #!/usr/bin/env python3
 
 import os
-import magic
+import time
+import argparse
 import pathlib
 
 from dotenv import load_dotenv
+from journal import Journal, last_sync, save_sync, last_wipe, save_wipe
+from metrics import metrics
 from ldt_images import get_orig
-from schema import Base, parse_name, get_sha256, save_file, get_ext
+from schema import Base, warm_name_cache, person_fields, ingest
 
 load_dotenv()
 airtable_key = os.environ.get('AIRTABLE_KEY')
 
+parser = argparse.ArgumentParser(description='Migrate the Lakeland Digitization Tracking base into Lakeland Temp.')
+parser.add_argument('--refresh', action='store_true', help='fetch LDT from Airtable even if there is a recent snapshot')
+parser.add_argument('--restart', action='store_true', help='start again from an empty base instead of resuming the last run')
+parser.add_argument('--incremental', action='store_true', help='only migrate LDT records modified since the last successful run')
+args = parser.parse_args()
+
 # Lakeland Digitization Data S3 bucket
 # s3://mith-lastclass-raw
 media = pathlib.Path("mith-lastclass-raw")
@@ -37,6 +46,17 @@ ldt = Base("appkzHtR3oryuaKfm", airtable_key, {
     "Subjects": {},
     "Locations": {},
     "QA": {}
+}, snapshot_dir='snapshots', snapshot_ttl=7 * 24 * 60 * 60, refresh=args.refresh, fields={
+    # only the fields that are migrated are fetched (links are always fetched)
+    "Folder": [
+        "Folder ID", "Date of donation", "Accession Notes", "Inventory Form",
+        "Consent Form"
+    ],
+    "Items": ["Title", "Object Type", "Places", "Readable Item ID"],
+    "Images": ["Image ID", "Image Description"],
+    "People": ["Name"],
+    "Subjects": ["Name"],
+    "Locations": ["Name"]
 })
 
 
@@ -53,80 +73,151 @@ lak = Base('appqn0kIOXRo00kdN', airtable_key, {
     "Events": {},
     "Families": {}
 
-})
-
-# First wipe the slate clean.
-lak.wipe()
+}, buffered=True)
+
+# Units of work that have been completed, so an interrupted run can resume.
+# The journal is emptied when a run finishes, so the next run starts over.
+journal = Journal('checkpoints/migrate_ldt.jsonl')
+if args.restart:
+    journal.reset()
+
+# Write a report of where the time went when the run finishes (or fails).
+metrics.save_at_exit(time.strftime('reports/migrate_ldt-%Y%m%d-%H%M%S.json'))
+metrics.include('ldt scheduler', ldt.scheduler.stats)
+metrics.include('lak scheduler', lak.scheduler.stats)
+
+# When running incrementally only the records that have been modified since
+# the last successful run are migrated, and they update what is already there.
+if args.incremental:
+    since = last_sync('migrate_ldt', last_wipe(lak.id))
+    if since is None:
+        parser.error('there has not been a successful full run to update')
+    changed = ldt.refresh_since(since)
+else:
+    changed = {name: table.data for name, table in ldt.tables.items()}
+
+# the same people are donors and turn up in many images and items, so their
+# names are parsed once up front
+warm_name_cache(p['fields'].get('Name') for p in ldt.tables['People'].data)
+
+def done(kind, key):
+    """
+    Was this unit completed by the earlier run that is being resumed, and is
+    the record it added still there?
+    """
+    if args.incremental or (kind, key) not in journal:
+        return False
+    table = lak.tables['Items' if kind in ('Item', 'ImageItem') else kind]
+    return table.get(journal.get(kind, key)) is not None
+
+def write(table_name, fields, key):
+    """
+    Insert a record, or when running incrementally update the record that
+    matches the key with any changes (inserting it if there isn't one).
+    """
+    if args.incremental:
+        return lak.tables[table_name].upsert(key, fields)
+    return lak.tables[table_name].insert(fields)
+
+def get_file(image_id):
+    """
+    Get the Files record for an image, which may be from an earlier run.
+    """
+    file_rec = image_file_map.get(image_id)
+    if not file_rec and args.incremental:
+        file_rec = lak.tables['Files'].find({'Legacy Image ID': image_id}, first=True)
+    return file_rec
+
+# LDT People record id -> Lakeland Temp People record
+lak_people = {}
+
+@metrics.timed('get_person')
+def get_person(p):
+    """
+    Get (or add) the Lakeland Temp People record for an LDT People record.
+    """
+    if p['id'] not in lak_people:
+        lak_people[p['id']] = lak.tables['People'].get_or_insert(person_fields(p['fields']['Name']))
+    return lak_people[p['id']]
+
+# First wipe the slate clean, unless an earlier run is being resumed.
+if not args.incremental and ('wipe', lak.id) not in journal:
+    lak.wipe()
+    # what migrate_lda added is gone too, so its journal has to start over
+    save_wipe(lak.id, time.time())
+    journal.record('wipe', lak.id)
 
 # Populate authorities
 
-for p in ldt.tables['People'].data:
-    if 'Name' not in p['fields']:
+for p in changed['People']:
+    if 'Name' not in p['fields'] or done('People', p['id']):
         continue
-    first, middle, last, suffix = parse_name(p['fields']['Name'])
-    lak.tables['People'].insert({
-        "First Name": first,
-        "Middle Name": middle,
-        "Last Name": last,
-        "Suffix Name": suffix
-    })
-
-for p in ldt.tables['Locations'].data:
-    if 'Name' not in p['fields']:
+    name = person_fields(p['fields']['Name'])
+    lak_people[p['id']] = write('People', name, name)
+    journal.record_after(lak.tables['People'], 'People', p['id'], lak_people[p['id']])
+
+for p in changed['Locations']:
+    if 'Name' not in p['fields'] or done('Places', p['id']):
         continue
-    lak.tables['Places'].insert({
-        'Name': p['fields']['Name']
-    })
+    name = {'Name': p['fields']['Name']}
+    place = write('Places', name, name)
+    journal.record_after(lak.tables['Places'], 'Places', p['id'], place)
 
-for s in ldt.tables['Subjects'].data:
-    if 'Name' not in s['fields']:
+for s in changed['Subjects']:
+    if 'Name' not in s['fields'] or done('Subjects', s['id']):
         continue
-    lak.tables['Subjects'].insert({
-        'Name': s['fields']['Name']
-    })
+    name = {'Name': s['fields']['Name']}
+    subject = write('Subjects', name, name)
+    journal.record_after(lak.tables['Subjects'], 'Subjects', s['id'], subject)
 
 
 # Folders -> Accessions, Files
 
 
-# image id -> file id mapping for use later
+# image id -> file record mapping for use later
 image_file_map = {}
 
-for f in ldt.tables['Folder'].data:
+metrics.show_progress(['folder', 'get_orig', 'ingest', 'item'], totals={
+    'folder': len(changed['Folder']),
+    'item': len(changed['Items'])
+})
 
-    donors = []
-
-    # get or add the donor
-    for person in f['fields']['Donor Name']:
-        first, middle, last, suffix = parse_name(person['fields']['Name'])
-        d = lak.tables['People'].get_or_insert({
-            "First Name": first,
-            "Middle Name": middle,
-            "Last Name": last,
-            "Suffix Name": suffix
-        })
-        donors.append(d['id'])
-
-    # add any attachments
-    docs = []
-    for a in f['fields'].get('Inventory Form', []):
-        docs.append({'url': a['url']})
-    for a in f['fields'].get('Consent Form', []):
-        docs.append({'url': a['url']})
-
-    # add each of the accessions
-    accession = lak.tables['Accessions'].insert({
-        "Donor": donors,
-        "Date of Donation": f["fields"].get("Date of donation"),
-        "Description": f["fields"].get("Accession Notes"),
-        "Documentation": docs, 
-        "Legacy Folder ID": f["fields"].get("Folder ID")
-    })
+for f in changed['Folder']:
+    metrics.count('folder')
+
+    # the accession could have been added by an earlier run
+    accession = lak.tables['Accessions'].get(journal.get('Accession', f['id']))
+
+    if not accession or args.incremental:
+        donors = []
+
+        # get or add the donor
+        for person in f['fields']['Donor Name']:
+            donors.append(get_person(person)['id'])
+
+        # add any attachments, with their filenames so that upsert() can
+        # tell whether they have changed
+        docs = []
+        for a in f['fields'].get('Inventory Form', []):
+            docs.append({'url': a['url'], 'filename': a['filename']})
+        for a in f['fields'].get('Consent Form', []):
+            docs.append({'url': a['url'], 'filename': a['filename']})
+
+        # add each of the accessions
+        accession = write('Accessions', {
+            "Donor": donors,
+            "Date of Donation": f["fields"].get("Date of donation"),
+            "Description": f["fields"].get("Accession Notes"),
+            "Documentation": docs, 
+            "Legacy Folder ID": f["fields"].get("Folder ID")
+        }, {"Legacy Folder ID": f["fields"].get("Folder ID")})
+        journal.record_after(lak.tables['Accessions'], 'Accession', f['id'], accession)
 
     # make sure the folder is on disk
     folder_id = f['fields']['Folder ID']
     if not (media / folder_id).is_dir():
         print("migrate_ldt: missing folder for {}".format(folder_id))
+        metrics.error('warnings', 'missing folder')
         continue
 
     # get the original file for each linked image
@@ -138,36 +229,40 @@ for f in ldt.tables['Folder'].data:
             files.append(orig)
         else:
             print("migrate_ldt: couldn't find image for {}".format(image_id))
+            metrics.error('warnings', 'missing image')
 
     # sort them so they appear in sequence
     for image in sorted(files, key=lambda r: r['id']):
-        image_path = pathlib.Path(image['path'])
-        mimetype = magic.from_file(image_path.as_posix(), mime=True)
-        sha256 = get_sha256(image_path)
-        size = image_path.stat().st_size
-        ext = get_ext(mimetype)
-
-        location = save_file(
-            image_path,
-            accession['fields']['ID'],
-            sha256,
-            ext
-        )
-
-        img = lak.tables['Files'].insert({
-            "Accession": [accession['id']],
-            "SHA256": sha256,
-            "Format": mimetype,
-            "Size": size,
-            "Location": location,
-            "Original Filenames": image_path.as_posix().replace('/home/ubuntu/lakeland-data-munging/', ''),
-            "Legacy Image ID": image['id']
-        })
-        image_file_map[image['id']] = img['id']
+
+        # the file could have been ingested by an earlier run
+        img = lak.tables['Files'].get(journal.get('File', image['id'])) or get_file(image['id'])
+
+        if not img:
+            image_path = pathlib.Path(image['path'])
+
+            location, sha256, mimetype, size = ingest(
+                image_path,
+                accession['fields']['ID']
+            )
+
+            img = lak.tables['Files'].insert({
+                "Accession": [accession['id']],
+                "SHA256": sha256,
+                "Format": mimetype,
+                "Size": size,
+                "Location": location,
+                "Original Filenames": image_path.as_posix().replace('/home/ubuntu/lakeland-data-munging/', ''),
+                "Legacy Image ID": image['id']
+            })
+            journal.record_after(lak.tables['Files'], 'File', image['id'], img)
+
+        image_file_map[image['id']] = img
 
 # Images -> Items
 
-for image in ldt.tables['Images'].data:
+for image in changed['Images']:
+    if done('ImageItem', image['id']):
+        continue
 
     # see if there is descriptive metadata about the image, if so add it as an item
     # "Image Description", "People (Image Level)", "Places (Image Level)", 
@@ -197,29 +292,26 @@ for image in ldt.tables['Images'].data:
     for p in image['fields'].get('People (Image Level)', []):
         if 'Name' not in p['fields']:
             continue
-        first, middle, last, suffix = parse_name(p['fields']['Name'])
-        person = lak.tables['People'].get_or_insert({
-            "First Name": first,
-            "Middle Name": middle,
-            "Last Name": last,
-            "Suffix Name": suffix
-        })
-        people.add(person['id'])
+        people.add(get_person(p)['id'])
 
-    file_id = image_file_map.get(image['fields']['Image ID'])
+    file_rec = get_file(image['fields']['Image ID'])
 
-    if file_id and (title or subjects or people or places):
-        lak.tables['Items'].insert({
+    if file_rec and (title or subjects or people or places):
+        lak_item = write('Items', {
             "Title": title,
             "Subjects": list(subjects),
             "People": list(people),
             "Places": list(places),
-            "Files": [file_id]
-        })
+            "Files": [file_rec['id']]
+        }, {"Files": [file_rec['id']], "Legacy Item ID": None})
+        journal.record_after(lak.tables['Items'], 'ImageItem', image['id'], lak_item)
 
 # Items -> Items
 
-for item in ldt.tables['Items'].data:
+for item in changed['Items']:
+    metrics.count('item')
+    if done('Item', item['id']):
+        continue
 
     title = item['fields'].get('Title')
     item_type = item['fields'].get('Object Type')
@@ -242,23 +334,17 @@ for item in ldt.tables['Items'].data:
     for p in item['fields'].get('People', []):
         if 'Name' not in p['fields']:
             continue
-        first, middle, last, suffix = parse_name(p['fields']['Name'])
-        person = lak.tables['People'].get_or_insert({
-            "First Name": first,
-            "Middle Name": middle,
-            "Last Name": last,
-            "Suffix Name": suffix
-        })
-        people.add(person['id'])
+        people.add(get_person(p)['id'])
 
     files = []
     for image in item['fields'].get('Images in Item', []):
         image_id = image['fields'].get('Image ID')
-        file_id = image_file_map.get(image_id)
-        if file_id:
-            files.append({"image_id": image_id, "file_id": file_id})
+        file_rec = get_file(image_id)
+        if file_rec:
+            files.append({"image_id": image_id, "file_id": file_rec['id']})
         else:
             print('migrate_ldt: unable to find file for {}'.format(image['fields']['Image ID']))
+            metrics.error('warnings', 'missing file')
 
     # get the File Airtable IDs sorted in order of their original Image ID
     # this insures that their order is sequential per the original ordering
@@ -267,7 +353,7 @@ for item in ldt.tables['Items'].data:
     files = [f['file_id'] for f in files]
 
     if files:
-        lak.tables['Items'].insert({
+        lak_item = write('Items', {
             "Title": title,
             "Type": item_type,
             "Subjects": list(subjects),
@@ -275,5 +361,15 @@ for item in ldt.tables['Items'].data:
             "Places": list(places),
             "Files": list(files),
             "Legacy Item ID": item['fields'].get('Readable Item ID')
-        })
+        }, {"Legacy Item ID": item['fields'].get('Readable Item ID')})
+        journal.record_after(lak.tables['Items'], 'Item', item['id'], lak_item)
+
+# send any writes that are still buffered
+lak.flush()
+metrics.stop_progress()
+
+# the next incremental run only needs what has changed since LDT was fetched
+save_sync('migrate_ldt', ldt.fetched, last_wipe(lak.id))
 
+# there is nothing left to resume
+journal.reset()
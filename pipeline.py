@@ -0,0 +1,77 @@
+import queue
+import threading
+
+
+class Pipeline:
+    """
+    Runs jobs through a series of stages. Each stage is a function that is
+    given a job and returns the job (or None to drop it), and is run by its
+    own pool of worker threads. The stages are connected by bounded queues
+    so a slow stage holds back the ones in front of it instead of letting
+    work pile up in memory.
+
+        p = Pipeline([(download, 4), (store, 2), (write, 1)])
+        for job in jobs:
+            p.put(job)
+        p.join()
+
+    If a stage raises an exception the remaining jobs are drained without
+    being processed and the exception is raised again by join().
+    """
+
+    def __init__(self, stages, maxsize=None):
+        self.stages = stages
+        self.queues = [queue.Queue(maxsize or 2 * workers) for func, workers in stages]
+        self.running = [workers for func, workers in stages]
+        self.lock = threading.Lock()
+        self.error = None
+        self.threads = []
+        for n, (func, workers) in enumerate(stages):
+            for i in range(workers):
+                t = threading.Thread(target=self.work, args=(n,), daemon=True)
+                t.start()
+                self.threads.append(t)
+
+    def put(self, job):
+        self.queues[0].put(job)
+
+    def join(self):
+        """
+        Wait for all the jobs that have been put to make it through.
+        """
+        for i in range(self.stages[0][1]):
+            self.queues[0].put(Done)
+        for t in self.threads:
+            t.join()
+        if self.error:
+            raise self.error
+
+    def work(self, n):
+        func, workers = self.stages[n]
+        q = self.queues[n]
+        while True:
+            job = q.get()
+            if job is Done:
+                break
+            if self.error:
+                continue
+            try:
+                job = func(job)
+            except Exception as e:
+                with self.lock:
+                    self.error = self.error or e
+                continue
+            if job is not None and n + 1 < len(self.stages):
+                self.queues[n + 1].put(job)
+
+        # the last worker out tells the next stage there is nothing more
+        with self.lock:
+            self.running[n] -= 1
+            last = self.running[n] == 0
+        if last and n + 1 < len(self.stages):
+            for i in range(self.stages[n + 1][1]):
+                self.queues[n + 1].put(Done)
+
+
+# marks the end of the jobs in a queue
+Done = object()
@@ -0,0 +1,383 @@
+import json
+import pathlib
+import contextlib
+import collections
+
+from schema import Client
+from journal import record_ids
+
+
+class Plan:
+    """
+    The writes a migration would make to a base, worked out without sending
+    anything to Airtable. A Base made with plan=Plan() still fetches its
+    records, so lookups are made against what is really there, but its
+    inserts and updates are recorded here instead. New records get
+    placeholder ids (like plan:People:12) that can be linked to as usual.
+
+    Writes that depend on the content of files that haven't been read yet
+    can be made inside reading(), which tags them with where the files come
+    from. They are only predictions: when the plan is executed the source
+    is read and the files are added for real. The plan also keeps track of
+    the bytes that would be copied and the URLs that would be downloaded.
+
+        plan = Plan()
+        lak = Base('appqn0kIOXRo00kdN', key, schema, plan=plan)
+        ...
+        plan.save('plans/migrate_lda.json')
+
+    and later:
+
+        lak = Base('appqn0kIOXRo00kdN', key, schema, buffered=True)
+        Plan.load('plans/migrate_lda.json').execute(lak, read_source, journal)
+        lak.flush()
+
+    The units of work (see journal.Journal) that a dry run finishes can be
+    added with unit(), and are journaled as executing the plan writes them.
+    """
+
+    def __init__(self, meta=None):
+        self.meta = meta or {}
+        # table name -> placeholder -> {"fields": ..., "source": ...}
+        self.inserts = collections.defaultdict(dict)
+        # table name -> record id -> the fields to change
+        self.updates = collections.defaultdict(dict)
+        # table name -> ids of existing records that would be changed
+        self.updated = collections.defaultdict(set)
+        # table name -> number of records that were merged into another
+        self.merges = collections.Counter()
+        # path -> size of files that would be copied
+        self.copies = {}
+        # URLs that would be downloaded, and ones that would be looked up to
+        # find out what to download
+        self.downloads = {}
+        self.lookups = {}
+        # sources of files that would be read
+        self.sources = {}
+        self.source = None
+        # [table name, kind, key, value] of units of work to journal
+        self.units = []
+
+    def client(self, table):
+        return PlanClient(self, table)
+
+    @contextlib.contextmanager
+    def reading(self, source):
+        """
+        Tag the writes that are made inside the block as depending on files
+        that will be read from source (a JSON serializable dictionary) when
+        the plan is executed.
+        """
+        self.sources[source_key(source)] = source
+        self.source = source
+        try:
+            yield
+        finally:
+            self.source = None
+
+    def insert(self, table_name, fields):
+        placeholder = 'plan:{}:{}'.format(table_name, len(self.inserts[table_name]) + 1)
+        entry = {"fields": dict(fields)}
+        if self.source is not None:
+            entry["source"] = self.source
+        self.inserts[table_name][placeholder] = entry
+        return placeholder
+
+    def update(self, table_name, id, fields):
+        # changes to a record that is going to be inserted are made before it is
+        if id in self.inserts[table_name]:
+            self.inserts[table_name][id]["fields"].update(fields)
+            return
+        self.updated[table_name].add(id)
+        if self.source is None:
+            self.updates[table_name].setdefault(id, {}).update(fields)
+
+    def unit(self, table_name, kind, key, value):
+        """
+        Journal a unit of work when the plan is executed, once the records in
+        its value (ids or placeholders) have been written to the table.
+        """
+        self.units.append([table_name, kind, key, value])
+
+    def copy(self, path, size):
+        self.copies[str(path)] = size
+
+    def download(self, url):
+        self.downloads[url] = True
+
+    def lookup(self, url):
+        self.lookups[url] = True
+
+    def summary(self):
+        tables = sorted(set(self.inserts) | set(self.updated) | set(self.merges))
+        return {
+            "tables": {
+                table_name: {
+                    "inserts": len(self.inserts.get(table_name, {})),
+                    "updates": len(self.updated.get(table_name, ())),
+                    "merges": self.merges.get(table_name, 0)
+                }
+                for table_name in tables
+            },
+            "sources": len(self.sources),
+            "copies": len(self.copies),
+            "bytes": sum(self.copies.values()),
+            "downloads": len(self.downloads),
+            "lookups": len(self.lookups)
+        }
+
+    def save(self, path):
+        path = pathlib.Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, 'w') as fh:
+            json.dump({
+                "meta": self.meta,
+                "summary": self.summary(),
+                "inserts": self.inserts,
+                "updates": self.updates,
+                "updated": {table_name: sorted(ids) for table_name, ids in self.updated.items()},
+                "merges": self.merges,
+                "sources": list(self.sources.values()),
+                "copies": self.copies,
+                "downloads": list(self.downloads),
+                "lookups": list(self.lookups),
+                "units": self.units
+            }, fh, indent=2)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as fh:
+            data = json.load(fh)
+        plan = cls(data["meta"])
+        plan.inserts.update(data["inserts"])
+        plan.updates.update(data["updates"])
+        plan.updated.update((table_name, set(ids)) for table_name, ids in data["updated"].items())
+        plan.merges.update(data["merges"])
+        plan.sources = {source_key(source): source for source in data["sources"]}
+        plan.copies = data["copies"]
+        plan.downloads = dict.fromkeys(data["downloads"], True)
+        plan.lookups = dict.fromkeys(data["lookups"], True)
+        plan.units = data.get("units", [])
+        return plan
+
+    def order(self):
+        """
+        Get the names of the tables with inserts, ordered so that a table
+        comes after the tables that its new records link to.
+        """
+        needs = {
+            table_name: {placeholder_table(p) for p in placeholders(entries)} - {table_name}
+            for table_name, entries in self.inserts.items()
+        }
+        ordered = []
+        while needs:
+            ready = sorted(t for t, n in needs.items() if not n - set(ordered))
+            if not ready:
+                raise ValueError('new records link to each other in a cycle: {}'.format(sorted(needs)))
+            for table_name in ready:
+                ordered.append(table_name)
+                del needs[table_name]
+        return ordered
+
+    def execute(self, base, read, journal=None):
+        """
+        Make the planned writes to a base. It should be buffered, so that the
+        inserts for each table are sent 10 at a time, and they are queued a
+        table at a time in order() so that the records they link to are all
+        sent together first. Updates to a record are sent as one.
+
+        read(source) is called once for each source, with its placeholders
+        replaced, to read the files and add them (when the table of the first
+        record predicted for it comes up). It returns the records it added or
+        merged them into, which are linked in place of the predicted ones.
+
+        If a journal is given, the records written for each placeholder and
+        source are journaled once they have been sent, so that executing the
+        plan again after it was interrupted uses them instead of writing them
+        again (as long as they still exist). The plan's units are journaled
+        too, as soon as the records in them have been written.
+        """
+        records = {}
+        read_sources = {}
+        recorded = set()
+
+        def journal_key(key):
+            return '{} {}'.format(self.meta.get('id'), key)
+
+        def written(key):
+            # what an earlier execution wrote for a placeholder or source
+            ids = journal.get('Planned', journal_key(key)) if journal is not None else None
+            if ids is None:
+                return None
+            found = [find_record(base, id) for id in ids]
+            return found if all(found) else None
+
+        def remember(key, result):
+            if journal is not None:
+                after_flush(tables_of(base, result), lambda: journal.record('Planned', journal_key(key), record_ids(result)))
+
+        def resolve(placeholder):
+            if placeholder not in records:
+                entry = self.inserts[placeholder_table(placeholder)][placeholder]
+                if "source" in entry:
+                    records[placeholder] = read_source(entry["source"])
+                else:
+                    result = written(placeholder)
+                    if result is None:
+                        table = base.tables[placeholder_table(placeholder)]
+                        result = [table.insert(swap(entry["fields"], resolve))]
+                        remember(placeholder, result)
+                    records[placeholder] = result
+            return records[placeholder]
+
+        def read_source(source):
+            key = source_key(source)
+            if key not in read_sources:
+                result = written(key)
+                if result is None:
+                    result = read(swap(source, resolve))
+                    if result is None:
+                        result = []
+                    elif not isinstance(result, list):
+                        result = [result]
+                    remember(key, result)
+                read_sources[key] = result
+            return read_sources[key]
+
+        def resolved(value):
+            # records rather than ids, which buffered inserts only get once sent
+            if is_placeholder(value):
+                return (records[value] or [None])[0]
+            elif type(value) == list:
+                return [r for v in value for r in (records[v] if is_placeholder(v) else [v])]
+            return value
+
+        def record_units(last=False):
+            # units that only change existing records wait for the updates
+            for n, (table_name, kind, key, value) in enumerate(self.units):
+                needs = list(placeholders(value))
+                if n not in recorded and (needs or last) and all(p in records for p in needs):
+                    recorded.add(n)
+                    journal.record_after(base.tables[table_name], kind, key, resolved(value))
+
+        for table_name in self.order():
+            for placeholder in self.inserts[table_name]:
+                resolve(placeholder)
+            if journal is not None:
+                # so that what is left in the buffers is journaled too
+                base.flush()
+                record_units()
+
+        # sources whose files were only predicted to be merged
+        for source in self.sources.values():
+            read_source(source)
+
+        for table_name, updates in self.updates.items():
+            for id, fields in updates.items():
+                base.tables[table_name].update(id, swap(fields, resolve))
+
+        if journal is not None:
+            record_units(last=True)
+
+
+class PlanClient(Client):
+    """
+    A Client that fetches records from Airtable but records writes in a Plan.
+    It returns what Airtable would, so the Table keeps its records and
+    indexes up to date as usual.
+    """
+
+    def __init__(self, plan, table):
+        base = table.base
+        super().__init__(base.id, table.table_name, base.api_key, base.scheduler, base.endpoint)
+        self.plan = plan
+        self.table = table
+
+    def insert(self, fields, typecast=False):
+        return {"id": self.plan.insert(self.table_name, fields), "fields": dict(fields), "createdTime": None}
+
+    def batch_insert(self, records, typecast=False):
+        return [self.insert(fields) for fields in records]
+
+    def update(self, record_id, fields, typecast=False):
+        self.plan.update(self.table_name, record_id, fields)
+        current = self.table.ids.get(record_id)
+        result = self.table.raw_fields(current) if current else {}
+        result.update(fields)
+        return {"id": record_id, "fields": result}
+
+    def batch_update(self, records, typecast=False):
+        return [self.update(r['id'], r['fields']) for r in records]
+
+    def batch_delete(self, record_ids):
+        # applying a plan only inserts and updates, so a dry run can't wipe
+        raise ValueError('a dry run cannot delete {} records from {}, wiping is not part of a plan'.format(
+            len(record_ids), self.table_name))
+
+
+def is_placeholder(v):
+    return type(v) == str and v.startswith('plan:')
+
+def placeholder_table(placeholder):
+    return placeholder.split(':')[1]
+
+def placeholders(v):
+    """
+    Get the placeholders used in a value (looking inside lists and dictionaries).
+    """
+    if is_placeholder(v):
+        yield v
+    elif type(v) == list:
+        for i in v:
+            yield from placeholders(i)
+    elif type(v) == dict:
+        for i in v.values():
+            yield from placeholders(i)
+
+def swap(v, resolve):
+    """
+    Replace the placeholders in a value with the ids of the records
+    resolve() returns for them. A placeholder can turn into more than one
+    record (or none) so they are expected to be in lists of links.
+    """
+    if type(v) == list:
+        ids = []
+        for i in v:
+            for new in ([r['id'] for r in resolve(i)] if is_placeholder(i) else [swap(i, resolve)]):
+                if new not in ids or not is_placeholder(i):
+                    ids.append(new)
+        return ids
+    elif type(v) == dict:
+        return {k: swap(i, resolve) for k, i in v.items()}
+    return v
+
+def source_key(source):
+    return json.dumps(source, sort_keys=True)
+
+def find_record(base, id):
+    for table in base.tables.values():
+        record = table.get(id)
+        if record is not None:
+            return record
+    return None
+
+def tables_of(base, records):
+    "Get the tables that records (which may be buffered inserts) are in."
+    tables = []
+    for record in records:
+        table = getattr(record, 'table', None)
+        if table is None:
+            table = next((t for t in base.tables.values() if record['id'] in t.ids), None)
+        if table is not None and table not in tables:
+            tables.append(table)
+    return tables
+
+def after_flush(tables, callback):
+    """
+    Call a function once the writes that have been made to all the tables
+    so far have been sent.
+    """
+    if not tables:
+        callback()
+        return
+    tables[0].when_flushed(lambda: after_flush(tables[1:], callback))
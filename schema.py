@@ -1,13 +1,45 @@
 import io
+import os
 import re
+import sys
 import csv
+import gzip
+import json
+import time
 import magic
+import queue
+import random
 import shutil
+import sqlite3
 import hashlib
 import pathlib
+import requests
+import tempfile
 import mimetypes
+import datetime
+import functools
+import threading
 
 from airtable import Airtable
+from urllib3.exceptions import ConnectTimeoutError
+from metrics import metrics
+from concurrent.futures import ThreadPoolExecutor
+
+# where migrated files are stored (somewhere else for a trial run)
+DATA_ROOT = pathlib.Path(os.environ.get('LAKELAND_DATA_ROOT', '/mnt/data'))
+
+# how much of a file to read at a time when hashing and copying
+CHUNK_SIZE = 512 * 1024
+
+# strings in records up to this long are interned, since the same names,
+# categories and record ids turn up over and over
+INTERN_LENGTH = 100
+
+# how many distinct names parse_name() remembers the parts of
+NAME_CACHE_SIZE = 100000
+
+# the last part of a name that is a suffix rather than a last name
+SUFFIX = re.compile(r'^(sr)|jr|[iv]+$', re.IGNORECASE)
 
 
 class Base:
@@ -15,19 +47,229 @@ class Base:
     Represents an Airtable Base and all its Tables.
     """
 
-    def __init__(self, base_id, api_key, schema):
+    def __init__(self, base_id, api_key, schema, buffered=False, flush_threshold=10, workers=None,
+                 snapshot_dir=None, snapshot_ttl=None, refresh=False, endpoint=None, fields=None,
+                 stream=(), fetch=True, plan=None):
         self.id = base_id
         self.tables = {}
         self.api_key = api_key
         self.schema = schema
-        self.load()
+        # a plan.Plan that writes are recorded in instead of being sent, one
+        # at a time since there is nothing to gain from buffering them
+        self.plan = plan
+        self.buffered = buffered and plan is None
+        self.flush_threshold = flush_threshold
+        self.workers = workers or len(schema)
+        self.snapshot_dir = pathlib.Path(snapshot_dir) if snapshot_dir else None
+        self.snapshot_ttl = snapshot_ttl
+        self.refresh = refresh
+        # table name -> the only fields to fetch for it
+        self.fields = fields or {}
+        # names of tables whose records are streamed rather than loaded
+        self.stream = stream
+        # a different Airtable API server, such as fake_airtable.py
+        self.endpoint = endpoint or os.environ.get('AIRTABLE_ENDPOINT')
+        self.scheduler = self.make_scheduler()
+        self.lock = threading.Lock()
+        if fetch:
+            self.load()
+
+    def make_scheduler(self):
+        """
+        Get the scheduler that the base's requests go through.
+        """
+        return get_scheduler(self.id)
 
     def load(self):
-        for table_name, relations in self.schema.items():
-            self.tables[table_name] = Table(self, table_name, relations)
+        """
+        Fetch all the tables at the same time (the scheduler keeps them under
+        the rate limit) and link them once they have all arrived. If a
+        snapshot_dir was given the tables are read from a fresh enough
+        snapshot instead, or a new snapshot is saved after fetching them.
+
+        If some tables are to be streamed, they are fetched as they are gone
+        through with Table.stream(), and the other tables are fetched in the
+        background instead. Using a table waits until it has all arrived.
+        """
+        snapshot = None
+        if self.snapshot_dir and not self.refresh:
+            snapshot = self.read_snapshot()
+        if not snapshot:
+            self.fetched = time.time()
+        self.unsaved = bool(self.snapshot_dir and not snapshot)
+
+        if self.stream and not snapshot:
+            self.tables = {
+                table_name: Table(self, table_name, relations, fetch=False)
+                for table_name, relations in self.schema.items()
+            }
+            pool = ThreadPoolExecutor(self.workers)
+            for table in self.tables.values():
+                if table.table_name not in self.stream:
+                    pool.submit(table.fetch)
+            pool.shutdown(wait=False)
+            return
+
+        def make_table(item):
+            table_name, relations = item
+            data = snapshot[table_name] if snapshot else None
+            return Table(self, table_name, relations, data)
+
+        with ThreadPoolExecutor(self.workers) as pool:
+            tables = pool.map(make_table, self.schema.items())
+            self.tables = {table.table_name: table for table in tables}
+
+        if self.unsaved:
+            self.unsaved = False
+            self.save_snapshot()
+
         for table in self.tables.values():
             table.link()
-        
+
+    def table_loaded(self):
+        """
+        Save a snapshot once all the tables that are being fetched in the
+        background or streamed have arrived.
+        """
+        with self.lock:
+            if self.unsaved and all(t.loaded.is_set() and t.error is None for t in self.tables.values()):
+                self.unsaved = False
+                self.save_snapshot()
+
+    def snapshots(self):
+        """
+        Return (fetch time, path) for each snapshot of this base, newest first.
+        """
+        results = []
+        for path in self.snapshot_dir.glob('{}-*.jsonl.gz'.format(self.id)):
+            fetched = path.name[len(self.id) + 1:].split('.')[0]
+            if fetched.isdigit():
+                results.append((int(fetched), path))
+        return sorted(results, reverse=True)
+
+    def read_snapshot(self):
+        """
+        Read the newest snapshot as a dictionary of table name to rows. None
+        is returned when there isn't one, it is older than snapshot_ttl
+        seconds, it is missing some of the tables in the schema, or it has
+        different fields.
+        """
+        snapshots = self.snapshots()
+        if not snapshots:
+            return None
+        fetched, path = snapshots[0]
+        if self.snapshot_ttl is not None and time.time() - fetched > self.snapshot_ttl:
+            return None
+
+        with gzip.open(path, 'rt') as fh:
+            header = json.loads(fh.readline())
+            if header.get('fields', {}) != self.snapshot_fields():
+                return None
+            data = {table_name: [] for table_name in header['tables']}
+            for line in fh:
+                row = json.loads(line)
+                data[row['table']].append(row['record'])
+
+        if not set(self.schema).issubset(data):
+            return None
+        self.fetched = fetched
+        return data
+
+    def save_snapshot(self):
+        """
+        Write the (unlinked) rows of every table to a gzipped JSON lines file
+        named for the base and the time it was fetched, and remove older ones.
+        """
+        self.snapshot_dir.mkdir(parents=True, exist_ok=True)
+        fetched = int(self.fetched)
+        path = self.snapshot_dir / '{}-{}.jsonl.gz'.format(self.id, fetched)
+        tmp_path = path.with_name(path.name + '.tmp')
+
+        with gzip.open(tmp_path, 'wt') as fh:
+            header = {"base": self.id, "fetched": fetched, "tables": list(self.tables), "fields": self.snapshot_fields()}
+            fh.write(json.dumps(header) + "\n")
+            for table in self.tables.values():
+                for record in table.data:
+                    fh.write(json.dumps({"table": table.table_name, "record": table.raw(record)}) + "\n")
+        tmp_path.rename(path)
+
+        for old_fetched, old_path in self.snapshots():
+            if old_path != path:
+                old_path.unlink()
+
+    def table_fields(self, table_name):
+        """
+        Get the fields to fetch for a table (always including its links), or
+        None to fetch them all.
+        """
+        if table_name not in self.fields:
+            return None
+        return sorted(set(self.fields[table_name]) | set(self.schema[table_name]))
+
+    def snapshot_fields(self):
+        return {table_name: self.table_fields(table_name) for table_name in self.fields}
+
+    def refresh_since(self, since):
+        """
+        Bring the tables up to date by fetching only the records that have
+        been modified since a time (in seconds since the epoch), or since
+        the data was fetched if that was earlier. Returns a dictionary of
+        table name to the rows that were added or changed. Records that
+        have been deleted are not noticed.
+        """
+        since = min(since, self.fetched)
+        fetched = time.time()
+
+        with ThreadPoolExecutor(self.workers) as pool:
+            changed = dict(pool.map(
+                lambda table: (table.table_name, table.load_modified(since)),
+                self.tables.values()
+            ))
+
+        return self.refreshed(changed, fetched)
+
+    def refreshed(self, changed, fetched):
+        """
+        Link and index the rows refresh_since() fetched (fetched is when it
+        started) and save a snapshot of the refreshed tables.
+        """
+        # link once everything is in since changed rows can link to each other
+        for table_name, rows in changed.items():
+            table = self.tables[table_name]
+            for row in rows:
+                table.link_row(row)
+                table.index_row(row)
+
+        self.fetched = fetched
+        if self.snapshot_dir:
+            self.save_snapshot()
+
+        return changed
+
+    def flush(self):
+        """
+        Send any buffered inserts and updates to Airtable.
+        """
+        for table in self.tables.values():
+            table.flush()
+
+    def fingerprint(self):
+        """
+        Get a hash of every record in the base, to tell whether it has changed
+        since. Attachments are hashed by name, since Airtable's urls for them
+        change.
+        """
+        digest = hashlib.sha256()
+        for table_name in sorted(self.tables):
+            table = self.tables[table_name]
+            for row in sorted(table.data, key=lambda row: row['id']):
+                fields = {
+                    k: [attachment_name(a) for a in v] if is_attachments(v) else v
+                    for k, v in table.raw_fields(row).items()
+                }
+                digest.update(json.dumps([table_name, row['id'], fields], sort_keys=True).encode('utf8'))
+        return digest.hexdigest()
+
     def wipe(self):
         """
         Empty all the tables but leave the schema intact.
@@ -35,13 +277,11 @@ class Base:
         # safety to only ever wipe this airtable base
         assert self.id == 'appqn0kIOXRo00kdN'
 
-        # first get the latest data
-        self.load()
+        self.flush()
 
-        for table in self.tables.values():
-            table.wipe()
-
-        self.load()
+        # each table fetches its latest rows before deleting them
+        with ThreadPoolExecutor(self.workers) as pool:
+            list(pool.map(lambda table: table.wipe(), self.tables.values()))
 
 
 class Table:
@@ -49,50 +289,334 @@ class Table:
     Represents an Airbase table.
     """
 
-    def __init__(self, base, table_name, relations):
+    def __init__(self, base, table_name, relations, data=None, fetch=True):
         self.base = base
         self.table_name = table_name
         self.relations = relations
-        self.airtable = Airtable(base.id, table_name, base.api_key)
-        self.load()
+        self.airtable = self.make_client()
+        self.fields = base.table_fields(table_name)
+        self.pending_inserts = []
+        self.pending_updates = {}
+        self.flush_callbacks = []
+        self.loaded = threading.Event()
+        self.error = None
+        if fetch or data is not None:
+            self.load(data)
+        else:
+            self._data = []
+            self.ids = {}
+            self.indexes = {}
 
-    def load(self):
-        self.data = self.airtable.get_all()
+    def make_client(self):
+        """
+        Get the client that talks to Airtable for the table, or records its
+        writes in the base's plan.
+        """
+        if self.base.plan is not None:
+            return self.base.plan.client(self)
+        return Client(self.base.id, self.table_name, self.base.api_key, self.base.scheduler, self.base.endpoint)
+
+    @property
+    def data(self):
+        self.wait()
+        return self._data
 
+    @data.setter
+    def data(self, data):
+        self._data = data
+
+    def wait(self):
+        """
+        Wait for the table to arrive if it is being fetched in the background
+        or streamed.
+        """
+        if not self.loaded.is_set():
+            self.loaded.wait()
+        if self.error is not None:
+            raise self.error
+
+    @metrics.timed('table.load')
+    def load(self, data=None, link=False):
+        if data is None:
+            data = self.airtable.get_all(**self.options())
+        self._data = [make_record(row) for row in data]
+        self.ids = {row['id']: row for row in self._data}
+        self.indexes = {}
+        if link:
+            self.link()
+        self.loaded.set()
+
+    def fetch(self):
+        """
+        Load and link the table in the background.
+        """
+        try:
+            self.load(link=True)
+        except Exception as e:
+            self.error = e
+            self.loaded.set()
+            raise
+        self.base.table_loaded()
+
+    def stream(self):
+        """
+        Yield the table's records as each page of them arrives, so work can
+        start on them before the whole table has been fetched. The pages are
+        fetched in a thread of their own, so that pagination goes on while
+        the records are being handled. The records are linked, but the rest
+        of the table can't be used until it has been streamed to the end (a
+        table that was only partly streamed can't be used at all). A table
+        that is already loaded just yields its data.
+        """
+        if self.loaded.is_set():
+            yield from self.data
+            return
+
+        pages = queue.Queue()
+        stop = threading.Event()
+
+        def fetch():
+            try:
+                for page in self.airtable.get_iter(**self.options()):
+                    pages.put(page)
+                    if stop.is_set():
+                        return
+                pages.put(None)
+            except Exception as e:
+                pages.put(e)
+
+        threading.Thread(target=fetch, name='stream-{}'.format(self.table_name), daemon=True).start()
+        try:
+            while True:
+                page = pages.get()
+                if page is None:
+                    break
+                if isinstance(page, Exception):
+                    raise page
+                for row in page:
+                    yield self.add_fetched(row)
+        except GeneratorExit:
+            # the stream was abandoned: stop fetching rather than waiting for
+            # the rest of the table, which is left unusable
+            stop.set()
+            self.error = RuntimeError('{} was only partly streamed'.format(self.table_name))
+            return
+        except Exception as e:
+            self.error = e
+            raise
+        finally:
+            self.loaded.set()
+            if self.error is None:
+                self.base.table_loaded()
+
+    def add_fetched(self, row):
+        row = make_record(row)
+        self._data.append(row)
+        self.ids[row['id']] = row
+        self.link_row(row)
+        return row
+
+    def options(self):
+        return {'fields': self.fields} if self.fields else {}
+
+    def load_modified(self, since):
+        """
+        Fetch the records modified since a time and merge them into the data.
+        The rows are returned unlinked and unindexed.
+        """
+        rows = self.airtable.get_all(formula=modified_since(since), **self.options())
+        return self.merge_modified(rows)
+
+    def merge_modified(self, rows):
+        """
+        Merge fetched rows into the data, replacing the fields of the ones
+        that are already there, and return them.
+        """
+        changed = []
+        for row in rows:
+            row = make_record(row)
+            old = self.get(row['id'])
+            if old:
+                self.unindex_row(old)
+                old['fields'] = row['fields']
+                changed.append(old)
+            else:
+                self.data.append(row)
+                self.ids[row['id']] = row
+                changed.append(row)
+        return changed
+
+    @metrics.timed('table.insert')
     def insert(self, row):
-        result = self.airtable.insert(row)
-        self.data.append(result)
-        self.link()
+        if self.base.buffered:
+            return self.queue_insert(row)
+        result = self.add_fetched(self.airtable.insert(row))
+        self.index_row(result)
         return result
 
+    @metrics.timed('table.update')
     def update(self, id, row):
-        return self.airtable.update(id, row)
+        if self.base.buffered:
+            return self.queue_update(id, row)
+        result = self.airtable.update(id, row)
+        self.apply_update(id, result['fields'])
+        return result
+
+    def apply_update(self, id, fields):
+        """
+        Replace the fields of a cached row with the ones Airtable returned.
+        """
+        old = self.get(id)
+        if old:
+            self.unindex_row(old)
+            old['fields'] = compact(fields)
+            self.link_row(old)
+            self.index_row(old)
+
+    def queue_insert(self, row):
+        """
+        Buffer an insert and return a PendingRecord for it. The record can be
+        found right away, and it gets its id when the buffer is flushed.
+        """
+        record = PendingRecord(self, row)
+        self.pending_inserts.append((record, dict(row)))
+        self.data.append(record)
+        self.index_row(record)
+        if len(self.pending_inserts) >= self.base.flush_threshold:
+            self.flush()
+        return record
+
+    def queue_update(self, id, row):
+        """
+        Buffer an update, applying it to the cached row straight away.
+        Several updates to the same record are sent as one.
+        """
+        self.pending_updates.setdefault(id, {}).update(row)
+        old = self.get(id)
+        if old:
+            self.unindex_row(old)
+            old['fields'].update(row)
+            self.link_row(old)
+            self.index_row(old)
+        else:
+            old = {'id': id, 'fields': dict(row)}
+        if len(self.pending_updates) >= self.base.flush_threshold:
+            self.flush()
+        return old
+
+    @metrics.timed('table.flush')
+    def flush(self):
+        """
+        Write buffered inserts and updates in batches of 10 records, which
+        is the most Airtable accepts in a single request.
+        """
+        inserts, self.pending_inserts = self.pending_inserts, []
+        for chunk in chunks(inserts, self.airtable.MAX_RECORDS_PER_REQUEST):
+            results = self.airtable.batch_insert([row for record, row in chunk])
+            for (record, row), result in zip(chunk, results):
+                self.unindex_row(record)
+                record.resolve(result)
+                self.ids[record['id']] = record
+                self.link_row(record)
+                self.index_row(record)
+
+        updates, self.pending_updates = self.pending_updates, {}
+        records = [{'id': id, 'fields': row} for id, row in updates.items()]
+        for chunk in chunks(records, self.airtable.MAX_RECORDS_PER_REQUEST):
+            self.airtable.batch_update(chunk)
+
+        callbacks, self.flush_callbacks = self.flush_callbacks, []
+        for callback in callbacks:
+            callback()
+
+    def when_flushed(self, callback):
+        """
+        Call a function once the writes that have been made to the table so
+        far have been sent to Airtable, which is right away if nothing is
+        buffered.
+        """
+        if self.pending_inserts or self.pending_updates:
+            self.flush_callbacks.append(callback)
+        else:
+            callback()
 
     def get(self, id):
-        for row in self.data:
-            if row['id'] == id:
-                return row
-        return None
+        self.wait()
+        return self.ids.get(id)
 
     def find(self, fields, first=False):
+        keys = tuple(sorted(fields))
+        index = self.get_index(keys)
+        if index is not None:
+            try:
+                results = index.get(index_key(fields, keys), [])
+            except TypeError:
+                results = self.scan(fields)
+        else:
+            results = self.scan(fields)
+        if first:
+            if len(results) == 0:
+                return None
+            else:
+                return results[0]
+        return results
+
+    def scan(self, fields):
+        """
+        Find matching rows by looking at every row. A field that is missing
+        from a row only matches None.
+        """
         results = []
         for row in self.data:
             match = True
             for k, v in fields.items():
-                if k not in row['fields']:
+                if not dict.__contains__(row['fields'], k):
                     if v is not None:
                         match = False
-                elif row['fields'][k] != v:
+                elif dict.__getitem__(row['fields'], k) != v:
                     match = False
             if match:
                 results.append(row)
-        if first:
-            if len(results) == 0:
-                return None
-            else:
-                return results[0]
         return results
 
+    def get_index(self, keys):
+        """
+        Get (building it if needed) the hash index for a tuple of field names.
+        None is returned if the fields hold values that can't be hashed, in
+        which case lookups need to fall back to scanning.
+        """
+        if keys not in self.indexes:
+            index = {}
+            try:
+                for row in self.data:
+                    index.setdefault(index_key(row['fields'], keys), []).append(row)
+            except TypeError:
+                index = None
+            self.indexes[keys] = index
+        return self.indexes[keys]
+
+    def index_row(self, row):
+        for keys, index in self.indexes.items():
+            if index is None:
+                continue
+            try:
+                index.setdefault(index_key(row['fields'], keys), []).append(row)
+            except TypeError:
+                self.indexes[keys] = None
+
+    def unindex_row(self, row):
+        for keys, index in self.indexes.items():
+            if index is None:
+                continue
+            try:
+                rows = index.get(index_key(row['fields'], keys), [])
+            except TypeError:
+                continue
+            for i, r in enumerate(rows):
+                if r is row:
+                    del rows[i]
+                    break
+
     def get_or_insert(self, fields, extra=None):
         """
         Get or insert and get the first record that matches the fields.
@@ -108,22 +632,73 @@ class Table:
             r = self.insert(f)
         return r
 
+    def upsert(self, key, fields):
+        """
+        Update the first record that matches the key fields, sending only
+        the fields that are different, or insert one if there isn't a match.
+        """
+        r = self.find(key, first=True)
+        if not r:
+            f = dict(fields)
+            f.update(key)
+            return self.insert(f)
+        return self.update_changed(r, fields)
+
+    def update_changed(self, r, fields):
+        """
+        Update a record with the fields that are different from what it has
+        (see same()), if there are any.
+        """
+        changes = self.changes(r, fields)
+        if changes:
+            self.update(r['id'], changes)
+        return r
+
+    def changes(self, r, fields):
+        """
+        Get the fields that are different from what a record has.
+        """
+        current = self.raw_fields(r)
+        return {k: v for k, v in fields.items() if not same(current.get(k), v)}
+
+    def raw(self, row):
+        """
+        Get a row as Airtable would return it, with links turned back into ids.
+        """
+        raw = {'id': row['id'], 'fields': self.raw_fields(row)}
+        if row.get('createdTime'):
+            raw['createdTime'] = row['createdTime']
+        return raw
+
+    def raw_fields(self, row):
+        fields = dict(row['fields'])
+        for prop in self.relations:
+            if type(fields.get(prop)) == list:
+                fields[prop] = [link_id(v) for v in fields[prop] if v is not None]
+            elif isinstance(fields.get(prop), Link):
+                fields[prop] = fields[prop].id
+        return fields
+
     def link(self):
         """
-        Use the table's schema relations to turn IDs into objects.
+        Use the table's schema relations to turn IDs into Links to records.
         """
-        for row in self.data:
-            for prop, other_table_name in self.relations.items():
-                other_table = self.base.tables[other_table_name]
-                if prop in row['fields']:
-                    value = row['fields'][prop]
-                    if type(value) == list:
-                        new_value = []
-                        for v in value:
-                            new_value.append(other_table.get(v))
-                        row['fields'][prop] = new_value
-                    else:
-                        row['fields'][prop] = other_table.get(value)
+        for row in self._data:
+            self.link_row(row)
+
+    def link_row(self, row):
+        """
+        Turn the IDs in a single row into Links. Values that have already
+        been linked are left alone so it is safe to call more than once.
+        """
+        for prop, other_table_name in self.relations.items():
+            other_table = self.base.tables[other_table_name]
+            if prop in row['fields']:
+                value = row['fields'][prop]
+                if type(value) == list:
+                    row['fields'][prop] = [Link(other_table, v) if type(v) == str else v for v in value]
+                elif type(value) == str:
+                    row['fields'][prop] = Link(other_table, value)
 
     def wipe(self):
         """
@@ -132,30 +707,414 @@ class Table:
         self.load()
         ids = [row['id'] for row in self.data]
         self.airtable.batch_delete(ids)
+        self.data = []
+        self.ids = {}
+        self.indexes = {}
+
+
+class Client(Airtable):
+    """
+    The Airtable wrapper with every request sent through a Scheduler.
+    """
+
+    # pacing is left to the scheduler instead of sleeping between pages
+    API_LIMIT = 0
+
+    def __init__(self, base_id, table_name, api_key, scheduler, endpoint=None):
+        if endpoint:
+            self.API_URL = endpoint.rstrip('/') + '/' + self.VERSION
+        super().__init__(base_id, table_name, api_key)
+        self.scheduler = scheduler
+
+    def _request(self, method, *args, **kwargs):
+        with metrics.timer('airtable.' + method):
+            return self.scheduler.call(super()._request, method, *args,
+                                       idempotent=method.upper() in IDEMPOTENT_METHODS, **kwargs)
+
+
+# requests that can be sent again if we can't tell whether Airtable acted on
+# them (an Airtable PATCH sets fields, so sending it twice is harmless)
+IDEMPOTENT_METHODS = {'GET', 'PUT', 'PATCH', 'DELETE'}
+
+
+class Scheduler:
+    """
+    Keeps requests to an Airtable base under its rate limit (5 per second)
+    using a token bucket, and retries requests that are throttled (429) or
+    fail on the server (5xx) with jittered exponential backoff. Airtable
+    makes you wait 30 seconds after a 429, so that is the least we back off.
+
+    A request that isn't idempotent (a POST that inserts records) is only
+    retried if it was throttled or never reached Airtable, since if the
+    response was lost sending it again would insert the records twice.
+    """
+
+    def __init__(self, rate=5, burst=5, retries=8, backoff=1, max_backoff=120, penalty=30):
+        self.rate = rate
+        self.burst = burst
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.penalty = penalty
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+        # counters
+        self.requests = 0
+        self.retried = 0
+        self.throttled = 0
+        self.wait_time = 0.0
+        self.backoff_time = 0.0
+
+    def acquire(self):
+        """
+        Take a token, sleeping until one is available. Tokens can go negative
+        so that concurrent callers queue up behind each other.
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+            self.requests += 1
+            self.wait_time += wait
+        if wait:
+            time.sleep(wait)
+
+    def call(self, func, *args, idempotent=True, **kwargs):
+        attempt = 0
+        while True:
+            self.acquire()
+            try:
+                return func(*args, **kwargs)
+            except (requests.exceptions.HTTPError,
+                    requests.exceptions.ConnectionError,
+                    requests.exceptions.Timeout) as e:
+                response = getattr(e, 'response', None)
+                status = response.status_code if response is not None else None
+                if attempt >= self.retries or not retryable(e, status, idempotent):
+                    raise
+                delay = min(self.max_backoff, self.backoff * 2 ** attempt)
+                if status == 429:
+                    delay = max(delay, self.penalty)
+                delay += random.uniform(0, delay / 2)
+                with self.lock:
+                    self.retried += 1
+                    self.throttled += status == 429
+                    self.backoff_time += delay
+                time.sleep(delay)
+                attempt += 1
+
+    def stats(self):
+        return {
+            "requests": self.requests,
+            "retried": self.retried,
+            "throttled": self.throttled,
+            "wait_time": round(self.wait_time, 2),
+            "backoff_time": round(self.backoff_time, 2)
+        }
+
+
+def modified_since(since):
+    "Get a formula for the records modified since a time (in seconds since the epoch)."
+    when = datetime.datetime.fromtimestamp(since, datetime.timezone.utc)
+    return "IS_AFTER(LAST_MODIFIED_TIME(), DATETIME_PARSE('{}'))".format(when.strftime('%Y-%m-%dT%H:%M:%SZ'))
+
+
+def retryable(e, status, idempotent):
+    """
+    Can a request that failed with an exception (and status, if there was a
+    response) be sent again? Throttled requests always can, and requests
+    that were refused for another reason (4xx) never can. Server errors and
+    dropped connections can be retried if the request is idempotent or it
+    is known not to have been sent.
+    """
+    if status == 429:
+        return True
+    if status is not None and status < 500:
+        return False
+    return idempotent or not_sent(e)
+
+def not_sent(e):
+    "Did a request fail before it was sent, while connecting?"
+    if isinstance(e, requests.exceptions.ConnectTimeout):
+        return True
+    reason = getattr(e.args[0], 'reason', None) if e.args else None
+    return isinstance(e, requests.exceptions.ConnectionError) and isinstance(reason, ConnectTimeoutError)
+
+
+# one scheduler per base id, since Airtable's rate limit is per base
+schedulers = {}
+schedulers_lock = threading.Lock()
+
+def get_scheduler(base_id):
+    """
+    Get the scheduler shared by everything that uses a base. AIRTABLE_RATE
+    can raise the rate for a server that allows more, like fake_airtable.py.
+    """
+    with schedulers_lock:
+        if base_id not in schedulers:
+            rate = float(os.environ.get('AIRTABLE_RATE', 5))
+            schedulers[base_id] = Scheduler(rate=rate, burst=max(rate, 5))
+        return schedulers[base_id]
+
+
+class Link:
+    """
+    A linked record, in place of the id Airtable returns for it. The record
+    is only looked up in the other table when the link is used like one
+    (link['fields']), so links that are never followed cost next to nothing.
+    A link hashes and compares like its id (and equals the record too), so
+    linked fields can still be indexed and searched for by id. A link to a
+    record that isn't in the other table is false.
+    """
+
+    __slots__ = ('table', 'id')
+
+    def __init__(self, table, id):
+        self.table = table
+        self.id = id
+
+    def resolve(self):
+        return self.table.get(self.id)
+
+    def __getitem__(self, key):
+        if key == 'id':
+            return self.id
+        record = self.resolve()
+        if record is None:
+            raise KeyError(key)
+        return record[key]
+
+    def get(self, key, default=None):
+        if key == 'id':
+            return self.id
+        record = self.resolve()
+        return record.get(key, default) if record is not None else default
+
+    def __contains__(self, key):
+        return key == 'id' or key in (self.resolve() or {})
+
+    def __bool__(self):
+        return self.resolve() is not None
+
+    def __eq__(self, other):
+        return self.id == link_id(other)
+
+    def __hash__(self):
+        return hash(self.id)
+
+    def __repr__(self):
+        return 'Link({!r}, {!r})'.format(self.table.table_name, self.id)
+
+
+def link_id(v):
+    "Get the id for a Link or record, or return an id as it is"
+    if isinstance(v, (Link, Record)):
+        return v.id
+    elif isinstance(v, dict):
+        return v.get('id')
+    return v
+
+
+class Record:
+    """
+    A record fetched from Airtable. It takes a lot less memory than the
+    dictionary the API returns, but is used the same way: record['id'],
+    record['fields'].get(...) and record.get('createdTime').
+    """
+
+    __slots__ = ('id', 'fields', 'createdTime')
+
+    def __init__(self, id, fields, createdTime=None):
+        self.id = id
+        self.fields = fields
+        self.createdTime = createdTime
+
+    def __getitem__(self, key):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key, value):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __contains__(self, key):
+        return key in self.__slots__
+
+    def get(self, key, default=None):
+        return getattr(self, key) if key in self.__slots__ else default
+
+    def __repr__(self):
+        return repr({'id': self.id, 'fields': self.fields, 'createdTime': self.createdTime})
+
+
+def make_record(row):
+    "Turn a record dictionary from Airtable (or a snapshot) into a Record"
+    return Record(sys.intern(row['id']), compact(row['fields']), compact(row.get('createdTime')))
+
+def compact(v):
+    "Intern the field names and short strings in a value"
+    if type(v) == str:
+        return sys.intern(v) if len(v) <= INTERN_LENGTH else v
+    elif type(v) == list:
+        return [compact(i) for i in v]
+    elif type(v) == dict:
+        return {sys.intern(k): compact(i) for k, i in v.items()}
+    return v
+
+
+class PendingRecord(dict):
+    """
+    A buffered insert. It looks like the record Airtable will return but
+    asking for its id, or for a field that Airtable fills in (like an
+    autonumber ID), flushes its table first.
+    """
+
+    def __init__(self, table, fields):
+        super().__init__(fields=PendingFields(self, fields))
+        self.table = table
+        self.saved = False
+
+    def __getitem__(self, key):
+        if not self.saved and key in ('id', 'createdTime'):
+            self.table.flush()
+        return super().__getitem__(key)
 
+    def get(self, key, default=None):
+        if not self.saved and key in ('id', 'createdTime'):
+            self.table.flush()
+        return super().get(key, default)
 
+    def resolve(self, result):
+        self.saved = True
+        self['id'] = result['id']
+        self['createdTime'] = result.get('createdTime')
+        self['fields'].update(result['fields'])
+
+
+class PendingFields(dict):
+    """
+    The fields of a PendingRecord. Asking for one that wasn't inserted (with
+    [], get() or in) flushes the table first, since Airtable may fill it in.
+    The Table's own indexing and scanning use the plain dict methods, so
+    that they only see the fields that were inserted and don't flush.
+    """
+
+    def __init__(self, record, fields):
+        super().__init__(fields)
+        self.record = record
+
+    def __missing__(self, key):
+        if not self.record.saved:
+            self.record.table.flush()
+            if key in self:
+                return self[key]
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        if not self.record.saved and not dict.__contains__(self, key):
+            self.record.table.flush()
+        return super().get(key, default)
+
+    def __contains__(self, key):
+        if not self.record.saved and not dict.__contains__(self, key):
+            self.record.table.flush()
+        return dict.__contains__(self, key)
+
+
+def chunks(l, size):
+    for i in range(0, len(l), size):
+        yield l[i:i + size]
+
+def index_key(fields, keys):
+    """
+    Build the hashable index key for the given field names. Missing fields
+    are treated as None, and lists as tuples.
+    """
+    key = tuple(hashable(dict.get(fields, k)) for k in keys)
+    hash(key)
+    return key
+
+def empty(v):
+    return v is None or v is False or v == '' or v == []
+
+def same(old, new):
+    """
+    Is a new value for a field the same as the one Airtable has? Empty
+    values are treated as missing since Airtable doesn't return them, and
+    attachments are compared by filename since Airtable copies them and
+    returns its own urls for them.
+    """
+    if empty(old) and empty(new):
+        return True
+    if is_attachments(new):
+        return type(old) == list and [attachment_name(a) for a in old] == [attachment_name(a) for a in new]
+    return old == new
+
+def is_attachments(v):
+    return type(v) == list and len(v) > 0 and all(type(a) == dict and 'url' in a for a in v)
+
+def attachment_name(a):
+    "Get an attachment's filename, which Airtable takes from its url if it isn't given"
+    return a.get('filename') or a['url'].split('?')[0].rsplit('/', 1)[-1]
+
+def hashable(v):
+    if type(v) == list:
+        return tuple(hashable(i) for i in v)
+    return v
+
+@functools.lru_cache(maxsize=NAME_CACHE_SIZE)
 def parse_name(s):
     """
-    Parse a name string into its parts.
+    Parse a name string into its (first, middle, last, suffix) parts. The
+    same people come up over and over, so the parts are remembered.
     """
     parts = s.split(' ')
     f = parts.pop(0)
     l = parts.pop() if len(parts) > 0 else None
     s = None
-    if l and re.match(r'^(sr)|jr|[iv]+$', l, re.IGNORECASE):
+    if l and SUFFIX.match(l):
         s = l
         l = parts.pop()
     m = ' '.join(parts) if len(parts) > 0 else None
     return f, m, l, s
 
+def warm_name_cache(names):
+    """
+    Parse a column of names up front, so that parse_name() already has
+    their parts when they are looked up one at a time.
+    """
+    for name in set(names):
+        if name:
+            parse_name(name)
+
+def person_fields(name):
+    """
+    Get the People fields for a name. Every person is found and inserted
+    with these same fields, so they are all looked up in one index.
+    """
+    first, middle, last, suffix = parse_name(name)
+    return {
+        "First Name": first,
+        "Middle Name": middle,
+        "Last Name": last,
+        "Suffix Name": suffix
+    }
+
 def get_sha256(f):
     d = hashlib.sha256()
-    fh = open(f, 'rb')
-    while True:
-        chunk = fh.read(512 * 1024)
-        if not chunk:
-            break
-        d.update(chunk)
+    with metrics.timer('sha256') as t, open(f, 'rb') as fh:
+        while True:
+            chunk = fh.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            d.update(chunk)
+            t.size += len(chunk)
     return d.hexdigest()
 
 def csv_list(s):
@@ -173,20 +1132,16 @@ def csv_str(l):
     csv.writer(out).writerow(l)
     return out.getvalue().strip()
 
-def save_file(src, accession_dir, sha256, ext):
+def get_location(accession_dir, sha256, ext):
+    "Get the storage path, relative to DATA_ROOT, for a file"
     ext = ext.lstrip('.')
     filename = "{}.{}".format(sha256, ext)
-    rel_path = pathlib.Path(str(accession_dir)) / filename
-    abs_path = pathlib.Path("/mnt/data") / rel_path
-
-    # make the directory if needed
-    if not abs_path.parent.is_dir():
-        abs_path.parent.mkdir(parents=True)
-
-    # copy the file
-    shutil.copyfile(src, abs_path)
+    return pathlib.Path(str(accession_dir)) / filename
 
-    return str(rel_path)
+def save_file(src, accession_dir, sha256, ext):
+    with metrics.timer('save_file') as t:
+        t.size = os.stat(src).st_size
+        return store.save(src, accession_dir, sha256, ext)
 
 def get_ext(mimetype):
     result = mimetypes.guess_extension(mimetype)
@@ -195,3 +1150,190 @@ def get_ext(mimetype):
     elif result is None:
         result = ''
     return result
+
+def ingest(src, accession_dir, place=True):
+    with metrics.timer('ingest') as t:
+        result = store.ingest(src, accession_dir, place)
+        t.size = result[3]
+        return result
+
+
+class FileStore:
+    """
+    Content addressed file storage. Files are stored as <sha256>.<ext> in
+    accession directories under a root directory, and a SQLite index in the
+    root keeps track of where each SHA256 has been stored, and the SHA256 of
+    source files that have already been read. Content that is already stored
+    is not copied again: it is either left alone or hard linked into the new
+    location.
+    """
+
+    def __init__(self, root):
+        self.root = pathlib.Path(root)
+        self.db = None
+        self.lock = threading.RLock()
+
+    def index(self):
+        if self.db is None:
+            self.root.mkdir(parents=True, exist_ok=True)
+            self.db = sqlite3.connect(str(self.root / '.index.sqlite3'), check_same_thread=False)
+            self.db.execute('CREATE TABLE IF NOT EXISTS files (sha256 TEXT PRIMARY KEY, location TEXT, size INTEGER)')
+            self.db.execute('CREATE TABLE IF NOT EXISTS sources (path TEXT PRIMARY KEY, size INTEGER, mtime REAL, sha256 TEXT, mimetype TEXT)')
+        return self.db
+
+    def lookup(self, sha256):
+        """
+        Return the location of a stored SHA256 if it is still on disk with
+        the expected size.
+        """
+        with self.lock:
+            row = self.index().execute('SELECT location, size FROM files WHERE sha256 = ?', (sha256,)).fetchone()
+            if row is None:
+                return None
+            location, size = row
+            if self.exists(location, size):
+                return location
+            self.index().execute('DELETE FROM files WHERE sha256 = ?', (sha256,))
+            self.index().commit()
+            return None
+
+    def exists(self, location, size):
+        path = self.root / location
+        return path.is_file() and path.stat().st_size == size
+
+    def add(self, sha256, location, size):
+        with self.lock:
+            self.index().execute('INSERT OR REPLACE INTO files VALUES (?, ?, ?)', (sha256, str(location), size))
+            self.index().commit()
+
+    def remove(self, location):
+        """
+        Remove a stored file, e.g. one that turned out to be a duplicate.
+        Duplicates that are stored at the same time share a location, so it
+        may have been removed already.
+        """
+        with self.lock:
+            (self.root / location).unlink(missing_ok=True)
+            self.index().execute('DELETE FROM files WHERE location = ?', (str(location),))
+            self.index().commit()
+
+    def place(self, sha256, location, size):
+        """
+        Try to put already stored content at a location without copying it.
+        Returns True if the content is now at the location.
+        """
+        if self.exists(location, size):
+            return True
+        existing = self.lookup(sha256)
+        if existing is None:
+            return False
+        path = self.root / location
+        path.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            os.link(self.root / existing, path)
+        except OSError:
+            shutil.copyfile(self.root / existing, path)
+        return True
+
+    def save(self, src, accession_dir, sha256, ext):
+        location = get_location(accession_dir, sha256, ext)
+        size = os.stat(src).st_size
+        if not self.place(sha256, location, size):
+            path = self.root / location
+            path.parent.mkdir(parents=True, exist_ok=True)
+            shutil.copyfile(src, path)
+            self.add(sha256, location, size)
+        return str(location)
+
+    def known(self, src, st=None):
+        """
+        Get the (sha256, mimetype) of a source file that was ingested before
+        and hasn't changed since (same size and mtime), or None.
+        """
+        src = os.path.abspath(src)
+        st = st or os.stat(src)
+        with self.lock:
+            return self.index().execute(
+                'SELECT sha256, mimetype FROM sources WHERE path = ? AND size = ? AND mtime = ?',
+                (src, st.st_size, st.st_mtime)
+            ).fetchone()
+
+    def ingest(self, src, accession_dir, place=True):
+        """
+        Store a file in an accession directory, reading it only once. Each
+        chunk that is read is hashed and written to a temporary file next to
+        its destination, and the first chunk is used to determine the format.
+        Once the SHA256 is known the temporary file is renamed into place, or
+        discarded if the content was already stored. Source files that were
+        ingested before (same path, size and mtime) aren't read at all.
+
+        When place is false content that is already stored somewhere else
+        isn't put in the accession directory too; call place() if it turns
+        out to be needed there.
+
+        Returns the location (relative to the root), sha256, mimetype and size.
+        """
+        src = os.path.abspath(src)
+        st = os.stat(src)
+
+        known = self.known(src, st)
+        if known:
+            sha256, mimetype = known
+            location = get_location(accession_dir, sha256, get_ext(mimetype))
+            if (not place and self.lookup(sha256)) or self.place(sha256, location, st.st_size):
+                metrics.count('ingest.unread')
+                return str(location), sha256, mimetype, st.st_size
+
+        dest_dir = self.root / str(accession_dir)
+        dest_dir.mkdir(parents=True, exist_ok=True)
+
+        d = hashlib.sha256()
+        size = 0
+        mimetype = None
+
+        with open(src, 'rb') as fh, tempfile.NamedTemporaryFile(dir=dest_dir, prefix='.ingest-', delete=False) as out:
+            try:
+                while True:
+                    chunk = fh.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    if mimetype is None:
+                        with metrics.timer('magic'):
+                            mimetype = magic.from_buffer(chunk, mime=True)
+                    d.update(chunk)
+                    out.write(chunk)
+                    size += len(chunk)
+            except:
+                out.close()
+                os.remove(out.name)
+                raise
+
+        if mimetype is None:
+            mimetype = magic.from_buffer(b'', mime=True)
+
+        sha256 = d.hexdigest()
+        location = get_location(accession_dir, sha256, get_ext(mimetype))
+
+        stored = None if place else self.lookup(sha256)
+        if stored or self.place(sha256, location, size):
+            os.remove(out.name)
+        else:
+            os.chmod(out.name, 0o644)
+            os.replace(out.name, self.root / location)
+            self.add(sha256, location, size)
+
+        # remember the stored copy too, so it can be ingested without reading it
+        dest = str(self.root / (stored or location))
+        dest_st = os.stat(dest)
+        with self.lock:
+            for path, path_st in [(src, st), (dest, dest_st)]:
+                self.index().execute(
+                    'INSERT OR REPLACE INTO sources VALUES (?, ?, ?, ?, ?)',
+                    (path, path_st.st_size, path_st.st_mtime, sha256, mimetype)
+                )
+            self.index().commit()
+
+        return str(location), sha256, mimetype, size
+
+
+store = FileStore(DATA_ROOT)
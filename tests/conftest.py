@@ -0,0 +1,24 @@
+import os
+
+import pytest
+
+import fake_airtable
+
+# the tests talk to fake_airtable, which doesn't need to be spared
+os.environ.setdefault('AIRTABLE_RATE', '100000')
+
+
+@pytest.fixture(scope='session')
+def server():
+    server = fake_airtable.serve(fake_airtable.FakeAirtable(rate=0), port=0)
+    yield server
+    server.shutdown()
+
+
+@pytest.fixture
+def endpoint(server, fake):
+    """
+    The endpoint of a fake_airtable server for the test's fake bases.
+    """
+    server.fake = fake
+    return 'http://localhost:{}'.format(server.server_port)
@@ -0,0 +1,59 @@
+import pytest
+
+from accession_rules import match_accessions
+
+
+def old_accessions(location, paths):
+    """
+    The chain of substring tests that get_accessions used to make.
+    """
+    accessions = []
+    if 'lakeland.umd.edu/asa' in location:
+        accessions.append("ASA")
+    elif 'lakeland.umd.edu' in location:
+        accessions.append("Lakeland Omeka Instance Images")
+    if 'Mary Sies Hard Drive' in paths:
+        accessions.append("Mary Sies Hard Drive: Images")
+    if "Maxine Hard Drive" in paths or "Maxine Gross Hard Drive" in paths:
+        accessions.append("Maxine Gross Hard Drive: Images")
+    if "College Park Photos" in paths:
+        accessions.append("College Park Photos")
+    if 'LCHP Accession 2021' in paths:
+        accessions.append("LCHP Accession 2021")
+    return accessions
+
+
+LOCATIONS = [
+    '',
+    'https://lakeland.umd.edu/asa/LCHP-00001',
+    'https://lakeland.umd.edu/items/show/123',
+    'https://lakeland.umd.edu/items/show/123?from=lakeland.umd.edu/asa',
+    'http://mith-lakeland-media.s3-website-us-east-1.amazonaws.com/00001.mp3',
+    'https://drive.google.com/file/d/abc/view?usp=sharing',
+    'https://lakeland.umd.edu.example.org/asa',
+    'lakeland-umd-edu/asa',
+]
+
+PATHS = [
+    '',
+    'Mary Sies Hard Drive/Church/IMG_0001.jpg',
+    'Maxine Hard Drive/IMG_0002.jpg',
+    'Maxine Gross Hard Drive/IMG_0002.jpg',
+    'Maxine  Hard Drive/IMG_0002.jpg',
+    'College Park Photos/IMG_0003.jpg',
+    'LCHP Accession 2021/IMG_0004.jpg',
+    'College Park Photos/IMG_0003.jpg, Mary Sies Hard Drive/IMG_0003.jpg',
+    '"LCHP Accession 2021/a, b.jpg",Maxine Hard Drive/a.jpg,Maxine Gross Hard Drive/a.jpg',
+    'mary sies hard drive/IMG_0005.jpg',
+]
+
+
+@pytest.mark.parametrize('location', LOCATIONS)
+@pytest.mark.parametrize('paths', PATHS)
+def test_same_as_the_substring_tests(location, paths):
+    assert match_accessions(location, paths) == old_accessions(location, paths)
+
+
+def test_missing_fields():
+    assert match_accessions(None, None) == []
+    assert match_accessions(None, 'College Park Photos/a.jpg') == ["College Park Photos"]
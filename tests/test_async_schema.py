@@ -0,0 +1,117 @@
+import time
+import asyncio
+
+import pytest
+
+import schema
+
+from async_schema import AsyncBase, AsyncClient, AsyncScheduler, async_retryable
+from fake_airtable import FakeAirtable, LAK
+
+SCHEMA = {
+    "People": {},
+    "Items": {"People": "People"}
+}
+
+
+@pytest.fixture
+def fake():
+    fake = FakeAirtable(rate=0)
+    fake.add_table(LAK, 'People', [
+        {'id': 'recPerson1', 'fields': {'Name': 'Mary Sies'}},
+        {'id': 'recPerson2', 'fields': {'Name': 'Maxine Gross'}}
+    ])
+    fake.add_table(LAK, 'Items', [
+        {'id': 'recItem{}'.format(n), 'fields': {'Title': 'Item {}'.format(n), 'People': ['recPerson1']}}
+        for n in range(25)
+    ])
+    # everything was modified long ago
+    for table in fake.bases[LAK].values():
+        for entry in table['records'].values():
+            entry['modified'] = 0
+    return fake
+
+
+def test_refresh_since(fake, endpoint):
+    async def refresh():
+        lak = await AsyncBase.open(LAK, 'fake', SCHEMA, endpoint=endpoint)
+        try:
+            people = fake.bases[LAK]['People']
+            fake.update(people, 'recPerson2', {'Name': 'Maxine E. Gross'})
+            fake.create(fake.bases[LAK]['Items'], {'Title': 'New', 'People': ['recPerson2']}, 'recNew')
+
+            changed = await lak.refresh_since(time.time() - 60)
+            return lak, changed
+        finally:
+            await lak.close()
+
+    lak, changed = asyncio.run(refresh())
+
+    assert [r['id'] for r in changed['People']] == ['recPerson2']
+    assert [r['id'] for r in changed['Items']] == ['recNew']
+    assert lak.tables['People'].find({'Name': 'Maxine E. Gross'}, first=True)['id'] == 'recPerson2'
+    new = lak.tables['Items'].get('recNew')
+    assert new['fields']['People'][0]['fields']['Name'] == 'Maxine E. Gross'
+    assert len(lak.tables['Items'].data) == 26
+
+
+def test_wipe(fake, endpoint):
+    async def wipe():
+        lak = await AsyncBase.open(LAK, 'fake', SCHEMA, endpoint=endpoint)
+        try:
+            await lak.wipe()
+            return lak
+        finally:
+            await lak.close()
+
+    lak = asyncio.run(wipe())
+
+    assert all(not table['records'] for table in fake.bases[LAK].values())
+    assert lak.tables['Items'].data == []
+    assert lak.tables['Items'].get('recItem1') is None
+
+
+def test_upsert(fake, endpoint):
+    async def upsert():
+        lak = await AsyncBase.open(LAK, 'fake', SCHEMA, endpoint=endpoint)
+        try:
+            people = lak.tables['People']
+            same = await people.upsert({'Name': 'Mary Sies'}, {'Notes': None})
+            changed = await people.upsert({'Name': 'Maxine Gross'}, {'Notes': 'Choir'})
+            new = await people.upsert({'Name': 'Violet Turner'}, {'Notes': 'Choir'})
+            return same, changed, new
+        finally:
+            await lak.close()
+
+    before = fake.bases[LAK]['People']['records']['recPerson1']['modified']
+    same, changed, new = asyncio.run(upsert())
+
+    # only what was different was sent
+    assert fake.bases[LAK]['People']['records']['recPerson1']['modified'] == before
+    assert fake.bases[LAK]['People']['records']['recPerson2']['record']['fields']['Notes'] == 'Choir'
+    assert changed['fields']['Notes'] == 'Choir'
+    assert fake.bases[LAK]['People']['records'][new['id']]['record']['fields'] == {'Name': 'Violet Turner', 'Notes': 'Choir'}
+
+
+def test_no_blocking_clients(fake, endpoint, monkeypatch):
+    # an AsyncBase doesn't make the Scheduler and Clients a Base uses
+    monkeypatch.setattr(schema, 'schedulers', {})
+
+    async def open_base():
+        lak = await AsyncBase.open(LAK, 'fake', SCHEMA, endpoint=endpoint)
+        await lak.close()
+        return lak
+
+    lak = asyncio.run(open_base())
+
+    assert schema.schedulers == {}
+    assert isinstance(lak.scheduler, AsyncScheduler)
+    assert all(type(table.airtable) is AsyncClient for table in lak.tables.values())
+
+
+def test_retryable():
+    assert async_retryable(None, 429, idempotent=False)
+    assert not async_retryable(None, 422, idempotent=True)
+    assert async_retryable(None, 503, idempotent=True)
+    assert not async_retryable(None, 503, idempotent=False)
+    assert not async_retryable(asyncio.TimeoutError(), None, idempotent=False)
@@ -0,0 +1,139 @@
+import threading
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from download import Downloader, validator_path
+
+CONTENT = bytes(range(256)) * 40
+
+
+class FileHandler(BaseHTTPRequestHandler):
+    """
+    Serves the server's content with an ETag, honouring Range and If-Range
+    the way the real hosts do, and keeps the headers of every request.
+    """
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.server.requests.append(dict(self.headers))
+        content, etag = self.server.content, self.server.etag
+        start = 0
+        ranged = self.headers.get('Range')
+        if ranged and self.headers.get('If-Range', etag) == etag:
+            start = int(ranged[len('bytes='):].rstrip('-'))
+            if start >= len(content):
+                self.send_response(416)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+        body = content[start:]
+        self.send_response(206 if start else 200)
+        self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if self.server.cut_off:
+            # the connection drops part way through
+            self.wfile.write(body[:self.server.cut_off])
+            self.server.cut_off = None
+            self.close_connection = True
+            return
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture(scope='module')
+def file_server():
+    server = ThreadingHTTPServer(('localhost', 0), FileHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+
+
+@pytest.fixture
+def server(file_server):
+    file_server.content = CONTENT
+    file_server.etag = '"v1"'
+    file_server.requests = []
+    file_server.cut_off = None
+    return file_server
+
+
+@pytest.fixture
+def url(server):
+    return 'http://localhost:{}/file.mp3'.format(server.server_port)
+
+
+def partial(tmp_path, content, validator):
+    """
+    Leave a partial download behind, as an interrupted one does.
+    """
+    part = tmp_path / 'file.mp3.part'
+    part.write_bytes(content)
+    validator_path(part).write_text(validator)
+    return part
+
+
+def test_fetch(tmp_path, server, url):
+    path = Downloader(tmp_path).fetch(url, 'file.mp3')
+
+    assert path == tmp_path / 'file.mp3'
+    assert path.read_bytes() == CONTENT
+    assert 'Range' not in server.requests[0]
+    # nothing is left over from the download
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['file.mp3']
+
+
+def test_resume(tmp_path, server, url):
+    partial(tmp_path, CONTENT[:1000], '"v1"')
+
+    path = Downloader(tmp_path).fetch(url, 'file.mp3')
+
+    assert path.read_bytes() == CONTENT
+    assert server.requests[0]['Range'] == 'bytes=1000-'
+    assert server.requests[0]['If-Range'] == '"v1"'
+
+
+def test_resume_a_file_that_changed(tmp_path, server, url):
+    # the server sends all of the new version instead of the rest of the old
+    partial(tmp_path, b'old version', '"v0"')
+
+    path = Downloader(tmp_path).fetch(url, 'file.mp3')
+
+    assert path.read_bytes() == CONTENT
+    assert server.requests[0]['If-Range'] == '"v0"'
+
+
+def test_resume_without_a_validator(tmp_path, server, url):
+    # there's no telling if the part is any good, so it isn't resumed
+    part = partial(tmp_path, b'who knows', '')
+    validator_path(part).unlink()
+
+    path = Downloader(tmp_path).fetch(url, 'file.mp3')
+
+    assert path.read_bytes() == CONTENT
+    assert 'Range' not in server.requests[0]
+
+
+def test_resume_past_the_end(tmp_path, server, url):
+    # a part that is too long gets a 416, and the download starts again
+    partial(tmp_path, CONTENT + b'extra', '"v1"')
+
+    path = Downloader(tmp_path).fetch(url, 'file.mp3')
+
+    assert path.read_bytes() == CONTENT
+    assert [r.get('Range') for r in server.requests] == ['bytes={}-'.format(len(CONTENT) + 5), None]
+
+
+def test_retry_resumes(tmp_path, server, url):
+    server.cut_off = 3000
+
+    path = Downloader(tmp_path, chunk_size=1000, backoff=0).fetch(url, 'file.mp3')
+
+    assert path.read_bytes() == CONTENT
+    assert [r.get('Range') for r in server.requests] == [None, 'bytes=3000-']
@@ -0,0 +1,111 @@
+import os
+import hashlib
+
+import pytest
+
+import schema
+
+from schema import FileStore, get_location
+
+JPEG = b'\xff\xd8\xff\xe0\x00\x10JFIF\x00\x01\x01\x00\x00\x01\x00\x01\x00\x00' + bytes(range(256)) * 64
+
+
+@pytest.fixture
+def store(tmp_path):
+    return FileStore(tmp_path / 'data')
+
+
+@pytest.fixture
+def photo(tmp_path):
+    path = tmp_path / 'IMG_0001.jpg'
+    path.write_bytes(JPEG)
+    return path
+
+
+def test_ingest(store, photo):
+    location, sha256, mimetype, size = store.ingest(photo, 'accession-1')
+
+    assert sha256 == hashlib.sha256(JPEG).hexdigest()
+    assert mimetype == 'image/jpeg'
+    assert size == len(JPEG)
+    assert location == str(get_location('accession-1', sha256, '.jpg'))
+    assert (store.root / location).read_bytes() == JPEG
+    assert store.lookup(sha256) == location
+    # no temporary files are left behind
+    assert os.listdir(store.root / 'accession-1') == [os.path.basename(location)]
+
+
+def test_ingest_same_content_again(store, photo, tmp_path):
+    location, sha256, _, _ = store.ingest(photo, 'accession-1')
+    copy = tmp_path / 'copy of IMG_0001.jpg'
+    copy.write_bytes(JPEG)
+
+    assert store.ingest(copy, 'accession-1')[:2] == (location, sha256)
+    assert os.listdir(store.root / 'accession-1') == [os.path.basename(location)]
+
+
+def test_ingest_into_another_accession(store, photo):
+    location, sha256, _, _ = store.ingest(photo, 'accession-1')
+    other, other_sha256, _, _ = store.ingest(photo, 'accession-2')
+
+    assert other_sha256 == sha256
+    assert other == str(get_location('accession-2', sha256, '.jpg'))
+    # linked rather than copied
+    assert os.path.samefile(store.root / location, store.root / other)
+
+
+def test_ingest_without_placing(store, photo, tmp_path):
+    location, sha256, _, _ = store.ingest(photo, 'accession-1')
+    copy = tmp_path / 'copy of IMG_0001.jpg'
+    copy.write_bytes(JPEG)
+
+    # content that is stored already isn't put in the other accession
+    other, _, _, size = store.ingest(copy, 'accession-2', place=False)
+    assert other == str(get_location('accession-2', sha256, '.jpg'))
+    assert not (store.root / other).exists()
+    assert not os.listdir(store.root / 'accession-2')
+
+    # read or not, until it is placed
+    assert store.ingest(copy, 'accession-2', place=False)[0] == other
+    assert not (store.root / other).exists()
+    assert store.place(sha256, other, size)
+    assert os.path.samefile(store.root / location, store.root / other)
+
+
+def test_known_sources_are_not_read_again(store, photo, monkeypatch):
+    location, sha256, mimetype, size = store.ingest(photo, 'accession-1')
+    assert store.known(photo) == (sha256, mimetype)
+
+    def read(*args, **kwargs):
+        raise AssertionError('the file was read again')
+
+    monkeypatch.setattr(schema.magic, 'from_buffer', read)
+    assert store.ingest(photo, 'accession-1') == (location, sha256, mimetype, size)
+    assert store.ingest(photo, 'accession-2')[1] == sha256
+
+
+def test_changed_sources_are_read_again(store, photo):
+    store.ingest(photo, 'accession-1')
+    photo.write_bytes(JPEG + b'more')
+    os.utime(photo, (0, 0))
+
+    assert store.known(photo) is None
+    _, sha256, _, size = store.ingest(photo, 'accession-1')
+    assert sha256 == hashlib.sha256(JPEG + b'more').hexdigest()
+    assert size == len(JPEG) + 4
+
+
+def test_lost_files_are_stored_again(store, photo):
+    location, sha256, _, _ = store.ingest(photo, 'accession-1')
+    (store.root / location).unlink()
+
+    assert store.lookup(sha256) is None
+    assert store.ingest(photo, 'accession-1')[0] == location
+    assert (store.root / location).read_bytes() == JPEG
+
+
+def test_save(store, photo):
+    sha256 = hashlib.sha256(JPEG).hexdigest()
+    location = store.save(photo, 'accession-1', sha256, '.jpg')
+    assert store.save(photo, 'accession-2', sha256, '.jpg') == str(get_location('accession-2', sha256, '.jpg'))
+    assert os.path.samefile(store.root / location, store.root / 'accession-2' / os.path.basename(location))
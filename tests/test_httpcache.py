@@ -0,0 +1,153 @@
+import json
+import threading
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import httpcache
+
+from httpcache import HttpCache
+
+
+class ApiHandler(BaseHTTPRequestHandler):
+    """
+    Answers with the server's JSON document for a path and its ETag, or a
+    304 if the client already has that version, and keeps the headers of
+    every request.
+    """
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        path = self.path.split('?')[0]
+        self.server.requests.append((path, dict(self.headers)))
+        if path not in self.server.docs:
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        etag = '"{}"'.format(self.server.versions.get(path, 1))
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+        body = json.dumps(self.server.docs[path]).encode('utf8')
+        self.send_response(200)
+        self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture(scope='module')
+def api_server():
+    server = ThreadingHTTPServer(('localhost', 0), ApiHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+
+
+@pytest.fixture
+def server(api_server):
+    api_server.docs = {'/items/1': {'id': 1}, '/items/2': {'id': 2}, '/items/3': {'id': 3}}
+    api_server.versions = {}
+    api_server.requests = []
+    return api_server
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """
+    A clock (in place of the time module) for the cache that only moves
+    when it is told to.
+    """
+    class Clock:
+        now = 1000.0
+
+        def time(self):
+            return self.now
+
+    clock = Clock()
+    monkeypatch.setattr(httpcache, 'time', clock)
+    return clock
+
+
+def url(server, path, key='secret'):
+    return 'http://localhost:{}{}?key={}'.format(server.server_port, path, key)
+
+
+def test_cached(tmp_path, server, clock):
+    cache = HttpCache(tmp_path / 'http.sqlite3')
+
+    assert cache.get_json(url(server, '/items/1')) == {'id': 1}
+    clock.now += 60
+    # the API key isn't part of what is cached
+    assert cache.get_json(url(server, '/items/1', key='other')) == {'id': 1}
+    assert len(server.requests) == 1
+    assert cache.key(url(server, '/items/1')) == url(server, '/items/1').split('?')[0]
+
+
+def test_failures_are_not_cached(tmp_path, server, clock):
+    cache = HttpCache(tmp_path / 'http.sqlite3')
+
+    assert cache.get_json(url(server, '/items/9')) is None
+    assert cache.get_json(url(server, '/items/9')) is None
+    assert len(server.requests) == 2
+    assert cache.peek_json(url(server, '/items/9')) is None
+
+
+def test_revalidate_unchanged(tmp_path, server, clock):
+    cache = HttpCache(tmp_path / 'http.sqlite3', ttl=60)
+    cache.get_json(url(server, '/items/1'))
+
+    clock.now += 61
+    assert cache.get_json(url(server, '/items/1')) == {'id': 1}
+    assert server.requests[1][1]['If-None-Match'] == '"1"'
+
+    # revalidating starts the ttl again
+    clock.now += 30
+    cache.get_json(url(server, '/items/1'))
+    assert len(server.requests) == 2
+
+
+def test_revalidate_changed(tmp_path, server, clock):
+    cache = HttpCache(tmp_path / 'http.sqlite3', ttl=60)
+    cache.get_json(url(server, '/items/1'))
+
+    server.docs['/items/1'] = {'id': 1, 'title': 'New'}
+    server.versions['/items/1'] = 2
+    clock.now += 61
+    assert cache.get_json(url(server, '/items/1')) == {'id': 1, 'title': 'New'}
+    assert cache.peek_json(url(server, '/items/1')) == {'id': 1, 'title': 'New'}
+
+
+def test_evict_least_recently_used(tmp_path, server, clock):
+    size = len(json.dumps({'id': 1}))
+    cache = HttpCache(tmp_path / 'http.sqlite3', max_size=2 * size)
+
+    cache.get_json(url(server, '/items/1'))
+    clock.now += 1
+    cache.get_json(url(server, '/items/2'))
+    clock.now += 1
+    # 1 is used again, so 2 is the one to go
+    cache.get_json(url(server, '/items/1'))
+    clock.now += 1
+    cache.get_json(url(server, '/items/3'))
+
+    assert cache.peek_json(url(server, '/items/1')) == {'id': 1}
+    assert cache.peek_json(url(server, '/items/2')) is None
+    assert cache.peek_json(url(server, '/items/3')) == {'id': 3}
+
+
+def test_sha256(tmp_path):
+    cache = HttpCache(tmp_path / 'http.sqlite3')
+    assert cache.get_sha256('https://example.org/a.mp3?key=1') is None
+
+    cache.set_sha256('https://example.org/a.mp3?key=1', 'abc')
+    assert cache.get_sha256('https://example.org/a.mp3?key=2') == 'abc'
@@ -0,0 +1,71 @@
+import time
+
+import pytest
+
+from schema import Base, same, modified_since
+from fake_airtable import FakeAirtable, LAK
+
+SCHEMA = {"People": {}, "Items": {"People": "People"}}
+
+
+@pytest.fixture
+def fake():
+    fake = FakeAirtable(rate=0)
+    fake.add_table(LAK, 'People', [
+        {'id': 'recPerson1', 'fields': {'First Name': 'Mary', 'Last Name': 'Sies'}},
+        {'id': 'recPerson2', 'fields': {'First Name': 'Maxine', 'Last Name': 'Gross'}}
+    ])
+    fake.add_table(LAK, 'Items', [
+        {'id': 'recItem1', 'fields': {'Title': 'Reunion', 'People': ['recPerson1']}}
+    ])
+    # everything was last modified an hour ago
+    for table in fake.bases[LAK].values():
+        for entry in table['records'].values():
+            entry['modified'] = time.time() - 3600
+    return fake
+
+
+def test_same():
+    assert same(None, '')
+    assert same(None, [])
+    assert not same('a', 'b')
+    assert same(
+        [{'url': 'https://dl.airtable.com/abc/transcript.pdf', 'filename': 'transcript.pdf'}],
+        [{'url': 'https://example.com/files/transcript.pdf?download=1'}]
+    )
+    assert not same(None, [{'url': 'https://example.com/transcript.pdf'}])
+
+
+def test_modified_since():
+    assert modified_since(0) == "IS_AFTER(LAST_MODIFIED_TIME(), DATETIME_PARSE('1970-01-01T00:00:00Z'))"
+
+
+def test_refresh_since(endpoint, fake):
+    lak = Base(LAK, 'fake', SCHEMA, endpoint=endpoint)
+    people = fake.bases[LAK]['People']
+    fake.update(people, 'recPerson2', {'Last Name': 'Gross-Turner'})
+    fake.create(people, {'First Name': 'Violet', 'Last Name': 'Turner'}, 'recPerson3')
+    fake.update(fake.bases[LAK]['Items'], 'recItem1', {'People': ['recPerson1', 'recPerson3']})
+
+    changed = lak.refresh_since(time.time() - 60)
+
+    assert sorted(r['id'] for r in changed['People']) == ['recPerson2', 'recPerson3']
+    assert [r['id'] for r in changed['Items']] == ['recItem1']
+
+    # the changed rows are indexed and linked like the others
+    table = lak.tables['People']
+    assert table.find({'Last Name': 'Gross'}) == []
+    assert table.find({'Last Name': 'Gross-Turner'}, first=True)['id'] == 'recPerson2'
+    assert len(table.data) == 3
+    item = lak.tables['Items'].get('recItem1')
+    assert item['fields']['People'][1]['fields']['First Name'] == 'Violet'
+
+
+def test_upsert_sends_only_changes(endpoint, fake):
+    lak = Base(LAK, 'fake', SCHEMA, endpoint=endpoint)
+    lak.tables['People'].upsert({'First Name': 'Mary'}, {'Last Name': 'Sies', 'Notes': None})
+    lak.tables['Items'].upsert({'Title': 'Reunion'}, {'People': ['recPerson1']})
+
+    # nothing was different, so nothing was modified
+    changed = lak.refresh_since(time.time() - 60)
+    assert changed == {'People': [], 'Items': []}
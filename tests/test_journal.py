@@ -0,0 +1,120 @@
+import json
+
+from journal import Journal, last_sync, save_sync, last_wipe, save_wipe
+
+
+class Buffered:
+    """
+    Stands in for a buffered Table, calling back when flush() is called.
+    """
+
+    def __init__(self):
+        self.callbacks = []
+
+    def when_flushed(self, callback):
+        self.callbacks.append(callback)
+
+    def flush(self):
+        callbacks, self.callbacks = self.callbacks, []
+        for callback in callbacks:
+            callback()
+
+
+def lines(path):
+    return [json.loads(line) for line in path.read_text().splitlines()]
+
+
+def test_resume(tmp_path):
+    path = tmp_path / 'journal.jsonl'
+    journal = Journal(path)
+    journal.record('Item', 'rec1', 'recA')
+    journal.record('File', 'rec2', ['recB', 'recC'])
+
+    journal = Journal(path)
+    assert ('Item', 'rec1') in journal
+    assert journal.get('File', 'rec2') == ['recB', 'recC']
+    assert ('Item', 'rec3') not in journal
+    assert len(journal) == 2
+
+
+def test_truncates_a_partly_written_unit(tmp_path):
+    path = tmp_path / 'journal.jsonl'
+    journal = Journal(path)
+    journal.record('Item', 'rec1', 'recA')
+    with open(path, 'a') as fh:
+        fh.write('{"kind": "Item", "key": "rec2", "val')
+
+    journal = Journal(path)
+    assert len(journal) == 1
+    journal.record('Item', 'rec3', 'recC')
+
+    assert [unit['key'] for unit in lines(path)] == ['rec1', 'rec3']
+
+
+def test_read_only(tmp_path):
+    path = tmp_path / 'journal.jsonl'
+    Journal(path).record('Item', 'rec1', 'recA')
+
+    journal = Journal(path, read_only=True)
+    journal.record('Item', 'rec2', 'recB')
+    assert ('Item', 'rec2') in journal
+    assert len(lines(path)) == 1
+
+
+def test_record_after_waits_for_flush(tmp_path):
+    journal = Journal(tmp_path / 'journal.jsonl')
+    table = Buffered()
+    record = {'id': None, 'fields': {'Title': 'Reunion'}}
+    journal.record_after(table, 'Item', 'rec1', record)
+    assert ('Item', 'rec1') not in journal
+
+    record['id'] = 'recA'
+    table.flush()
+    assert journal.get('Item', 'rec1') == 'recA'
+
+
+def test_unchanged_units_are_not_written_again(tmp_path):
+    path = tmp_path / 'journal.jsonl'
+    journal = Journal(path)
+    journal.record('Item', 'rec1', 'recA')
+    journal.record('Item', 'rec1', 'recA')
+    journal.record('Item', 'rec1', 'recB')
+    assert [unit['value'] for unit in lines(path)] == ['recA', 'recB']
+
+
+def test_generation(tmp_path):
+    path = tmp_path / 'journal.jsonl'
+    journal = Journal(path, generation=1)
+    journal.record('Item', 'rec1', 'recA')
+    assert ('Item', 'rec1') in Journal(path, generation=1)
+
+    # the base was wiped since
+    journal = Journal(path, generation=2)
+    assert len(journal) == 0
+    assert lines(path) == [{'generation': 2}]
+
+
+def test_reset(tmp_path):
+    path = tmp_path / 'journal.jsonl'
+    journal = Journal(path, generation=1)
+    journal.record('Item', 'rec1', 'recA')
+    journal.reset()
+    assert len(journal) == 0
+    assert len(Journal(path, generation=1)) == 0
+
+
+def test_sync_and_wipe_times(tmp_path):
+    syncs = tmp_path / 'sync.json'
+    wipes = tmp_path / 'wipes.json'
+    assert last_sync('migrate_lda', path=syncs) is None
+    assert last_wipe('app1', path=wipes) is None
+
+    save_wipe('app1', 100.0, path=wipes)
+    save_sync('migrate_lda', 200.0, generation=100.0, path=syncs)
+    assert last_wipe('app1', path=wipes) == 100.0
+    assert last_sync('migrate_lda', generation=100.0, path=syncs) == 200.0
+    assert last_sync('migrate_lda', generation=300.0, path=syncs) is None
+
+    # syncs saved before there were generations
+    syncs.write_text(json.dumps({'migrate_ldt': 50.0}))
+    assert last_sync('migrate_ldt', path=syncs) == 50.0
@@ -0,0 +1,111 @@
+import os
+import json
+
+import pytest
+
+import ldt_images
+
+from PIL import Image
+from ldt_images import get_orig, build_index, make_derivatives
+
+
+@pytest.fixture
+def image_root(tmp_path, monkeypatch):
+    """
+    A few LDT folders, with images in the places the real ones have them.
+    """
+    root = tmp_path / 'mith-lastclass-raw'
+    files = [
+        'abc123/Jpegs/abc123-001.jpg',
+        'abc123/abc123_002.tif',
+        'abc123/Jpegs/abc123-002.jpg',
+        'abc123/abc123-003.tif',
+        'abc123/Other/abc123-004 rescan.jpg',
+        'def456/Extra/abc123-005 copy.jpg',
+        'ghi789/Extra/abc123-005.jpg',
+    ]
+    for f in files:
+        (root / f).parent.mkdir(parents=True, exist_ok=True)
+        (root / f).write_bytes(b'')
+    monkeypatch.setattr(ldt_images, 'IMAGE_ROOT', str(root))
+    monkeypatch.setattr(ldt_images, 'index', None)
+    monkeypatch.chdir(tmp_path)
+    return root
+
+
+def test_get_orig(image_root):
+    def orig(image_id):
+        found = get_orig(image_id)
+        return os.path.relpath(found['path'], image_root) if found else None
+
+    # the images directory first, then the one above it
+    assert orig('abc123-001') == 'abc123/Jpegs/abc123-001.jpg'
+    assert orig('abc123-002') == 'abc123/Jpegs/abc123-002.jpg'
+    assert orig('abc123-003') == 'abc123/abc123-003.tif'
+    # then anywhere in the folder, and then the first folder that has it
+    assert orig('abc123-004') == 'abc123/Other/abc123-004 rescan.jpg'
+    assert orig('abc123-005') == 'def456/Extra/abc123-005 copy.jpg'
+    assert orig('abc123-006') is None
+
+
+def test_index_is_reused(image_root, monkeypatch):
+    index = build_index()
+    assert os.path.isfile(ldt_images.INDEX_PATH)
+
+    # nothing changed, so nothing is walked again
+    def index_folder(name):
+        raise AssertionError('{} was indexed again'.format(name))
+    monkeypatch.setattr(ldt_images, 'index_folder', index_folder)
+    assert build_index() == index
+
+
+def test_changed_folders_are_indexed_again(image_root, monkeypatch):
+    build_index()
+    jpegs = image_root / 'abc123' / 'Jpegs'
+    (jpegs / 'abc123-007.jpg').write_bytes(b'')
+    os.utime(jpegs, (1, 1))
+
+    indexed = []
+    index_folder = ldt_images.index_folder
+    monkeypatch.setattr(ldt_images, 'index_folder', lambda name: indexed.append(name) or index_folder(name))
+    index = build_index()
+
+    assert indexed == ['abc123']
+    assert index['folders']['abc123']['images']['abc123-007'] == str(jpegs / 'abc123-007.jpg')
+
+
+@pytest.fixture
+def originals(tmp_path):
+    Image.new('RGB', (400, 300), 'red').save(tmp_path / 'abc123-001.jpg')
+    Image.new('RGBA', (300, 400), (0, 0, 255, 128)).save(tmp_path / 'abc123-002.png')
+    return [('abc123-001', str(tmp_path / 'abc123-001.jpg')), ('abc123-002', str(tmp_path / 'abc123-002.png'))]
+
+
+def test_make_derivatives(originals, tmp_path):
+    out = tmp_path / 'static'
+    summary = make_derivatives(originals, sizes=(200, 100), formats=('png', 'jpg'), out_dir=str(out), workers=1)
+
+    assert summary['png']['images'] == summary['jpg']['images'] == 4
+    with Image.open(out / 'abc123-001-200.png') as img:
+        assert img.size == (200, 150)
+    with Image.open(out / 'abc123-002-100.jpg') as img:
+        assert img.size == (75, 100) and img.mode == 'RGB'
+    # transparency is kept where the format can keep it
+    with Image.open(out / 'abc123-002-200.png') as img:
+        assert img.mode == 'RGBA'
+
+    manifest = json.loads((out / 'manifest.json').read_text())
+    assert sorted(manifest['abc123-001']['outputs']) == [
+        'abc123-001-100.jpg', 'abc123-001-100.png', 'abc123-001-200.jpg', 'abc123-001-200.png'
+    ]
+
+
+def test_only_changes_are_made_again(originals, tmp_path):
+    out = str(tmp_path / 'static')
+    make_derivatives(originals, sizes=(100,), formats=('png',), out_dir=out, workers=1)
+    assert make_derivatives(originals, sizes=(100,), formats=('png',), out_dir=out, workers=1) == {}
+
+    # a new size, and an original that changed
+    Image.new('RGB', (400, 300), 'green').save(originals[0][1])
+    summary = make_derivatives(originals, sizes=(100, 50), formats=('png',), out_dir=out, workers=1)
+    assert summary['png']['images'] == 3
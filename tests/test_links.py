@@ -0,0 +1,72 @@
+import pytest
+
+from schema import Base, Link, link_id
+from fake_airtable import FakeAirtable, LAK
+
+SCHEMA = {"People": {}, "Items": {"People": "People"}}
+
+
+@pytest.fixture
+def fake():
+    fake = FakeAirtable(rate=0)
+    fake.add_table(LAK, 'People', [
+        {'id': 'recPerson1', 'fields': {'First Name': 'Mary', 'Last Name': 'Sies'}},
+        {'id': 'recPerson2', 'fields': {'First Name': 'Maxine', 'Last Name': 'Gross'}}
+    ])
+    fake.add_table(LAK, 'Items', [
+        {'id': 'recItem1', 'fields': {'Title': 'Reunion', 'People': ['recPerson1', 'recPerson2', 'recGone']}}
+    ])
+    return fake
+
+
+@pytest.fixture
+def lak(endpoint):
+    return Base(LAK, 'fake', SCHEMA, endpoint=endpoint)
+
+
+class Loading:
+    """
+    Stands in for a Table that is still loading: its ids aren't all there
+    yet, but get() waits until they are.
+    """
+
+    table_name = 'People'
+    ids = {}
+
+    def get(self, id):
+        return {'id': id, 'fields': {'First Name': 'Mary'}}
+
+
+def test_links_resolve(lak):
+    people = lak.tables['Items'].get('recItem1')['fields']['People']
+    mary, maxine, gone = people
+
+    assert all(isinstance(link, Link) for link in people)
+    assert mary['fields']['First Name'] == 'Mary'
+    assert maxine.get('fields')['Last Name'] == 'Gross'
+    assert 'fields' in mary
+    assert mary.resolve() is lak.tables['People'].get('recPerson1')
+
+    # a link to a record that isn't there is false, and has no fields
+    assert mary and maxine and not gone
+    assert gone['id'] == 'recGone'
+    assert gone.get('fields') is None
+    with pytest.raises(KeyError):
+        gone['fields']
+
+
+def test_links_compare_like_ids(lak):
+    mary = lak.tables['Items'].get('recItem1')['fields']['People'][0]
+
+    assert mary == 'recPerson1'
+    assert mary == lak.tables['People'].get('recPerson1')
+    assert mary == Link(lak.tables['People'], 'recPerson1')
+    assert mary in {'recPerson1'}
+    assert link_id(mary) == 'recPerson1'
+    assert lak.tables['Items'].raw(lak.tables['Items'].get('recItem1'))['fields']['People'] == [
+        'recPerson1', 'recPerson2', 'recGone'
+    ]
+
+
+def test_link_to_a_table_that_is_loading():
+    assert Link(Loading(), 'recPerson1')
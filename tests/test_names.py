@@ -0,0 +1,34 @@
+import pytest
+
+from schema import parse_name, warm_name_cache, person_fields
+
+
+@pytest.mark.parametrize('name, parts', [
+    ('Mary', ('Mary', None, None, None)),
+    ('Mary Smith', ('Mary', None, 'Smith', None)),
+    ('Mary J. Smith', ('Mary', 'J.', 'Smith', None)),
+    ('Mary Jane Ann Smith', ('Mary', 'Jane Ann', 'Smith', None)),
+    ('John Smith Jr.', ('John', None, 'Smith', 'Jr.')),
+    ('John Q. Smith III', ('John', 'Q.', 'Smith', 'III')),
+])
+def test_parse_name(name, parts):
+    assert parse_name(name) == parts
+
+
+def test_person_fields_with_a_middle_name():
+    # the parts are (first, middle, last, suffix), not (first, last, ...)
+    assert person_fields('Violet M. Jones Sr.') == {
+        "First Name": 'Violet',
+        "Middle Name": 'M.',
+        "Last Name": 'Jones',
+        "Suffix Name": 'Sr.'
+    }
+
+
+def test_warm_name_cache():
+    parse_name.cache_clear()
+    assert warm_name_cache(['Ruth Hall', None, '', 'Ruth Hall', 'George King']) is None
+    assert parse_name.cache_info().currsize == 2
+
+    person_fields('Ruth Hall')
+    assert parse_name.cache_info().hits == 1
@@ -0,0 +1,71 @@
+import time
+import threading
+
+import pytest
+
+from pipeline import Pipeline
+
+
+def test_jobs_go_through_every_stage():
+    written = []
+    p = Pipeline([
+        (lambda job: job + [1], 4),
+        (lambda job: job + [2], 2),
+        (lambda job: written.append(job), 1)
+    ])
+    for n in range(50):
+        p.put([n])
+    p.join()
+
+    assert sorted(written) == [[n, 1, 2] for n in range(50)]
+
+
+def test_dropped_jobs():
+    written = []
+    p = Pipeline([(lambda n: n if n % 2 else None, 2), (written.append, 1)])
+    for n in range(10):
+        p.put(n)
+    p.join()
+
+    assert sorted(written) == [1, 3, 5, 7, 9]
+
+
+def test_stages_overlap():
+    # a slow stage with more workers keeps the others busy
+    active = []
+    most = [0]
+    lock = threading.Lock()
+
+    def slow(job):
+        with lock:
+            active.append(job)
+            most[0] = max(most[0], len(active))
+        time.sleep(0.05)
+        with lock:
+            active.remove(job)
+        return job
+
+    p = Pipeline([(slow, 4), (lambda job: job, 1)])
+    for n in range(8):
+        p.put(n)
+    p.join()
+
+    assert most[0] == 4
+
+
+def test_error():
+    done = []
+
+    def fail(n):
+        if n == 3:
+            raise ValueError('bad job')
+        return n
+
+    p = Pipeline([(fail, 1), (done.append, 1)])
+    for n in range(10):
+        p.put(n)
+    with pytest.raises(ValueError, match='bad job'):
+        p.join()
+
+    # the jobs after the one that failed are drained, not processed
+    assert 3 not in done and len(done) < 10
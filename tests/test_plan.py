@@ -0,0 +1,157 @@
+import pytest
+
+from journal import Journal
+from plan import Plan, swap, placeholders
+from schema import Base
+from fake_airtable import FakeAirtable, LAK
+
+SCHEMA = {"Accessions": {}, "Files": {}, "People": {}, "Items": {}}
+
+
+@pytest.fixture
+def fake():
+    fake = FakeAirtable(rate=0)
+    fake.add_table(LAK, 'Accessions', [{'id': 'recAccession1', 'fields': {'Description': 'LCHP Accession 2021'}}])
+    fake.add_table(LAK, 'Files', [{'id': 'recFile1', 'fields': {'SHA256': 'abc', 'Size': 10}}])
+    fake.add_table(LAK, 'People', [{'id': 'recPerson1', 'fields': {'Name': 'Mary Sies'}}])
+    fake.add_table(LAK, 'Items', [])
+    return fake
+
+
+def records(fake, table_name):
+    return [entry['record'] for entry in fake.bases[LAK][table_name]['records'].values()]
+
+
+def make_plan(endpoint):
+    """
+    Plan an item with a new person, an existing one and a file that is read
+    from a source, the way migrate_lda does.
+    """
+    plan = Plan()
+    lak = Base(LAK, 'fake', SCHEMA, buffered=True, endpoint=endpoint, plan=plan)
+    plan.meta = {"id": "test", "fingerprint": lak.fingerprint()}
+
+    maxine = lak.tables['People'].get_or_insert({'Name': 'Maxine Gross'})
+    mary = lak.tables['People'].get_or_insert({'Name': 'Mary Sies'})
+    with plan.reading({"file": "recLDA1", "accession": "recAccession1"}):
+        afile = lak.tables['Files'].insert({'Accession': ['recAccession1'], 'Size': 20})
+    item = lak.tables['Items'].insert({'Title': 'Reunion', 'People': [maxine['id'], mary['id']], 'Files': [afile['id']]})
+    lak.tables['People'].update(mary['id'], {'Notes': 'In the choir'})
+
+    plan.unit('Files', 'File', 'recLDA1', [afile['id']])
+    plan.unit('Items', 'Item', 'recLDAItem1', item['id'])
+    return plan
+
+
+class Reader:
+    """
+    Reads a source by adding a Files record for it, like migrate_lda's
+    read_source().
+    """
+
+    def __init__(self, lak):
+        self.lak = lak
+        self.sources = []
+
+    def __call__(self, source):
+        self.sources.append(source)
+        return [self.lak.tables['Files'].insert({'Accession': [source['accession']], 'Size': 21})]
+
+
+def test_dry_run(endpoint, fake):
+    plan = make_plan(endpoint)
+
+    assert list(plan.inserts['People']) == ['plan:People:1']
+    assert plan.inserts['Items']['plan:Items:1']['fields']['People'] == ['plan:People:1', 'recPerson1']
+    assert plan.inserts['Files']['plan:Files:1']['source'] == {"file": "recLDA1", "accession": "recAccession1"}
+    assert plan.updates['People'] == {'recPerson1': {'Notes': 'In the choir'}}
+    assert plan.summary()['tables']['People'] == {'inserts': 1, 'updates': 1, 'merges': 0}
+    # nothing was written
+    assert len(records(fake, 'People')) == 1
+
+
+def test_save_and_load(endpoint, tmp_path):
+    plan = make_plan(endpoint)
+    plan.save(tmp_path / 'plan.json')
+    loaded = Plan.load(tmp_path / 'plan.json')
+
+    assert loaded.meta == plan.meta
+    assert loaded.inserts == plan.inserts
+    assert loaded.updates == plan.updates
+    assert loaded.sources == plan.sources
+    assert loaded.units == plan.units
+
+
+def test_order():
+    plan = Plan()
+    person = plan.insert('People', {'Name': 'Maxine Gross'})
+    afile = plan.insert('Files', {'Size': 20})
+    plan.insert('Items', {'People': [person], 'Files': [afile]})
+    plan.insert('Accessions', {'Description': 'LCHP Accession 2021'})
+    assert plan.order() == ['Accessions', 'Files', 'People', 'Items']
+
+    plan.update('People', person, {'Items': ['plan:Items:1']})
+    with pytest.raises(ValueError):
+        plan.order()
+
+
+def test_swap():
+    found = {'plan:People:1': [{'id': 'recA'}], 'plan:Files:1': [{'id': 'recB'}, {'id': 'recC'}], 'plan:Files:2': []}
+    fields = {'People': ['plan:People:1', 'recPerson1'], 'Files': ['plan:Files:1', 'plan:Files:2'], 'Title': 'Reunion'}
+
+    assert swap(fields, found.get) == {'People': ['recA', 'recPerson1'], 'Files': ['recB', 'recC'], 'Title': 'Reunion'}
+    # placeholders that turn into the same record are only linked once
+    assert swap(['plan:Files:1', 'plan:Files:1'], found.get) == ['recB', 'recC']
+    assert sorted(placeholders(fields)) == ['plan:Files:1', 'plan:Files:2', 'plan:People:1']
+
+
+def test_execute(endpoint, fake, tmp_path):
+    plan = make_plan(endpoint)
+    lak = Base(LAK, 'fake', SCHEMA, buffered=True, endpoint=endpoint)
+    read = Reader(lak)
+    journal = Journal(tmp_path / 'journal.jsonl')
+
+    plan.execute(lak, read, journal)
+    lak.flush()
+
+    assert read.sources == [{"file": "recLDA1", "accession": "recAccession1"}]
+    people = {r['fields']['Name']: r for r in records(fake, 'People')}
+    assert people['Mary Sies']['fields']['Notes'] == 'In the choir'
+    afile = next(r for r in records(fake, 'Files') if r['fields'].get('Size') == 21)
+    [item] = records(fake, 'Items')
+    assert item['fields']['People'] == [people['Maxine Gross']['id'], 'recPerson1']
+    assert item['fields']['Files'] == [afile['id']]
+
+    assert journal.get('File', 'recLDA1') == [afile['id']]
+    assert journal.get('Item', 'recLDAItem1') == item['id']
+
+
+def test_execute_again(endpoint, fake, tmp_path):
+    plan = make_plan(endpoint)
+    path = tmp_path / 'journal.jsonl'
+    lak = Base(LAK, 'fake', SCHEMA, buffered=True, endpoint=endpoint)
+    plan.execute(lak, Reader(lak), Journal(path))
+    lak.flush()
+    [person] = [r for r in records(fake, 'People') if r['fields']['Name'] == 'Maxine Gross']
+
+    # what was written is used instead of being written again, unless it was
+    # removed since
+    fake.delete(fake.bases[LAK]['Items'], records(fake, 'Items')[0]['id'])
+    lak = Base(LAK, 'fake', SCHEMA, buffered=True, endpoint=endpoint)
+    read = Reader(lak)
+    plan.execute(lak, read, Journal(path))
+    lak.flush()
+
+    assert read.sources == []
+    assert len(records(fake, 'People')) == 2
+    assert len(records(fake, 'Files')) == 2
+    [item] = records(fake, 'Items')
+    assert item['fields']['People'] == [person['id'], 'recPerson1']
+    assert Journal(path).get('Item', 'recLDAItem1') == item['id']
+
+
+def test_wiping_is_not_planned(endpoint, fake):
+    lak = Base(LAK, 'fake', SCHEMA, buffered=True, endpoint=endpoint, plan=Plan())
+    with pytest.raises(ValueError, match='cannot delete 1 records from People'):
+        lak.tables['People'].wipe()
+    assert len(records(fake, 'People')) == 1
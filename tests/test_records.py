@@ -0,0 +1,55 @@
+import sys
+
+import pytest
+
+from schema import Base, Record, make_record
+from fake_airtable import FakeAirtable, LDA
+
+SCHEMA = {"Items": {"Files": "Files"}, "Files": {}}
+
+
+@pytest.fixture
+def fake():
+    fake = FakeAirtable(rate=0)
+    fake.add_table(LDA, 'Files', [
+        {'id': 'recFile1', 'fields': {'File Path': 'College Park Photos/a.jpg', 'Size': 10, 'Notes': 'x' * 500}}
+    ])
+    fake.add_table(LDA, 'Items', [
+        {'id': 'recItem{}'.format(n), 'fields': {'Title': 'Item {}'.format(n), 'Description': 'Long', 'Files': ['recFile1']}}
+        for n in range(3)
+    ])
+    return fake
+
+
+def test_record():
+    r = make_record({'id': 'recFile1', 'fields': {'Format': 'image/jpeg', 'Tags': ['a', 'b']}, 'createdTime': '2021-01-01T00:00:00.000Z'})
+
+    assert isinstance(r, Record)
+    assert r['id'] == 'recFile1' and r.get('createdTime') == '2021-01-01T00:00:00.000Z'
+    assert r['fields']['Format'] == 'image/jpeg'
+    assert 'fields' in r and 'other' not in r
+    assert r.get('other', 1) == 1
+    with pytest.raises(KeyError):
+        r['other']
+    r['fields'] = {'Size': 1}
+    assert r['fields'] == {'Size': 1}
+
+
+def test_short_strings_are_shared():
+    long = ''.join(['x'] * 500)
+    a = make_record({'id': 'rec1', 'fields': {'Format': ''.join(['image/', 'jpeg']), 'Notes': long}})
+    b = make_record({'id': 'rec2', 'fields': {'Format': ''.join(['image', '/jpeg']), 'Notes': long[:]}})
+
+    assert a['fields']['Format'] is b['fields']['Format'] is sys.intern('image/jpeg')
+    assert list(a['fields'])[0] is list(b['fields'])[0]
+
+
+def test_only_the_fields_used_are_fetched(endpoint):
+    lda = Base(LDA, 'fake', SCHEMA, endpoint=endpoint, fields={'Items': ['Title'], 'Files': ['Size']})
+
+    # links are always fetched
+    assert lda.tables['Items'].fields == ['Files', 'Title']
+    item = lda.tables['Items'].get('recItem1')
+    assert item['fields'] == {'Title': 'Item 1', 'Files': ['recFile1']}
+    assert item['fields']['Files'][0]['fields'] == {'Size': 10}
+
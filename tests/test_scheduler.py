@@ -0,0 +1,106 @@
+import pytest
+import requests
+
+from urllib3.exceptions import MaxRetryError, NewConnectionError, ReadTimeoutError
+
+from schema import Scheduler, retryable, not_sent
+
+
+def http_error(status):
+    response = requests.Response()
+    response.status_code = status
+    return requests.exceptions.HTTPError('{} error'.format(status), response=response)
+
+
+def connect_failed():
+    reason = NewConnectionError(None, 'Connection refused')
+    return requests.exceptions.ConnectionError(MaxRetryError(None, '/v0/app/Items', reason))
+
+
+def connection_dropped():
+    reason = ReadTimeoutError(None, '/v0/app/Items', 'Read timed out')
+    return requests.exceptions.ConnectionError(MaxRetryError(None, '/v0/app/Items', reason))
+
+
+def test_not_sent():
+    assert not_sent(requests.exceptions.ConnectTimeout())
+    assert not_sent(connect_failed())
+    assert not not_sent(connection_dropped())
+    assert not not_sent(requests.exceptions.ReadTimeout())
+    assert not not_sent(http_error(500))
+
+
+@pytest.mark.parametrize('error, status, idempotent, expected', [
+    (http_error(429), 429, False, True),
+    (http_error(422), 422, True, False),
+    (http_error(404), 404, True, False),
+    (http_error(500), 500, True, True),
+    (http_error(503), 503, False, False),
+    (connection_dropped(), None, True, True),
+    (connection_dropped(), None, False, False),
+    (requests.exceptions.ReadTimeout(), None, False, False),
+    (connect_failed(), None, False, True),
+    (requests.exceptions.ConnectTimeout(), None, False, True),
+])
+def test_retryable(error, status, idempotent, expected):
+    assert retryable(error, status, idempotent) == expected
+
+
+class Flaky:
+    """
+    A request that fails with the given errors before it succeeds.
+    """
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return {'records': []}
+
+
+@pytest.fixture
+def scheduler():
+    return Scheduler(rate=1000, burst=1000, retries=3, backoff=0, penalty=0)
+
+
+def test_retries_throttled_inserts(scheduler):
+    func = Flaky(http_error(429), http_error(429))
+    assert scheduler.call(func, idempotent=False) == {'records': []}
+    assert func.calls == 3
+    assert scheduler.throttled == 2
+
+
+def test_retries_server_errors_when_idempotent(scheduler):
+    func = Flaky(http_error(502), connection_dropped())
+    assert scheduler.call(func) == {'records': []}
+    assert func.calls == 3
+
+
+def test_does_not_resend_inserts_that_may_have_arrived(scheduler):
+    func = Flaky(http_error(502))
+    with pytest.raises(requests.exceptions.HTTPError):
+        scheduler.call(func, idempotent=False)
+    assert func.calls == 1
+
+    func = Flaky(connection_dropped())
+    with pytest.raises(requests.exceptions.ConnectionError):
+        scheduler.call(func, idempotent=False)
+    assert func.calls == 1
+
+
+def test_resends_inserts_that_never_connected(scheduler):
+    func = Flaky(connect_failed())
+    assert scheduler.call(func, idempotent=False) == {'records': []}
+    assert func.calls == 2
+
+
+def test_gives_up(scheduler):
+    func = Flaky(*[http_error(503)] * 5)
+    with pytest.raises(requests.exceptions.HTTPError):
+        scheduler.call(func)
+    assert func.calls == 4
+    assert scheduler.retried == 3
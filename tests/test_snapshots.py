@@ -0,0 +1,67 @@
+import pytest
+
+from schema import Base
+from fake_airtable import FakeAirtable, LDA
+
+SCHEMA = {"Items": {"Files": "Files"}, "Files": {}}
+
+
+@pytest.fixture
+def fake():
+    fake = FakeAirtable(rate=0)
+    fake.add_table(LDA, 'Files', [{'id': 'recFile1', 'fields': {'File Path': 'College Park Photos/a.jpg', 'Size': 10}}])
+    fake.add_table(LDA, 'Items', [{'id': 'recItem1', 'fields': {'Title': 'Reunion', 'Files': ['recFile1']}}])
+    return fake
+
+
+def open_lda(endpoint, snapshot_dir, schema=SCHEMA, **kwargs):
+    return Base(LDA, 'fake', schema, endpoint=endpoint, snapshot_dir=snapshot_dir, snapshot_ttl=60, **kwargs)
+
+
+def rename(fake, title):
+    fake.update(fake.bases[LDA]['Items'], 'recItem1', {'Title': title})
+
+
+def title(lda):
+    return lda.tables['Items'].get('recItem1')['fields']['Title']
+
+
+def test_snapshot_is_reused(endpoint, fake, tmp_path):
+    lda = open_lda(endpoint, tmp_path)
+    assert len(lda.snapshots()) == 1
+    rename(fake, 'Picnic')
+
+    again = open_lda(endpoint, tmp_path)
+    assert title(again) == 'Reunion'
+    assert again.fetched == int(lda.fetched)
+    # it is linked like a fetched base
+    assert again.tables['Items'].get('recItem1')['fields']['Files'][0]['fields']['Size'] == 10
+
+
+def test_refresh(endpoint, fake, tmp_path):
+    open_lda(endpoint, tmp_path)
+    rename(fake, 'Picnic')
+
+    assert title(open_lda(endpoint, tmp_path, refresh=True)) == 'Picnic'
+    # the new snapshot replaces the old one
+    assert len(open_lda(endpoint, tmp_path).snapshots()) == 1
+
+
+def test_stale_snapshot(endpoint, fake, tmp_path):
+    lda = open_lda(endpoint, tmp_path)
+    fetched, path = lda.snapshots()[0]
+    path.rename(path.with_name('{}-{}.jsonl.gz'.format(LDA, fetched - 120)))
+    rename(fake, 'Picnic')
+
+    assert title(open_lda(endpoint, tmp_path)) == 'Picnic'
+
+
+def test_snapshot_with_other_tables_or_fields(endpoint, fake, tmp_path):
+    open_lda(endpoint, tmp_path, schema={"Files": {}})
+    rename(fake, 'Picnic')
+    assert title(open_lda(endpoint, tmp_path)) == 'Picnic'
+
+    rename(fake, 'Parade')
+    lda = open_lda(endpoint, tmp_path, fields={'Items': ['Title']})
+    assert title(lda) == 'Parade'
+    assert lda.tables['Items'].fields == ['Files', 'Title']
@@ -0,0 +1,38 @@
+import pytest
+
+from schema import Base
+from fake_airtable import FakeAirtable, LDA
+
+SCHEMA = {"Items": {"Files": "Files"}, "Files": {}}
+
+
+@pytest.fixture
+def fake():
+    fake = FakeAirtable(rate=0)
+    fake.add_table(LDA, 'Files', [{'id': 'recFile1', 'fields': {'Size': 10}}])
+    # more than a page of items
+    fake.add_table(LDA, 'Items', [
+        {'id': 'recItem{}'.format(n), 'fields': {'Title': 'Item {}'.format(n), 'Files': ['recFile1']}}
+        for n in range(250)
+    ])
+    return fake
+
+
+def test_stream(endpoint):
+    lda = Base(LDA, 'fake', SCHEMA, endpoint=endpoint, stream=['Items'])
+
+    titles = [item['fields']['Title'] for item in lda.tables['Items'].stream()]
+    assert titles == ['Item {}'.format(n) for n in range(250)]
+    # the streamed records are linked, and the table can be used afterwards
+    assert lda.tables['Items'].get('recItem5')['fields']['Files'][0]['fields']['Size'] == 10
+    assert len(lda.tables['Items'].data) == 250
+
+
+def test_abandoned_stream(endpoint):
+    lda = Base(LDA, 'fake', SCHEMA, endpoint=endpoint, stream=['Items'])
+
+    stream = lda.tables['Items'].stream()
+    next(stream)
+    stream.close()
+    with pytest.raises(RuntimeError, match='only partly streamed'):
+        lda.tables['Items'].data
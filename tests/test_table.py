@@ -0,0 +1,79 @@
+import pytest
+
+from schema import Base
+from fake_airtable import FakeAirtable, LAK
+
+SCHEMA = {"People": {}, "Items": {"People": "People"}}
+
+
+@pytest.fixture
+def fake():
+    fake = FakeAirtable(rate=0)
+    fake.add_table(LAK, 'People', [
+        {'id': 'recPerson1', 'fields': {'First Name': 'Mary', 'Last Name': 'Sies'}},
+        {'id': 'recPerson2', 'fields': {'First Name': 'Maxine', 'Last Name': 'Gross'}},
+        {'id': 'recPerson3', 'fields': {'First Name': 'Mary', 'Last Name': 'Gross'}}
+    ])
+    fake.add_table(LAK, 'Items', [
+        {'id': 'recItem1', 'fields': {'Title': 'Reunion', 'People': ['recPerson1', 'recPerson2']}}
+    ])
+    return fake
+
+
+@pytest.fixture(params=[False, True], ids=['unbuffered', 'buffered'])
+def lak(request, endpoint):
+    return Base(LAK, 'fake', SCHEMA, buffered=request.param, endpoint=endpoint)
+
+
+def test_find(lak):
+    people = lak.tables['People']
+    assert [r['id'] for r in people.find({'First Name': 'Mary'})] == ['recPerson1', 'recPerson3']
+    assert people.find({'First Name': 'Mary', 'Last Name': 'Gross'}, first=True)['id'] == 'recPerson3'
+    assert people.find({'First Name': 'Violet'}) == []
+    # a missing field only matches None
+    assert people.find({'Suffix': None, 'Last Name': 'Sies'}, first=True)['id'] == 'recPerson1'
+    assert set(people.indexes) == {('First Name',), ('First Name', 'Last Name'), ('Last Name', 'Suffix')}
+
+
+def test_find_links(lak):
+    items = lak.tables['Items']
+    # lists of links are indexed by their ids
+    assert items.find({'People': ['recPerson1', 'recPerson2']}, first=True)['id'] == 'recItem1'
+    item = items.get('recItem1')
+    assert item['fields']['People'][1]['fields']['First Name'] == 'Maxine'
+
+
+def test_get_or_insert(lak, fake):
+    people = lak.tables['People']
+    assert people.get_or_insert({'First Name': 'Mary', 'Last Name': 'Sies'})['id'] == 'recPerson1'
+
+    violet = people.get_or_insert({'First Name': 'Violet', 'Last Name': 'Turner'}, {'Notes': 'Choir'})
+    again = people.get_or_insert({'First Name': 'Violet', 'Last Name': 'Turner'})
+    assert again is violet
+    lak.flush()
+
+    assert violet['id'] in fake.bases[LAK]['People']['records']
+    assert violet['fields']['Notes'] == 'Choir'
+    assert len(fake.bases[LAK]['People']['records']) == 4
+
+
+def test_update_reindexes(lak):
+    people = lak.tables['People']
+    people.find({'Last Name': 'Gross'})
+    people.update('recPerson3', {'Last Name': 'Gaines'})
+    lak.flush()
+
+    assert [r['id'] for r in people.find({'Last Name': 'Gross'})] == ['recPerson2']
+    assert people.find({'Last Name': 'Gaines'}, first=True)['id'] == 'recPerson3'
+
+
+def test_upsert(lak, fake):
+    people = lak.tables['People']
+    people.upsert({'First Name': 'Maxine'}, {'Last Name': 'Gross', 'Notes': 'Historian'})
+    people.upsert({'First Name': 'Ruth'}, {'Last Name': 'Harris'})
+    lak.flush()
+
+    records = fake.bases[LAK]['People']['records']
+    assert records['recPerson2']['record']['fields']['Notes'] == 'Historian'
+    assert len(records) == 4
+